@@ -24,7 +24,8 @@ syntax:
 
     pcr2netcdf -S date -E date -N mapstackname -I mapstack_folder
                -O netcdf_name [-b buffersize] [-c inifile][-s start][-d digit][-Y][-P EPSG]
-               [-i inputformat][-F netcdfformat]
+               [-i inputformat][-F netcdfformat][-L complevel][-k chunktime]
+               [-w workers][-p]
 
     For single maps (no series)
     pcr2netcdf -M -S date  -N mapname
@@ -51,6 +52,14 @@ syntax:
     -d least_significant_digit (set precision for more compression)
     -c inifile (contains netcdf meta data)
     -C clonemap.map use maps as mask and clone
+    -L complevel - zlib compression level (default = 9)
+    -k chunktime - number of timesteps in a netcdf chunk (default = 1)
+    -w workers - number of threads that read the maps (default = 4)
+    -p use worker processes instead of threads to read the maps
+
+All mapstacks given with -N are converted in one pass: the maps of all
+mapstacks are read by the workers while the previous block of timesteps is
+written.
 
 This utility is made to simplify running wflow models with OpenDA. The
 OpenDA link needs the forcing timeseries to be in netcdf format. Use this to convert
@@ -68,6 +77,7 @@ based on GLOFRIS_utils.py by H Winsemius
 import time
 import datetime as dt
 import getopt
+import concurrent.futures
 import sys
 from numpy import *
 import numpy as np
@@ -264,15 +274,59 @@ def getvarmetadatafromini(inifile, var):
     return metadata
 
 
-def write_netcdf_timeseries(
+def mapstack_file(srcPrefix, count):
+    """
+    Returns the file name of map number count in a PCRaster mapstack,
+    e.g. P0000001.001 for count 1001 and prefix P
+    """
+    # if necessary, make trgPrefix maximum of 8 characters
+    if len(srcPrefix) > 8:
+        srcPrefix = srcPrefix[0:8]
+    return str(srcPrefix + "%0" + str(8 - len(srcPrefix)) + "d.%03d") % (
+        count // 1000,
+        count % 1000,
+    )
+
+
+_reader = {}
+
+
+def _init_reader(clone):
+    """
+    Stores the clone in the (worker) process that reads the maps
+    """
+    _reader["clone"] = clone
+
+
+def _read_step(task):
+    """
+    Read one map of a mapstack and set all missing values to the netcdf
+    fill value. Runs in the thread or process pool of write_netcdf_mapstacks.
+
+    :param task: tuple of (pcraster_path, nc_Fill)
+    :return: float32 array
+    """
+    pcraster_path, nc_Fill = task
+    logger = logging.getLogger("pcr2netcdf")
+    clone = _reader["clone"]
+    logger.debug("processing map: " + pcraster_path)
+    x, y, data, FFillVal = _readMap(pcraster_path, "PCRaster", logger)
+
+    data[data == FFillVal] = nc_Fill
+    data[isinf(data)] = nc_Fill
+    data[isnan(data)] = nc_Fill
+    data[clone <= -999] = nc_Fill
+    data[clone == FFillVal] = nc_Fill
+
+    return data.astype(np.float32)
+
+
+def write_netcdf_mapstacks(
     srcFolder,
-    srcPrefix,
+    mapstacks,
     trgFile,
-    trgVar,
     trgUnits,
-    trgName,
     timeList,
-    metadata,
     logger,
     clone,
     maxbuf=600,
@@ -282,140 +336,195 @@ def write_netcdf_timeseries(
     startidx=0,
     EPSG="EPSG:4326",
     FillVal=1e31,
+    complevel=9,
+    chunktime=1,
+    workers=4,
+    processes=False,
 ):
     """
-    Write pcraster mapstack to netcdf file. Taken from GLOFRIS_Utils.py
-    
-    - srcFolder - Folder with pcraster mapstack
-    - srcPrefix - name of the mapstack
+    Write one or more pcraster mapstacks to a netcdf file.
+
+    The maps are decoded by a pool of workers while this process writes
+    the previous block of time steps, so reading, decoding and compression overlap.
+    All mapstacks are read in the same pass and written to their own variable.
+    Blocks start at a multiple of the buffer size, which is a multiple of the
+    chunk size so each write covers whole chunks.
+
+    - srcFolder - Folder with pcraster mapstacks
+    - mapstacks - list of (srcPrefix, trgVar, trgName, metadata) tuples, one for each mapstack
     - trgFile - target netcdf file
-    - tgrVar - variable in nc file
     - trgUnits - units for the netcdf file
     - timeLists - list of times
-    - metadata - dict with metedata for var
 
-    Optional argumenrs
+    Optional arguments
     - maxbuf = 600: number of timesteps to buffer before writing
-    
+    - complevel = 9: zlib compression level
+    - chunktime = 1: number of timesteps in a netcdf chunk
+    - workers = 4: number of threads (or processes) that read the maps
+    - processes = False: use a process pool instead of a thread pool
     """
-    complevel = 9
-
-    # if necessary, make trgPrefix maximum of 8 characters
-    if len(srcPrefix) > 8:
-        srcPrefix = srcPrefix[0:8]
     # Open target netCDF file
     nc_trg = nc4.Dataset(trgFile, "a", format=Format)
-    # read time axis and convert to time objects
-    logger.debug("Creating time object..")
+    # look up the position of all times in the time axis at once
+    logger.debug("Creating time index..")
     time = nc_trg.variables["time"]
     nc_trg.set_fill_off()
-    timeObj = cftime.num2date(time[:], units=time.units, calendar=time.calendar)
+    times = np.asarray(time[:])
+    timenum = cftime.date2num(timeList, units=time.units, calendar=time.calendar)
+    timeidx = np.minimum(np.searchsorted(times, timenum), len(times) - 1)
+    if np.any(times[timeidx] != timenum):
+        nc_trg.close()
+        raise ValueError("Not all times of the mapstack are in " + trgFile)
 
-    try:
-        nc_var = nc_trg.variables[trgVar]
-    except:
-        # prepare the variable
+    if len(shape(nc_trg.variables["lat"])) == 2:
+        latlen = shape(nc_trg.variables["lat"])[0]
+        lonlen = shape(nc_trg.variables["lon"])[1]
+    else:
+        latlen = len(nc_trg.variables["lat"])
+        lonlen = len(nc_trg.variables["lon"])
 
-        if EPSG.lower() == "epsg:4326":
-            nc_var = nc_trg.createVariable(
-                trgVar,
-                "f4",
-                ("time", "lat", "lon"),
-                fill_value=FillVal,
-                zlib=zlib,
-                complevel=complevel,
-                least_significant_digit=least_significant_digit,
-            )
-            nc_var.coordinates = "lat lon"
-        else:
+    if EPSG.lower() == "epsg:4326":
+        dims = ("time", "lat", "lon")
+    else:
+        dims = ("time", "y", "x")
+    if Format.startswith("NETCDF4"):
+        chunksizes = (chunktime, latlen, lonlen)
+    else:
+        chunksizes = None
+
+    nc_vars = []
+    for srcPrefix, trgVar, trgName, metadata in mapstacks:
+        try:
+            nc_var = nc_trg.variables[trgVar]
+        except:
+            # prepare the variable
             nc_var = nc_trg.createVariable(
                 trgVar,
                 "f4",
-                ("time", "y", "x"),
+                dims,
                 fill_value=FillVal,
                 zlib=zlib,
                 complevel=complevel,
                 least_significant_digit=least_significant_digit,
+                chunksizes=chunksizes,
             )
             nc_var.coordinates = "lat lon"
-            nc_var.grid_mapping = "crs"
-
-        nc_var.units = trgUnits
-        nc_var.standard_name = trgName
-        # print metadata
-        for attr in metadata:
-            # print metadata[attr]
-            nc_var.setncattr(attr, metadata[attr])
-
-    nc_Fill = nc_var._FillValue
-    # Create a buffer of a number of timesteps to speed-up writing
-    bufsize = minimum(len(timeList), maxbuf)
-
-    if len(shape(nc_trg.variables["lat"])) == 2:
-        latlen = shape(nc_trg.variables["lat"])[0]
-        lonlen = shape(nc_trg.variables["lon"])[1]
-    else:
-        latlen = len(nc_trg.variables["lat"])
-        lonlen = len(nc_trg.variables["lon"])
-
-    timestepbuffer = np.zeros((bufsize, latlen, lonlen))
-
-    # now loop over all time steps, check the date and write valid dates to a list, write time series to PCRaster maps
-    for nn, curTime in enumerate(timeList):
-        logger.debug("Adding time: " + str(curTime))
-        idx = int(where(timeObj == curTime)[0])
-        count = nn + startidx
+            if EPSG.lower() != "epsg:4326":
+                nc_var.grid_mapping = "crs"
+
+            nc_var.units = trgUnits
+            nc_var.standard_name = trgName
+            for attr in metadata:
+                nc_var.setncattr(attr, metadata[attr])
+        nc_vars.append((srcPrefix, nc_var, float(nc_var._FillValue)))
+
+    # blocks of consecutive time steps, starting at a multiple of the buffer size
+    bufsize = max(maxbuf // chunktime, 1) * chunktime
+    starts = np.flatnonzero(
+        (timeidx % bufsize == 0) | (np.diff(timeidx, prepend=-2) != 1)
+    )
+    blocks = list(zip(starts, np.append(starts[1:], len(timeidx))))
 
-        below_thousand = count % 1000
-        above_thousand = count / 1000
-        # read the file of interest
-        pcraster_file = str(srcPrefix + "%0" + str(8 - len(srcPrefix)) + ".f.%03.f") % (
-            above_thousand,
-            below_thousand,
-        )
-        pcraster_path = os.path.join(srcFolder, pcraster_file)
-        # write grid to PCRaster file
-        logger.debug("processing map: " + pcraster_file)
-        # x, y, data, FillVal = readMap(pcraster_path, 'PCRaster',logger)
-        x, y, data, FFillVal = _readMap(pcraster_path, "PCRaster", logger)
-        logger.debug("Setting fillval...")
-
-        data[data == FFillVal] = float(nc_Fill)
-        data[isinf(data)] = float(nc_Fill)
-        data[isnan(data)] = float(nc_Fill)
-        data[clone <= -999] = float(nc_Fill)
-        data[clone == FFillVal] = float(nc_Fill)
-
-        buffreset = (idx + 1) % maxbuf
-        bufpos = (idx) % maxbuf
-        logger.debug("Adding data to array...")
-        timestepbuffer[bufpos, :, :] = data
-
-        logger.debug(
-            "index: "
-            + str(idx - bufpos)
-            + " index: "
-            + str(idx)
-            + "bufpos: "
-            + str(bufpos)
-            + "idx: "
-            + str(idx)
+    if processes:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_reader, initargs=(clone,)
         )
-        if buffreset == 0 or idx == bufsize - 1 or nn + 1 == len(timeList):
+    else:
+        _init_reader(clone)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def submit(block):
+        return [
+            [
+                executor.submit(
+                    _read_step,
+                    (
+                        os.path.join(
+                            srcFolder, mapstack_file(srcPrefix, nn + startidx)
+                        ),
+                        nc_Fill,
+                    ),
+                )
+                for nn in range(block[0], block[1])
+            ]
+            for srcPrefix, nc_var, nc_Fill in nc_vars
+        ]
+
+    with executor:
+        # the next block is read while the current block is written
+        pending = submit(blocks[0]) if blocks else None
+        for nb, block in enumerate(blocks):
+            current = pending
+            if nb + 1 < len(blocks):
+                pending = submit(blocks[nb + 1])
+            for (srcPrefix, nc_var, nc_Fill), futures in zip(nc_vars, current):
+                data = np.array([future.result() for future in futures])
+                nc_var[timeidx[block[0]] : timeidx[block[1] - 1] + 1, :, :] = data
+            nc_trg.sync()
             logger.info(
-                "Writing buffer to file at: "
-                + str(curTime)
+                "Written buffer to file at: "
+                + str(timeList[block[1] - 1])
                 + " "
-                + str(int(bufpos) + 1)
+                + str(block[1] - block[0])
                 + " timesteps"
             )
-            nc_var[idx - bufpos : idx + 1, :, :] = timestepbuffer[0 : bufpos + 1, :, :]
-            nc_trg.sync()
 
-    # nc_trg.sync()
     nc_trg.close()
 
 
+def write_netcdf_timeseries(
+    srcFolder,
+    srcPrefix,
+    trgFile,
+    trgVar,
+    trgUnits,
+    trgName,
+    timeList,
+    metadata,
+    logger,
+    clone,
+    maxbuf=600,
+    Format="NETCDF4",
+    zlib=True,
+    least_significant_digit=None,
+    startidx=0,
+    EPSG="EPSG:4326",
+    FillVal=1e31,
+):
+    """
+    Write pcraster mapstack to netcdf file. Taken from GLOFRIS_Utils.py
+    
+    - srcFolder - Folder with pcraster mapstack
+    - srcPrefix - name of the mapstack
+    - trgFile - target netcdf file
+    - tgrVar - variable in nc file
+    - trgUnits - units for the netcdf file
+    - timeLists - list of times
+    - metadata - dict with metedata for var
+
+    Optional argumenrs
+    - maxbuf = 600: number of timesteps to buffer before writing
+
+    See write_netcdf_mapstacks, which can convert several mapstacks at once.
+    """
+    write_netcdf_mapstacks(
+        srcFolder,
+        [(srcPrefix, trgVar, trgName, metadata)],
+        trgFile,
+        trgUnits,
+        timeList,
+        logger,
+        clone,
+        maxbuf=maxbuf,
+        Format=Format,
+        zlib=zlib,
+        least_significant_digit=least_significant_digit,
+        startidx=startidx,
+        EPSG=EPSG,
+        FillVal=FillVal,
+    )
+
+
 def setlogger(logfilename, loggername, thelevel=logging.INFO):
     """
     Set-up the logging system and return a logger object. Exit if this fails
@@ -525,6 +634,10 @@ def main(argv=None):
     clonemapname = "None"
     startstep = 1
     perYear = False
+    complevel = 9
+    chunktime = 1
+    workers = 4
+    processes = False
     if argv is None:
         argv = sys.argv[1:]
         if len(argv) == 0:
@@ -534,7 +647,7 @@ def main(argv=None):
     ## Main model starts here
     ########################################################################
     try:
-        opts, args = getopt.getopt(argv, "c:S:E:N:I:O:b:t:F:zs:d:YP:Mi:C:")
+        opts, args = getopt.getopt(argv, "c:S:E:N:I:O:b:t:F:zs:d:YP:Mi:C:L:k:w:p")
     except getopt.error as msg:
         usage(msg)
 
@@ -571,6 +684,14 @@ def main(argv=None):
             clonemapname = a
         if o == "-t":
             timestepsecs = int(a)
+        if o == "-L":
+            complevel = int(a)
+        if o == "-k":
+            chunktime = int(a)
+        if o == "-w":
+            workers = int(a)
+        if o == "-p":
+            processes = True
         if o == "-N":
             flst = glob.glob(a)
             if len(flst) == 0:
@@ -585,14 +706,8 @@ def main(argv=None):
     # Use first timestep as clone-map
     logger = setlogger("pcr2netcdf.log", "pcr2netcdf", thelevel=logging.DEBUG)
 
-    count = 1
-    below_thousand = count % 1000
-    above_thousand = count / 1000
-
     if clonemapname == "None":
-        clonemapname = str(
-            mapstackname[0] + "%0" + str(8 - len(mapstackname[0])) + ".f.%03.f"
-        ) % (above_thousand, below_thousand)
+        clonemapname = mapstack_file(mapstackname[0], 1)
 
     clonemap = os.path.join(mapstackfolder, clonemapname)
 
@@ -629,7 +744,13 @@ def main(argv=None):
     # break up into separate years
 
     if not Singlemap:
-        varmeta = {}
+        # get variable attributes from ini file here
+        mapstacks = []
+        for idx, mname in enumerate(mapstackname):
+            varmeta = {}
+            if os.path.exists(inifile):
+                varmeta = getvarmetadatafromini(inifile, var[idx])
+            mapstacks.append((mname, var[idx], varname[idx], varmeta))
 
         startmapstack = startstep
 
@@ -659,35 +780,32 @@ def main(argv=None):
                         FillValue=outputFillVal,
                     )
 
-                    idx = 0
-                    for mname in mapstackname:
-                        logger.info(
-                            "Converting mapstack: " + mname + " to " + ncoutfile
-                        )
-                        # get variable attributes from ini file here
-                        if os.path.exists(inifile):
-                            varmeta = getvarmetadatafromini(inifile, var[idx])
-
-                        write_netcdf_timeseries(
-                            mapstackfolder,
-                            mname,
-                            ncoutfile_yr,
-                            var[idx],
-                            unit,
-                            varname[idx],
-                            yr_timelist,
-                            varmeta,
-                            logger,
-                            clone,
-                            maxbuf=mbuf,
-                            Format=OFormat,
-                            zlib=zlib,
-                            least_significant_digit=least_significant_digit,
-                            startidx=startmapstack,
-                            EPSG=EPSG,
-                            FillVal=outputFillVal,
-                        )
-                        idx = idx + 1
+                    logger.info(
+                        "Converting mapstacks: "
+                        + ", ".join(mapstackname)
+                        + " to "
+                        + ncoutfile_yr
+                    )
+                    write_netcdf_mapstacks(
+                        mapstackfolder,
+                        mapstacks,
+                        ncoutfile_yr,
+                        unit,
+                        yr_timelist,
+                        logger,
+                        clone,
+                        maxbuf=mbuf,
+                        Format=OFormat,
+                        zlib=zlib,
+                        least_significant_digit=least_significant_digit,
+                        startidx=startmapstack,
+                        EPSG=EPSG,
+                        FillVal=outputFillVal,
+                        complevel=complevel,
+                        chunktime=chunktime,
+                        workers=workers,
+                        processes=processes,
+                    )
 
                 logger.info(
                     "Old stack: "
@@ -710,33 +828,29 @@ def main(argv=None):
                 zlib=zlib,
                 EPSG=EPSG,
             )
-            idx = 0
-            for mname in mapstackname:
-                logger.info("Converting mapstack: " + mname + " to " + ncoutfile)
-                # get variable attributes from ini file here
-                if os.path.exists(inifile):
-                    varmeta = getvarmetadatafromini(inifile, var[idx])
-
-                write_netcdf_timeseries(
-                    mapstackfolder,
-                    mname,
-                    ncoutfile,
-                    var[idx],
-                    unit,
-                    varname[idx],
-                    timeList,
-                    varmeta,
-                    logger,
-                    clone,
-                    maxbuf=mbuf,
-                    Format=OFormat,
-                    zlib=zlib,
-                    least_significant_digit=least_significant_digit,
-                    startidx=startmapstack,
-                    EPSG=EPSG,
-                    FillVal=outputFillVal,
-                )
-                idx = idx + 1
+            logger.info(
+                "Converting mapstacks: " + ", ".join(mapstackname) + " to " + ncoutfile
+            )
+            write_netcdf_mapstacks(
+                mapstackfolder,
+                mapstacks,
+                ncoutfile,
+                unit,
+                timeList,
+                logger,
+                clone,
+                maxbuf=mbuf,
+                Format=OFormat,
+                zlib=zlib,
+                least_significant_digit=least_significant_digit,
+                startidx=startmapstack,
+                EPSG=EPSG,
+                FillVal=outputFillVal,
+                complevel=complevel,
+                chunktime=chunktime,
+                workers=workers,
+                processes=processes,
+            )
     else:
         NcOutput = ncdf.netcdfoutputstatic(
             ncoutfile,
@@ -123,6 +123,11 @@ seamless product.
 
 Some trial and error may be required to yield the right tile sizes and overlaps.
 
+All tiles are independent (apart from their overlap) and can be computed in parallel
+with the -p command line argument. Each worker process reads its own windows from the input
+files, the main process writes the results to the HAND and flood map files. Keep in mind that
+each process holds a tile in memory.
+
 ::
 
 	[inundation]
@@ -130,10 +135,9 @@ Some trial and error may be required to yield the right tile sizes and overlaps.
 	initial_level=32
 
 The inundation section contains a number of settings for the flood fill algorithm.
-The number of iterations can be changed, we recommend to set it to 20 for
-an accurate results. The initial\_level is the largest water level that can occur during flooding. Make
+The water level in each subcatchment is solved directly from the sorted HAND values, the
+number of iterations is therefore no longer used. The initial\_level is the largest water level that can occur during flooding. Make
 sure it is set to a level (much) higher than anticipated to occur but not to a value close to infinity.
-If you set it orders too high, the solution will not converge to a reasonable estimate.
 
 Command line arguments
 ----------------------
@@ -170,6 +174,11 @@ When wflow\_flood.py is run with the -h argument, you will receive the following
 	  -n neg_HAND, --negHAND=0
 	            optional functionality to allow HAND maps to become
 	            negative (if set to 1, default=0)
+	  -p PROCESSES, --processes=PROCESSES
+	            number of processes used to compute tiles in parallel
+	            (default=1)
+	  -k HAND_CACHE, --hand_cache=HAND_CACHE
+	            optional HAND cache prepared with wflow_hand_cache.py
 
 
 Further explanation:
@@ -208,6 +217,15 @@ Further explanation:
         However, this option leads to artifacts when the used SRTM is not corrected for elevation and when the river shapefile is not entirely correct (for example if the burned in river is following an old meander.
         Therefore the user must be very confident about the used data sources (river shape file and digital elevation model corrected for vegetation) when this option is set to 1!
 
+    -p
+        number of processes used to compute the tiles of the HAND and flood maps in parallel (default 1)
+
+    -k
+        HAND cache directory prepared with wflow_hand_cache.py. The cache holds the HAND maps and
+        subcatchments of all Strahler orders, so no HAND files are generated and the subcatchments are
+        not derived again for each event. The cache must be made with the same ini file (terrain files and
+        tiling), -c and -n and contain all Strahler orders up to -m, otherwise wflow_flood stops with an error.
+
 Outputs
 -------
 
@@ -236,6 +254,8 @@ $Keywords: $
 
 import sys
 import os
+import logging
+import multiprocessing
 
 from optparse import OptionParser
 import numpy as np
@@ -251,6 +271,391 @@ import wflow.wflow_lib as wflow_lib
 import datetime as dt
 
 
+def tile_windows(nx, ny, x_tile, y_tile, x_overlap, y_overlap):
+    """
+    Returns a list of tiles covering a grid of nx columns and ny rows. Each tile is
+    a dictionary with the tile number, the start and end column and row of the
+    tile and the actual overlap at each side of the tile.
+    """
+    tiles = []
+    n = 0
+    for x_loop in range(0, nx, x_tile):
+        x_start = np.maximum(x_loop, 0)
+        x_end = np.minimum(x_loop + x_tile, nx)
+        # determine actual overlap for cutting
+        for y_loop in range(0, ny, y_tile):
+            n += 1
+            y_start = np.maximum(y_loop, 0)
+            y_end = np.minimum(y_loop + y_tile, ny)
+            tiles.append(
+                {
+                    "n": n,
+                    "x_start": int(x_start),
+                    "x_end": int(x_end),
+                    "y_start": int(y_start),
+                    "y_end": int(y_end),
+                    "x_overlap_min": int(x_start - np.maximum(x_start - x_overlap, 0)),
+                    "x_overlap_max": int(np.minimum(x_end + x_overlap, nx) - x_end),
+                    "y_overlap_min": int(y_start - np.maximum(y_start - y_overlap, 0)),
+                    "y_overlap_max": int(np.minimum(y_end + y_overlap, ny) - y_end),
+                }
+            )
+    return tiles
+
+
+def read_tile(rasterband, tile):
+    """
+    Read the window of a tile (including overlap) from a GDAL rasterband
+    """
+    return rasterband.ReadAsArray(
+        float(tile["x_start"] - tile["x_overlap_min"]),
+        float(tile["y_start"] - tile["y_overlap_min"]),
+        int(
+            (tile["x_end"] + tile["x_overlap_max"])
+            - (tile["x_start"] - tile["x_overlap_min"])
+        ),
+        int(
+            (tile["y_end"] + tile["y_overlap_max"])
+            - (tile["y_start"] - tile["y_overlap_min"])
+        ),
+    )
+
+
+def cut_tile(data, tile):
+    """
+    Cut the overlap from a processed tile
+    """
+    y_overlap_max = tile["y_overlap_max"]
+    x_overlap_max = tile["x_overlap_max"]
+    if y_overlap_max == 0:
+        y_overlap_max = -data.shape[0]
+    if x_overlap_max == 0:
+        x_overlap_max = -data.shape[1]
+    return data[
+        0 + tile["y_overlap_min"] : -y_overlap_max,
+        0 + tile["x_overlap_min"] : -x_overlap_max,
+    ]
+
+
+def run_tiles(func, tasks, processes=1):
+    """
+    Process tiles with func and yield the results as they become available.
+    With more than one process the tiles are handled by a pool of worker
+    processes, the calling process remains the only one that writes output.
+    """
+    if processes <= 1:
+        for task in tasks:
+            yield func(task)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for result in pool.imap_unordered(func, tasks):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+
+def hand_tile(task):
+    """
+    Compute the HAND map of one tile. All input is read directly from
+    the GDAL files so tiles can be processed independently.
+
+    :param task: tuple of (options, tile, hand_strahler)
+    :return: x_start, y_start and HAND without overlap
+    """
+    options, tile, hand_strahler = task
+    logger = logging.getLogger("HAND_INUN")
+
+    # Open terrain data for reading
+    ds_dem, rasterband_dem = inun_lib.get_gdal_rasterband(options.dem_file)
+    ds_ldd, rasterband_ldd = inun_lib.get_gdal_rasterband(options.ldd_file)
+    ds_stream, rasterband_stream = inun_lib.get_gdal_rasterband(options.stream_file)
+    # cut out DEM
+    logger.debug(
+        "Computing HAND for xmin: {:d} xmax: {:d} ymin {:d} ymax {:d}".format(
+            tile["x_start"], tile["x_end"], tile["y_start"], tile["y_end"]
+        )
+    )
+    terrain = read_tile(rasterband_dem, tile)
+    drainage = read_tile(rasterband_ldd, tile)
+    stream = read_tile(rasterband_stream, tile)
+    # write to temporary file
+    terrain_temp_file = os.path.join(
+        options.dest_path, "terrain_temp_{:04d}.map".format(tile["n"])
+    )
+    drainage_temp_file = os.path.join(
+        options.dest_path, "drainage_temp_{:04d}.map".format(tile["n"])
+    )
+    stream_temp_file = os.path.join(
+        options.dest_path, "stream_temp_{:04d}.map".format(tile["n"])
+    )
+    if rasterband_dem.GetNoDataValue() is not None:
+        inun_lib.gdal_writemap(
+            terrain_temp_file,
+            "PCRaster",
+            np.arange(0, terrain.shape[1]),
+            np.arange(0, terrain.shape[0]),
+            terrain,
+            rasterband_dem.GetNoDataValue(),
+            gdal_type=gdal.GDT_Float32,
+            logging=logger,
+        )
+    else:
+        # in case no nodata value is found
+        logger.warning(
+            "No nodata value found in {:s}. assuming -9999".format(options.dem_file)
+        )
+        inun_lib.gdal_writemap(
+            terrain_temp_file,
+            "PCRaster",
+            np.arange(0, terrain.shape[1]),
+            np.arange(0, terrain.shape[0]),
+            terrain,
+            -9999.0,
+            gdal_type=gdal.GDT_Float32,
+            logging=logger,
+        )
+
+    inun_lib.gdal_writemap(
+        drainage_temp_file,
+        "PCRaster",
+        np.arange(0, terrain.shape[1]),
+        np.arange(0, terrain.shape[0]),
+        drainage,
+        rasterband_ldd.GetNoDataValue(),
+        gdal_type=gdal.GDT_Int32,
+        logging=logger,
+    )
+    inun_lib.gdal_writemap(
+        stream_temp_file,
+        "PCRaster",
+        np.arange(0, terrain.shape[1]),
+        np.arange(0, terrain.shape[0]),
+        stream,
+        rasterband_ldd.GetNoDataValue(),
+        gdal_type=gdal.GDT_Int32,
+        logging=logger,
+    )
+    ds_dem = None
+    ds_ldd = None
+    ds_stream = None
+    # read as pcr objects
+    pcr.setclone(terrain_temp_file)
+    terrain_pcr = pcr.readmap(terrain_temp_file)
+    drainage_pcr = pcr.lddrepair(
+        pcr.ldd(pcr.readmap(drainage_temp_file))
+    )  # convert to ldd type map
+    stream_pcr = pcr.scalar(pcr.readmap(stream_temp_file))  # convert to ldd type map
+
+    # check if the highest stream order of the tile is below the hand_strahler
+    # if the highest stream order of the tile is smaller than hand_strahler, than DEM values are taken instead of HAND values.
+    max_stream_tile = inun_lib.define_max_strahler(stream_temp_file, logging=logger)
+    if max_stream_tile < hand_strahler:
+        hand_pcr = terrain_pcr
+        logger.info(
+            "For this tile, DEM values are used instead of HAND because there is no stream order larger than {:02d}".format(
+                hand_strahler
+            )
+        )
+    else:
+        # compute streams
+        stream_ge, subcatch = inun_lib.subcatch_stream(
+            drainage_pcr, hand_strahler, stream=stream_pcr
+        )  # generate streams
+        # compute basins
+        stream_ge_dummy, subcatch = inun_lib.subcatch_stream(
+            drainage_pcr, options.catchment_strahler, stream=stream_pcr
+        )  # generate streams
+        basin = pcr.boolean(subcatch)
+        hand_pcr, dist_pcr = inun_lib.derive_HAND(
+            terrain_pcr,
+            drainage_pcr,
+            3000,
+            rivers=pcr.boolean(stream_ge),
+            basin=basin,
+            neg_HAND=options.neg_HAND,
+        )
+    # convert to numpy
+    hand = pcr.pcr2numpy(hand_pcr, -9999.0)
+    os.unlink(terrain_temp_file)
+    os.unlink(drainage_temp_file)
+    os.unlink(stream_temp_file)
+
+    # cut relevant part
+    return tile["x_start"], tile["y_start"], cut_tile(hand, tile)
+
+
+def flood_tile(task):
+    """
+    Spread the flood volume over the HAND maps of all Strahler orders for one tile.
+    All input is read directly from the GDAL files so tiles can be processed
+    independently.
+
+    :param task: tuple of (options, tile, x_tile_ax, y_tile_ax, hand_files, flood_vol_map, flood_folder)
+    :return: x_start, y_start and inundation without overlap
+    """
+    options, tile, x_tile_ax, y_tile_ax, hand_files, flood_vol_map, flood_folder = task
+    logger = logging.getLogger("HAND_INUN")
+    if options.hand_cache != "":
+        hand_cache = inun_lib.HandCache(options.hand_cache)
+    else:
+        hand_cache = None
+
+    hand_temp_file = os.path.join(
+        flood_folder, "hand_temp_{:04d}.map".format(tile["n"])
+    )
+    drainage_temp_file = os.path.join(
+        flood_folder, "drainage_temp_{:04d}.map".format(tile["n"])
+    )
+    stream_temp_file = os.path.join(
+        flood_folder, "stream_temp_{:04d}.map".format(tile["n"])
+    )
+    flood_vol_temp_file = os.path.join(
+        flood_folder, "flood_warp_temp_{:04d}.tif".format(tile["n"])
+    )
+    ds_ldd, rasterband_ldd = inun_lib.get_gdal_rasterband(options.ldd_file)
+    ds_stream, rasterband_stream = inun_lib.get_gdal_rasterband(options.stream_file)
+    # cut out DEM
+    logger.debug(
+        "handling xmin: {:d} xmax: {:d} ymin {:d} ymax {:d}".format(
+            tile["x_start"], tile["x_end"], tile["y_start"], tile["y_end"]
+        )
+    )
+
+    drainage = read_tile(rasterband_ldd, tile)
+    stream = read_tile(rasterband_stream, tile)
+
+    inun_lib.gdal_writemap(
+        drainage_temp_file,
+        "PCRaster",
+        x_tile_ax,
+        y_tile_ax,
+        drainage,
+        rasterband_ldd.GetNoDataValue(),
+        gdal_type=gdal.GDT_Int32,
+        logging=logger,
+    )
+    inun_lib.gdal_writemap(
+        stream_temp_file,
+        "PCRaster",
+        x_tile_ax,
+        y_tile_ax,
+        stream,
+        rasterband_stream.GetNoDataValue(),
+        gdal_type=gdal.GDT_Int32,
+        logging=logger,
+    )
+    ds_ldd = None
+    ds_stream = None
+
+    # read as pcr objects
+    pcr.setclone(stream_temp_file)
+    drainage_pcr = pcr.lddrepair(
+        pcr.ldd(pcr.readmap(drainage_temp_file))
+    )  # convert to ldd type map
+    stream_pcr = pcr.scalar(pcr.readmap(stream_temp_file))  # convert to ldd type map
+
+    # warp of flood volume to inundation resolution
+    inun_lib.gdal_warp(
+        flood_vol_map,
+        stream_temp_file,
+        flood_vol_temp_file,
+        gdal_interp=gdalconst.GRA_NearestNeighbour,
+    )  # ,
+    x_tile_ax, y_tile_ax, flood_meter, fill_value = inun_lib.gdal_readmap(
+        flood_vol_temp_file, "GTiff", logging=logger
+    )
+    # make sure that the option unittrue is on !! (if unitcell was is used in another function)
+    x_res_tile, y_res_tile, reallength = pcrut.detRealCellLength(
+        pcr.scalar(stream_pcr), not (bool(options.latlon))
+    )
+    cell_surface_tile = pcr.pcr2numpy(x_res_tile * y_res_tile, 0)
+
+    # convert meter depth to volume [m3]
+    flood_vol = pcr.numpy2pcr(pcr.Scalar, flood_meter * cell_surface_tile, fill_value)
+
+    # first prepare a basin map, belonging to the lowest order we are looking at
+    inundation_pcr = pcr.scalar(stream_pcr) * 0
+    for hand_strahler, hand_file in hand_files:
+        if hand_cache is not None:
+            hand_pcr = pcr.numpy2pcr(
+                pcr.Scalar, hand_cache.hand(hand_strahler, tile), -9999.0
+            )
+            subcatch = pcr.numpy2pcr(
+                pcr.Ordinal, hand_cache.read("subcatch", hand_strahler, tile), -1
+            )
+            zones = pcr.numpy2pcr(
+                pcr.Ordinal, hand_cache.read("zones", hand_strahler, tile), -1
+            )
+        else:
+            ds_hand, rasterband_hand = inun_lib.get_gdal_rasterband(hand_file)
+            hand = read_tile(rasterband_hand, tile)
+            logger.debug(
+                "len x-ax: {:d} len y-ax {:d} x-shape {:d} y-shape {:d}".format(
+                    len(x_tile_ax), len(y_tile_ax), hand.shape[1], hand.shape[0]
+                )
+            )
+
+            inun_lib.gdal_writemap(
+                hand_temp_file,
+                "PCRaster",
+                x_tile_ax,
+                y_tile_ax,
+                hand,
+                rasterband_hand.GetNoDataValue(),
+                gdal_type=gdal.GDT_Float32,
+                logging=logger,
+            )
+            ds_hand = None
+
+            hand_pcr = pcr.readmap(hand_temp_file)
+
+            stream_ge_hand, subcatch_hand = inun_lib.subcatch_stream(
+                drainage_pcr, options.catchment_strahler, stream=stream_pcr
+            )
+            # stream_ge_hand, subcatch_hand = inun_lib.subcatch_stream(drainage_pcr, hand_strahler, stream=stream_pcr)
+            stream_ge, subcatch = inun_lib.subcatch_stream(
+                drainage_pcr,
+                options.catchment_strahler,
+                stream=stream_pcr,
+                basin=pcr.boolean(pcr.cover(subcatch_hand, 0)),
+                assign_existing=True,
+                min_strahler=hand_strahler,
+                max_strahler=hand_strahler,
+            )  # generate subcatchments, only within basin for HAND
+            # to make sure backwater effects can occur from higher order rivers to lower order rivers
+            zones = pcr.subcatchment(drainage_pcr, subcatch)
+        flood_vol_strahler = pcr.ifthenelse(
+            pcr.boolean(pcr.cover(subcatch, 0)), flood_vol, 0
+        )  # mask the flood volume map with the created subcatch map for strahler order = hand_strahler
+
+        inundation_pcr_step = inun_lib.volume_spread(
+            drainage_pcr,
+            hand_pcr,
+            zones,
+            flood_vol_strahler,
+            volume_thres=0.0,
+            iterations=options.iterations,
+            cell_surface=pcr.numpy2pcr(pcr.Scalar, cell_surface_tile, -9999),
+            logging=logger,
+            order=hand_strahler,
+            neg_HAND=options.neg_HAND,
+        )  # 1166400000.
+        # use maximum value of inundation_pcr_step and new inundation for higher strahler order
+        inundation_pcr = pcr.max(inundation_pcr, inundation_pcr_step)
+    inundation = pcr.pcr2numpy(inundation_pcr, -9999.0)
+    # clean up
+    os.unlink(flood_vol_temp_file)
+    os.unlink(drainage_temp_file)
+    if os.path.isfile(hand_temp_file):
+        os.unlink(hand_temp_file)
+    os.unlink(stream_temp_file)  # also remove temp stream file from output folder
+
+    # cut relevant part
+    return tile["x_start"], tile["y_start"], cut_tile(inundation, tile)
+
+
 def main():
     ### Read input arguments #####
     parser = OptionParser()
@@ -330,6 +735,13 @@ def main():
         default="",
         help="optional HAND file prefix of already generated HAND files",
     )
+    parser.add_option(
+        "-k",
+        "--hand_cache",
+        dest="hand_cache",
+        default="",
+        help="optional HAND cache prepared with wflow_hand_cache.py",
+    )
     parser.add_option(
         "-n",
         "--neg_HAND",
@@ -338,6 +750,14 @@ def main():
         type="int",
         help="if set to 1, allow for negative HAND values in HAND maps",
     )
+    parser.add_option(
+        "-p",
+        "--processes",
+        dest="processes",
+        default=1,
+        type="int",
+        help="number of processes used to compute tiles in parallel",
+    )
     (options, args) = parser.parse_args()
 
     if not os.path.exists(options.inifile):
@@ -475,9 +895,33 @@ def main():
 
     max_s = inun_lib.define_max_strahler(options.stream_file, logging=logger)
     stream_max = np.minimum(max_s, options.max_strahler)
+    dem_name = os.path.split(options.dem_file)[1].split(".")[0]
+
+    if options.hand_cache != "":
+        # HAND maps and subcatchments are read from the cache, check if it fits
+        options.hand_cache = os.path.abspath(options.hand_cache)
+        try:
+            hand_cache = inun_lib.HandCache(options.hand_cache)
+        except IOError:
+            msg = "No HAND cache found in {:s}".format(options.hand_cache)
+            inun_lib.close_with_error(logger, ch, msg)
+            sys.exit(1)
+        problems = hand_cache.check(
+            inun_lib.hand_cache_settings(options, len(x), len(y)),
+            range(options.catchment_strahler, stream_max + 1, 1),
+        )
+        if problems:
+            msg = "HAND cache {:s} cannot be used: {:s}".format(
+                options.hand_cache, ", ".join(problems)
+            )
+            inun_lib.close_with_error(logger, ch, msg)
+            sys.exit(1)
+        logger.info("Using HAND cache {:s}".format(options.hand_cache))
+        hand_orders = []
+    else:
+        hand_orders = range(options.catchment_strahler, stream_max + 1, 1)
 
-    for hand_strahler in range(options.catchment_strahler, stream_max + 1, 1):
-        dem_name = os.path.split(options.dem_file)[1].split(".")[0]
+    for hand_strahler in hand_orders:
         if os.path.isfile(
             "{:s}_{:02d}.tif".format(options.hand_file_prefix, hand_strahler)
         ):
@@ -510,174 +954,23 @@ def main():
             )
             # band_hand = ds_hand.GetRasterBand(1)
 
-            # Open terrain data for reading
-            ds_dem, rasterband_dem = inun_lib.get_gdal_rasterband(options.dem_file)
-            ds_ldd, rasterband_ldd = inun_lib.get_gdal_rasterband(options.ldd_file)
-            ds_stream, rasterband_stream = inun_lib.get_gdal_rasterband(
-                options.stream_file
-            )
-            n = 0
-            for x_loop in range(0, len(x), options.x_tile):
-                x_start = np.maximum(x_loop, 0)
-                x_end = np.minimum(x_loop + options.x_tile, len(x))
-                # determine actual overlap for cutting
-                for y_loop in range(0, len(y), options.y_tile):
-                    x_overlap_min = x_start - np.maximum(x_start - options.x_overlap, 0)
-                    x_overlap_max = (
-                        np.minimum(x_end + options.x_overlap, len(x)) - x_end
-                    )
-                    n += 1
-                    # print('tile {:001d}:'.format(n))
-                    y_start = np.maximum(y_loop, 0)
-                    y_end = np.minimum(y_loop + options.y_tile, len(y))
-                    y_overlap_min = y_start - np.maximum(y_start - options.y_overlap, 0)
-                    y_overlap_max = (
-                        np.minimum(y_end + options.y_overlap, len(y)) - y_end
-                    )
-                    # cut out DEM
-                    logger.debug(
-                        "Computing HAND for xmin: {:d} xmax: {:d} ymin {:d} ymax {:d}".format(
-                            x_start, x_end, y_start, y_end
-                        )
-                    )
-                    terrain = rasterband_dem.ReadAsArray(
-                        float(x_start - x_overlap_min),
-                        float(y_start - y_overlap_min),
-                        int((x_end + x_overlap_max) - (x_start - x_overlap_min)),
-                        int((y_end + y_overlap_max) - (y_start - y_overlap_min)),
-                    )
-
-                    drainage = rasterband_ldd.ReadAsArray(
-                        float(x_start - x_overlap_min),
-                        float(y_start - y_overlap_min),
-                        int((x_end + x_overlap_max) - (x_start - x_overlap_min)),
-                        int((y_end + y_overlap_max) - (y_start - y_overlap_min)),
-                    )
-                    stream = rasterband_stream.ReadAsArray(
-                        float(x_start - x_overlap_min),
-                        float(y_start - y_overlap_min),
-                        int((x_end + x_overlap_max) - (x_start - x_overlap_min)),
-                        int((y_end + y_overlap_max) - (y_start - y_overlap_min)),
-                    )
-                    # write to temporary file
-                    terrain_temp_file = os.path.join(
-                        options.dest_path, "terrain_temp.map"
-                    )
-                    drainage_temp_file = os.path.join(
-                        options.dest_path, "drainage_temp.map"
-                    )
-                    stream_temp_file = os.path.join(
-                        options.dest_path, "stream_temp.map"
-                    )
-                    if rasterband_dem.GetNoDataValue() is not None:
-                        inun_lib.gdal_writemap(
-                            terrain_temp_file,
-                            "PCRaster",
-                            np.arange(0, terrain.shape[1]),
-                            np.arange(0, terrain.shape[0]),
-                            terrain,
-                            rasterband_dem.GetNoDataValue(),
-                            gdal_type=gdal.GDT_Float32,
-                            logging=logger,
-                        )
-                    else:
-                        # in case no nodata value is found
-                        logger.warning(
-                            "No nodata value found in {:s}. assuming -9999".format(
-                                options.dem_file
-                            )
-                        )
-                        inun_lib.gdal_writemap(
-                            terrain_temp_file,
-                            "PCRaster",
-                            np.arange(0, terrain.shape[1]),
-                            np.arange(0, terrain.shape[0]),
-                            terrain,
-                            -9999.0,
-                            gdal_type=gdal.GDT_Float32,
-                            logging=logger,
-                        )
-
-                    inun_lib.gdal_writemap(
-                        drainage_temp_file,
-                        "PCRaster",
-                        np.arange(0, terrain.shape[1]),
-                        np.arange(0, terrain.shape[0]),
-                        drainage,
-                        rasterband_ldd.GetNoDataValue(),
-                        gdal_type=gdal.GDT_Int32,
-                        logging=logger,
-                    )
-                    inun_lib.gdal_writemap(
-                        stream_temp_file,
-                        "PCRaster",
-                        np.arange(0, terrain.shape[1]),
-                        np.arange(0, terrain.shape[0]),
-                        stream,
-                        rasterband_ldd.GetNoDataValue(),
-                        gdal_type=gdal.GDT_Int32,
-                        logging=logger,
-                    )
-                    # read as pcr objects
-                    pcr.setclone(terrain_temp_file)
-                    terrain_pcr = pcr.readmap(terrain_temp_file)
-                    drainage_pcr = pcr.lddrepair(
-                        pcr.ldd(pcr.readmap(drainage_temp_file))
-                    )  # convert to ldd type map
-                    stream_pcr = pcr.scalar(
-                        pcr.readmap(stream_temp_file)
-                    )  # convert to ldd type map
-
-                    # check if the highest stream order of the tile is below the hand_strahler
-                    # if the highest stream order of the tile is smaller than hand_strahler, than DEM values are taken instead of HAND values.
-                    max_stream_tile = inun_lib.define_max_strahler(
-                        stream_temp_file, logging=logger
-                    )
-                    if max_stream_tile < hand_strahler:
-                        hand_pcr = terrain_pcr
-                        logger.info(
-                            "For this tile, DEM values are used instead of HAND because there is no stream order larger than {:02d}".format(
-                                hand_strahler
-                            )
-                        )
-                    else:
-                        # compute streams
-                        stream_ge, subcatch = inun_lib.subcatch_stream(
-                            drainage_pcr, hand_strahler, stream=stream_pcr
-                        )  # generate streams
-                        # compute basins
-                        stream_ge_dummy, subcatch = inun_lib.subcatch_stream(
-                            drainage_pcr, options.catchment_strahler, stream=stream_pcr
-                        )  # generate streams
-                        basin = pcr.boolean(subcatch)
-                        hand_pcr, dist_pcr = inun_lib.derive_HAND(
-                            terrain_pcr,
-                            drainage_pcr,
-                            3000,
-                            rivers=pcr.boolean(stream_ge),
-                            basin=basin,
-                            neg_HAND=options.neg_HAND,
-                        )
-                    # convert to numpy
-                    hand = pcr.pcr2numpy(hand_pcr, -9999.0)
-                    # cut relevant part
-                    if y_overlap_max == 0:
-                        y_overlap_max = -hand.shape[0]
-                    if x_overlap_max == 0:
-                        x_overlap_max = -hand.shape[1]
-                    hand_cut = hand[
-                        0 + y_overlap_min : -y_overlap_max,
-                        0 + x_overlap_min : -x_overlap_max,
-                    ]
-
-                    band_hand.WriteArray(hand_cut, float(x_start), float(y_start))
-                    os.unlink(terrain_temp_file)
-                    os.unlink(drainage_temp_file)
-                    os.unlink(stream_temp_file)
-                    band_hand.FlushCache()
-            ds_dem = None
-            ds_ldd = None
-            ds_stream = None
+            # tiles are computed in parallel, only this process writes to the HAND file
+            tasks = [
+                (options, tile, hand_strahler)
+                for tile in tile_windows(
+                    len(x),
+                    len(y),
+                    options.x_tile,
+                    options.y_tile,
+                    options.x_overlap,
+                    options.y_overlap,
+                )
+            ]
+            for x_start, y_start, hand_cut in run_tiles(
+                hand_tile, tasks, processes=options.processes
+            ):
+                band_hand.WriteArray(hand_cut, float(x_start), float(y_start))
+                band_hand.FlushCache()
             band_hand.SetNoDataValue(-9999.0)
             ds_hand = None
             logger.info("Finalizing {:s}".format(hand_file))
@@ -739,10 +1032,6 @@ def main():
         inun_file_tmp = os.path.join(flood_folder, "{:s}.nc.tmp".format(case_name))
         inun_file = os.path.join(flood_folder, "{:s}.nc".format(case_name))
 
-    hand_temp_file = os.path.join(flood_folder, "hand_temp.map")
-    drainage_temp_file = os.path.join(flood_folder, "drainage_temp.map")
-    stream_temp_file = os.path.join(flood_folder, "stream_temp.map")
-    flood_vol_temp_file = os.path.join(flood_folder, "flood_warp_temp.tif")
     # load the data with river levels and compute the volumes
     if options.file_format == 0:
         # assume we need the maximum value in a NetCDF time series grid
@@ -844,11 +1133,6 @@ def main():
         -999.0,
         logging=logger,
     )
-    # this is placed later in the hand loop
-    # ds_hand, rasterband_hand = inun_lib.get_gdal_rasterband(hand_file)
-    ds_ldd, rasterband_ldd = inun_lib.get_gdal_rasterband(options.ldd_file)
-    ds_stream, rasterband_stream = inun_lib.get_gdal_rasterband(options.stream_file)
-
     logger.info("Preparing flood map in {:s} ...please wait...".format(inun_file))
     if options.out_format == 0:
         ds_inun, band_inun = inun_lib.prepare_gdal(
@@ -865,203 +1149,55 @@ def main():
             metadata_var=metadata_var,
             logging=logger,
         )
-    # loop over all the tiles
-    n = 0
-    for x_loop in range(0, len(x), options.x_tile):
-        x_start = np.maximum(x_loop, 0)
-        x_end = np.minimum(x_loop + options.x_tile, len(x))
-        # determine actual overlap for cutting
-        for y_loop in range(0, len(y), options.y_tile):
-            x_overlap_min = x_start - np.maximum(x_start - options.x_overlap, 0)
-            x_overlap_max = np.minimum(x_end + options.x_overlap, len(x)) - x_end
-            n += 1
-            # print('tile {:001d}:'.format(n))
-            y_start = np.maximum(y_loop, 0)
-            y_end = np.minimum(y_loop + options.y_tile, len(y))
-            y_overlap_min = y_start - np.maximum(y_start - options.y_overlap, 0)
-            y_overlap_max = np.minimum(y_end + options.y_overlap, len(y)) - y_end
-            x_tile_ax = x[x_start - x_overlap_min : x_end + x_overlap_max]
-            y_tile_ax = y[y_start - y_overlap_min : y_end + y_overlap_max]
-            # cut out DEM
-            logger.debug(
-                "handling xmin: {:d} xmax: {:d} ymin {:d} ymax {:d}".format(
-                    x_start, x_end, y_start, y_end
-                )
-            )
-
-            drainage = rasterband_ldd.ReadAsArray(
-                float(x_start - x_overlap_min),
-                float(y_start - y_overlap_min),
-                int((x_end + x_overlap_max) - (x_start - x_overlap_min)),
-                int((y_end + y_overlap_max) - (y_start - y_overlap_min)),
-            )
-            stream = rasterband_stream.ReadAsArray(
-                float(x_start - x_overlap_min),
-                float(y_start - y_overlap_min),
-                int((x_end + x_overlap_max) - (x_start - x_overlap_min)),
-                int((y_end + y_overlap_max) - (y_start - y_overlap_min)),
-            )
-
-            # stream_max = np.minimum(stream.max(), options.max_strahler)
-
-            inun_lib.gdal_writemap(
-                drainage_temp_file,
-                "PCRaster",
-                x_tile_ax,
-                y_tile_ax,
-                drainage,
-                rasterband_ldd.GetNoDataValue(),
-                gdal_type=gdal.GDT_Int32,
-                logging=logger,
+    # loop over all the tiles, tiles are computed in parallel and only this
+    # process writes to the inundation file
+    hand_files = []
+    for hand_strahler in range(options.catchment_strahler, stream_max + 1, 1):
+        hand_file = os.path.join(
+            options.dest_path,
+            "{:s}_hand_strahler_{:02d}.tif".format(dem_name, hand_strahler),
+        )
+        if not os.path.isfile(hand_file):
+            hand_file = "{:s}_{:02d}.tif".format(
+                options.hand_file_prefix, hand_strahler
             )
-            inun_lib.gdal_writemap(
-                stream_temp_file,
-                "PCRaster",
+        hand_files.append((hand_strahler, hand_file))
+    tasks = []
+    for tile in tile_windows(
+        len(x),
+        len(y),
+        options.x_tile,
+        options.y_tile,
+        options.x_overlap,
+        options.y_overlap,
+    ):
+        x_min = tile["x_start"] - tile["x_overlap_min"]
+        x_max = tile["x_end"] + tile["x_overlap_max"]
+        y_min = tile["y_start"] - tile["y_overlap_min"]
+        y_max = tile["y_end"] + tile["y_overlap_max"]
+        x_tile_ax = x[x_min:x_max]
+        y_tile_ax = y[y_min:y_max]
+        tasks.append(
+            (
+                options,
+                tile,
                 x_tile_ax,
                 y_tile_ax,
-                stream,
-                rasterband_stream.GetNoDataValue(),
-                gdal_type=gdal.GDT_Int32,
-                logging=logger,
-            )
-
-            # read as pcr objects
-            pcr.setclone(stream_temp_file)
-            drainage_pcr = pcr.lddrepair(
-                pcr.ldd(pcr.readmap(drainage_temp_file))
-            )  # convert to ldd type map
-            stream_pcr = pcr.scalar(
-                pcr.readmap(stream_temp_file)
-            )  # convert to ldd type map
-
-            # warp of flood volume to inundation resolution
-            inun_lib.gdal_warp(
+                hand_files,
                 flood_vol_map,
-                stream_temp_file,
-                flood_vol_temp_file,
-                gdal_interp=gdalconst.GRA_NearestNeighbour,
-            )  # ,
-            x_tile_ax, y_tile_ax, flood_meter, fill_value = inun_lib.gdal_readmap(
-                flood_vol_temp_file, "GTiff", logging=logger
+                flood_folder,
             )
-            # make sure that the option unittrue is on !! (if unitcell was is used in another function)
-            x_res_tile, y_res_tile, reallength = pcrut.detRealCellLength(
-                pcr.scalar(stream_pcr), not (bool(options.latlon))
-            )
-            cell_surface_tile = pcr.pcr2numpy(x_res_tile * y_res_tile, 0)
-
-            # convert meter depth to volume [m3]
-            flood_vol = pcr.numpy2pcr(
-                pcr.Scalar, flood_meter * cell_surface_tile, fill_value
-            )
-
-            # first prepare a basin map, belonging to the lowest order we are looking at
-            inundation_pcr = pcr.scalar(stream_pcr) * 0
-            for hand_strahler in range(options.catchment_strahler, stream_max + 1, 1):
-                # hand_temp_file = os.path.join(flood_folder, 'hand_temp.map')
-                if os.path.isfile(
-                    os.path.join(
-                        options.dest_path,
-                        "{:s}_hand_strahler_{:02d}.tif".format(dem_name, hand_strahler),
-                    )
-                ):
-                    hand_file = os.path.join(
-                        options.dest_path,
-                        "{:s}_hand_strahler_{:02d}.tif".format(dem_name, hand_strahler),
-                    )
-                else:
-                    hand_file = "{:s}_{:02d}.tif".format(
-                        options.hand_file_prefix, hand_strahler
-                    )
-                ds_hand, rasterband_hand = inun_lib.get_gdal_rasterband(hand_file)
-                hand = rasterband_hand.ReadAsArray(
-                    float(x_start - x_overlap_min),
-                    float(y_start - y_overlap_min),
-                    int((x_end + x_overlap_max) - (x_start - x_overlap_min)),
-                    int((y_end + y_overlap_max) - (y_start - y_overlap_min)),
-                )
-                print(
-                    (
-                        "len x-ax: {:d} len y-ax {:d} x-shape {:d} y-shape {:d}".format(
-                            len(x_tile_ax), len(y_tile_ax), hand.shape[1], hand.shape[0]
-                        )
-                    )
-                )
-
-                inun_lib.gdal_writemap(
-                    hand_temp_file,
-                    "PCRaster",
-                    x_tile_ax,
-                    y_tile_ax,
-                    hand,
-                    rasterband_hand.GetNoDataValue(),
-                    gdal_type=gdal.GDT_Float32,
-                    logging=logger,
-                )
-
-                hand_pcr = pcr.readmap(hand_temp_file)
+        )
+    for x_start, y_start, inundation_cut in run_tiles(
+        flood_tile, tasks, processes=options.processes
+    ):
+        if options.out_format == 0:
+            band_inun.WriteArray(inundation_cut, float(x_start), float(y_start))
+            band_inun.FlushCache()
+        else:
+            # with netCDF, data is up-side-down.
+            inun_lib.write_tile_nc(band_inun, inundation_cut, x_start, y_start)
 
-                stream_ge_hand, subcatch_hand = inun_lib.subcatch_stream(
-                    drainage_pcr, options.catchment_strahler, stream=stream_pcr
-                )
-                # stream_ge_hand, subcatch_hand = inun_lib.subcatch_stream(drainage_pcr, hand_strahler, stream=stream_pcr)
-                stream_ge, subcatch = inun_lib.subcatch_stream(
-                    drainage_pcr,
-                    options.catchment_strahler,
-                    stream=stream_pcr,
-                    basin=pcr.boolean(pcr.cover(subcatch_hand, 0)),
-                    assign_existing=True,
-                    min_strahler=hand_strahler,
-                    max_strahler=hand_strahler,
-                )  # generate subcatchments, only within basin for HAND
-                flood_vol_strahler = pcr.ifthenelse(
-                    pcr.boolean(pcr.cover(subcatch, 0)), flood_vol, 0
-                )  # mask the flood volume map with the created subcatch map for strahler order = hand_strahler
-
-                inundation_pcr_step = inun_lib.volume_spread(
-                    drainage_pcr,
-                    hand_pcr,
-                    pcr.subcatchment(
-                        drainage_pcr, subcatch
-                    ),  # to make sure backwater effects can occur from higher order rivers to lower order rivers
-                    flood_vol_strahler,
-                    volume_thres=0.0,
-                    iterations=options.iterations,
-                    cell_surface=pcr.numpy2pcr(pcr.Scalar, cell_surface_tile, -9999),
-                    logging=logger,
-                    order=hand_strahler,
-                    neg_HAND=options.neg_HAND,
-                )  # 1166400000.
-                # use maximum value of inundation_pcr_step and new inundation for higher strahler order
-                inundation_pcr = pcr.max(inundation_pcr, inundation_pcr_step)
-            inundation = pcr.pcr2numpy(inundation_pcr, -9999.0)
-            # cut relevant part
-            if y_overlap_max == 0:
-                y_overlap_max = -inundation.shape[0]
-            if x_overlap_max == 0:
-                x_overlap_max = -inundation.shape[1]
-            inundation_cut = inundation[
-                0 + y_overlap_min : -y_overlap_max, 0 + x_overlap_min : -x_overlap_max
-            ]
-            # inundation_cut
-            if options.out_format == 0:
-                band_inun.WriteArray(inundation_cut, float(x_start), float(y_start))
-                band_inun.FlushCache()
-            else:
-                # with netCDF, data is up-side-down.
-                inun_lib.write_tile_nc(band_inun, inundation_cut, x_start, y_start)
-            # clean up
-            os.unlink(flood_vol_temp_file)
-            os.unlink(drainage_temp_file)
-            os.unlink(hand_temp_file)
-            os.unlink(
-                stream_temp_file
-            )  # also remove temp stream file from output folder
-
-            # if n == 35:
-            #     band_inun.SetNoDataValue(-9999.)
-            #     ds_inun = None
-            #     sys.exit(0)
     # os.unlink(flood_vol_map)
 
     logger.info("Finalizing {:s}".format(inun_file))
@@ -1071,11 +1207,9 @@ def main():
     # band_inun.SetMetadata(metadata_var)
     if options.out_format == 0:
         ds_inun = None
-        ds_hand = None
     else:
         ds_inun.close()
 
-    ds_ldd = None
     # rename temporary file to final hand file
     if os.path.isfile(inun_file):
         # remove an old result if available
@@ -15,6 +15,7 @@ $Keywords: $
 
 import sys
 import os
+import json
 import configparser
 import logging
 import logging.handlers
@@ -578,6 +579,52 @@ def subcatch_stream(
     return stream_ge, pcr.ordinal(subcatch)
 
 
+def spread_level(height, depth, zones):
+    """
+    Determine the water level in each zone for which the average water depth
+    over all cells in the zone equals a given depth. Instead of iterating, the
+    heights in each zone are sorted once after which the level follows in closed
+    form from the cumulative sum of the sorted heights. All zones are solved at
+    the same time.
+    Input:
+        height -- numpy array (1D), height of each cell above the lowest cell in its zone
+        depth -- numpy array (1D), average water depth in the zone of each cell
+        zones -- numpy array (1D), zone ID of each cell
+    Output:
+        level -- numpy array (1D), water level of each cell
+    """
+    # the levels follow from differences of a running sum over all cells, this
+    # needs float64 (pcr2numpy gives float32)
+    height = np.asarray(height, dtype=np.float64)
+    depth = np.asarray(depth, dtype=np.float64)
+    if height.size == 0:
+        return height.copy()
+    order = np.lexsort((height, zones))
+    h = height[order]
+    z = zones[order]
+    d = depth[order]
+    # position of each cell in its zone (sorted)
+    start = np.concatenate(([True], z[1:] != z[:-1]))
+    first = np.flatnonzero(start)
+    zone_nr = np.cumsum(start) - 1
+    n = np.diff(np.concatenate((first, [z.size])))
+    k = np.arange(z.size) - first[zone_nr] + 1
+    # cumulative sum of the heights within each zone
+    csum = np.cumsum(h)
+    csum = csum - np.concatenate(([0.0], csum))[first][zone_nr]
+    # volume (as depth times number of cells) needed to fill the zone up to each height
+    fill = k * h - csum
+    target = n[zone_nr] * d
+    # the number of flooded cells in each zone
+    nflooded = np.bincount(zone_nr, weights=fill <= target).astype(np.int64)
+    nflooded = np.maximum(nflooded, 1)
+    last = first + nflooded - 1
+    level_zone = (n * d[first] + csum[last]) / nflooded
+    level = np.empty(height.shape)
+    level[order] = level_zone[zone_nr]
+    return level
+
+
 def volume_spread(
     ldd,
     hand,
@@ -599,7 +646,7 @@ def volume_spread(
         volume -- pcraster object float32, scalar flood volume (i.e. m3 volume outside the river bank within subcatchment)
         volume_thres=0. -- scalar threshold, at least this amount of m3 of volume should be present in a catchment
         area_multiplier=1. -- in case the maps are not in m2, set a multiplier other than 1. to convert
-        iterations=15 -- number of iterations to use
+        iterations=15 -- not used anymore, the water level is solved directly (see spread_level)
         neg_HAND -- if set to 1, HAND maps can have negative values when elevation outside of stream is lower than
         stream (for example when there are natural embankments)
     Output:
@@ -613,7 +660,6 @@ def volume_spread(
     surface = pcr.areaarea(subcatch) * pcr.areaaverage(
         cell_surface, subcatch
     )  # area_multiplier
-    error_abs = pcr.scalar(1e10)  # initial error (very high)
     volume_catch = pcr.areatotal(volume, subcatch)
     depth_catch = volume_catch / surface  # meters water disc averaged over subcatchment
     # ilt(depth_catch, 'depth_catch_{:02d}.map'.format(order))
@@ -622,24 +668,26 @@ def volume_spread(
         dem_max = pcr.ifthenelse(
             volume_catch > volume_thres, pcr.scalar(32.0), pcr.scalar(-32.0)
         )  # bizarre high inundation depth☻
-        dem_min = pcr.scalar(-32.0)
     else:
         dem_max = pcr.ifthenelse(
             volume_catch > volume_thres, pcr.scalar(32.0), pcr.scalar(0.0)
         )  # bizarre high inundation depth☻
-        dem_min = pcr.scalar(0.0)
-    for n in range(iterations):
-        logging.debug("Iteration: {:02d}".format(n + 1))
-        #####while np.logical_and(error_abs > error_thres, dem_min < dem_max):
-        dem_av = (dem_min + dem_max) / 2
-        # compute value at dem_av
-        average_depth_catch = pcr.areaaverage(pcr.max(dem_av - dem_norm, 0), subcatch)
-        error = pcr.cover(
-            (depth_catch - average_depth_catch) / depth_catch, depth_catch * 0
-        )
-        dem_min = pcr.ifthenelse(error > 0, dem_av, dem_min)
-        dem_max = pcr.ifthenelse(error <= 0, dem_av, dem_max)
-    inundation = pcr.max(dem_av - dem_norm, 0)
+
+    np_dem_norm = pcr.pcr2numpy(dem_norm, np.nan)
+    np_depth = pcr.pcr2numpy(pcr.cover(depth_catch, 0.0), np.nan)
+    np_dem_max = pcr.pcr2numpy(dem_max, np.nan)
+    np_subcatch = pcr.pcr2numpy(pcr.nominal(subcatch), -9999)
+    valid = ~np.isnan(np_dem_norm) & ~np.isnan(np_dem_max) & (np_subcatch != -9999)
+    logging.debug("Solving water levels for {:d} cells".format(int(np.sum(valid))))
+    level = spread_level(
+        np_dem_norm[valid], np.maximum(np_depth[valid], 0.0), np_subcatch[valid]
+    )
+    # the level is limited by the highest inundation depth
+    level = np.minimum(level, np_dem_max[valid])
+
+    np_inundation = np.full(np_dem_norm.shape, -9999.0)
+    np_inundation[valid] = np.maximum(level - np_dem_norm[valid], 0)
+    inundation = pcr.numpy2pcr(pcr.Scalar, np_inundation, -9999.0)
     pcr.setglobaloption("unittrue")
     return inundation
 
@@ -788,3 +836,95 @@ def define_max_strahler(stream_file, logging=logging):
         stream_file, "GTiff", logging=logging
     )
     return stream_data.max()
+
+
+hand_cache_version = 1
+
+
+def hand_cache_file(path, var, order, n=None):
+    """
+    Returns the file name of a variable in a HAND cache. HAND is stored for the
+    whole domain, the other variables per tile (including overlap).
+    """
+    if n is None:
+        return os.path.join(path, "{:s}_{:02d}.npy".format(var, order))
+    return os.path.join(path, "{:s}_{:02d}_{:04d}.npy".format(var, order, n))
+
+
+def hand_cache_settings(options, nx, ny):
+    """
+    Returns the settings a HAND cache depends on. A cache can only be reused
+    when these are the same, inputs are identified by their size and modification time.
+    """
+    inputs = {}
+    for fn in [options.dem_file, options.ldd_file, options.stream_file]:
+        inputs[os.path.abspath(fn)] = [os.path.getsize(fn), os.path.getmtime(fn)]
+    return {
+        "version": hand_cache_version,
+        "inputs": inputs,
+        "nx": int(nx),
+        "ny": int(ny),
+        "x_tile": options.x_tile,
+        "y_tile": options.y_tile,
+        "x_overlap": options.x_overlap,
+        "y_overlap": options.y_overlap,
+        "catchment_strahler": options.catchment_strahler,
+        "neg_HAND": options.neg_HAND,
+    }
+
+
+class HandCache(object):
+    """
+    Reader for a HAND cache prepared with wflow_hand_cache.py. All files are
+    memory-mapped so only the windows of the tiles that are used are read from disk.
+
+    The cache holds for each Strahler order:
+
+    - hand: Height-Above-Nearest-Drain of the whole domain
+    - subcatch: the subcatchments over which flood volumes are averaged (per tile)
+    - zones: the subcatchments used to spread the volume (per tile)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "hand_cache.json"), "r") as f:
+            self.metadata = json.load(f)
+        self.orders = self.metadata["orders"]
+        self._hand = {}
+
+    def check(self, settings, orders):
+        """
+        Returns a list of reasons why the cache cannot be used for the given
+        settings and Strahler orders, an empty list if the cache can be used.
+        """
+        problems = [
+            "{:s} differs".format(key)
+            for key in sorted(settings)
+            if self.metadata["settings"].get(key) != settings[key]
+        ]
+        for order in orders:
+            if order not in self.orders:
+                problems.append("Strahler order {:d} not in cache".format(order))
+        return problems
+
+    def hand(self, order, tile):
+        """
+        Returns the HAND of a tile (including overlap) for a Strahler order
+        """
+        if order not in self._hand:
+            self._hand[order] = np.load(
+                hand_cache_file(self.path, "hand", order), mmap_mode="r"
+            )
+        y_min = tile["y_start"] - tile["y_overlap_min"]
+        y_max = tile["y_end"] + tile["y_overlap_max"]
+        x_min = tile["x_start"] - tile["x_overlap_min"]
+        x_max = tile["x_end"] + tile["x_overlap_max"]
+        return np.array(self._hand[order][y_min:y_max, x_min:x_max])
+
+    def read(self, var, order, tile):
+        """
+        Returns a per tile variable (subcatch or zones) for a Strahler order
+        """
+        return np.array(
+            np.load(hand_cache_file(self.path, var, order, tile["n"]), mmap_mode="r")
+        )
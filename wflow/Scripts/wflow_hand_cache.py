@@ -0,0 +1,374 @@
+#!/usr/bin/python
+
+"""
+Definition of the wflow_hand_cache pre processor.
+-------------------------------------------------
+
+Prepares a cache of all terrain derived data needed by wflow_flood.py. Deriving
+the Height-Above-Nearest-Drain (HAND) maps and the subcatchments for all Strahler
+orders is by far the most expensive part of a flood downscaling, while it only
+depends on the high resolution terrain data. With a cache, many events (e.g. a
+multi-year series of floods) can be downscaled without repeating this work.
+
+For each tile (the tiling of the [tiling] section of the ini file) all Strahler orders
+are handled in one pass, the ldd, stream and DEM windows are read only once. The
+cache contains for each Strahler order from -c to -m:
+
+- hand_<order>.npy: HAND map of the whole domain
+- subcatch_<order>_<tile>.npy: subcatchments over which flood volumes are averaged
+- zones_<order>_<tile>.npy: subcatchments over which the flood volumes are spread
+
+The per tile maps include the tile overlap. The settings and inputs the cache was made
+with are stored in hand_cache.json, this file is written last. wflow_flood.py checks
+these settings when the cache is given with the -k argument and memory-maps the files,
+so only the windows of the processed tiles are read.
+
+The cache is only read by wflow_flood.py, so plain numpy files are used: they are
+written in parallel by the tile processes without a shared (netCDF) writer, and
+they are memory-mapped with numpy alone. Because the maps overlap between tiles,
+they cannot be stored in a single georeferenced raster either. All maps are on the
+grid of the DEM given in hand_cache.json.
+
+The ini file is the same as the one used by wflow_flood.py, only the [HighResMaps]
+and [tiling] sections are used.
+
+::
+
+    python wflow_hand_cache.py -h
+    Usage: wflow_hand_cache.py [options]
+
+    Options:
+      -h, --help            show this help message and exit
+      -q, --quiet           do not print status messages to stdout
+      -i INIFILE, --ini=INIFILE
+                ini configuration file
+      -c CATCHMENT_STRAHLER, --catchment=CATCHMENT_STRAHLER
+                Strahler order threshold >= are selected as catchment
+                boundaries
+      -m MAX_STRAHLER, --max_strahler=MAX_STRAHLER
+                Maximum Strahler order to loop over
+      -d DEST_PATH, --destination=DEST_PATH
+                Destination path of the cache
+      -n NEG_HAND, --neg_HAND=NEG_HAND
+                if set to 1, allow for negative HAND values in HAND
+                maps
+      -p PROCESSES, --processes=PROCESSES
+                number of processes used to compute tiles in parallel
+
+$Id: wflow_hand_cache.py $
+"""
+
+import sys
+import os
+import json
+import logging
+
+from optparse import OptionParser
+import numpy as np
+
+from osgeo import gdal
+import pcraster as pcr
+
+import wflow_flood_lib as inun_lib
+from wflow_flood import tile_windows, read_tile, run_tiles, cut_tile
+
+
+def cache_tile(task):
+    """
+    Compute the HAND, subcatchments and spreading zones of all Strahler orders
+    for one tile. The per tile maps are saved directly, the
+    HAND maps (without overlap) are returned to be written by the main process.
+
+    :param task: tuple of (options, tile, x_tile_ax, y_tile_ax, orders)
+    :return: x_start, y_start and a dictionary with the HAND of each order without overlap
+    """
+    options, tile, x_tile_ax, y_tile_ax, orders = task
+    logger = logging.getLogger("HAND_CACHE")
+
+    ds_dem, rasterband_dem = inun_lib.get_gdal_rasterband(options.dem_file)
+    ds_ldd, rasterband_ldd = inun_lib.get_gdal_rasterband(options.ldd_file)
+    ds_stream, rasterband_stream = inun_lib.get_gdal_rasterband(options.stream_file)
+    logger.debug(
+        "Caching xmin: {:d} xmax: {:d} ymin {:d} ymax {:d}".format(
+            tile["x_start"], tile["x_end"], tile["y_start"], tile["y_end"]
+        )
+    )
+    terrain = read_tile(rasterband_dem, tile)
+    drainage = read_tile(rasterband_ldd, tile)
+    stream = read_tile(rasterband_stream, tile)
+    terrain_temp_file = os.path.join(
+        options.dest_path, "terrain_temp_{:04d}.map".format(tile["n"])
+    )
+    drainage_temp_file = os.path.join(
+        options.dest_path, "drainage_temp_{:04d}.map".format(tile["n"])
+    )
+    stream_temp_file = os.path.join(
+        options.dest_path, "stream_temp_{:04d}.map".format(tile["n"])
+    )
+    terrain_fill = rasterband_dem.GetNoDataValue()
+    if terrain_fill is None:
+        # in case no nodata value is found
+        logger.warning(
+            "No nodata value found in {:s}. assuming -9999".format(options.dem_file)
+        )
+        terrain_fill = -9999.0
+    inun_lib.gdal_writemap(
+        terrain_temp_file,
+        "PCRaster",
+        x_tile_ax,
+        y_tile_ax,
+        terrain,
+        terrain_fill,
+        gdal_type=gdal.GDT_Float32,
+        logging=logger,
+    )
+    inun_lib.gdal_writemap(
+        drainage_temp_file,
+        "PCRaster",
+        x_tile_ax,
+        y_tile_ax,
+        drainage,
+        rasterband_ldd.GetNoDataValue(),
+        gdal_type=gdal.GDT_Int32,
+        logging=logger,
+    )
+    inun_lib.gdal_writemap(
+        stream_temp_file,
+        "PCRaster",
+        x_tile_ax,
+        y_tile_ax,
+        stream,
+        rasterband_stream.GetNoDataValue(),
+        gdal_type=gdal.GDT_Int32,
+        logging=logger,
+    )
+    ds_dem = None
+    ds_ldd = None
+    ds_stream = None
+
+    pcr.setclone(terrain_temp_file)
+    terrain_pcr = pcr.readmap(terrain_temp_file)
+    drainage_pcr = pcr.lddrepair(pcr.ldd(pcr.readmap(drainage_temp_file)))
+    stream_pcr = pcr.scalar(pcr.readmap(stream_temp_file))
+    max_stream_tile = inun_lib.define_max_strahler(stream_temp_file, logging=logger)
+
+    # the catchment basins are the same for all orders
+    stream_ge_catch, subcatch_catch = inun_lib.subcatch_stream(
+        drainage_pcr, options.catchment_strahler, stream=stream_pcr
+    )
+    hand_cuts = {}
+    for order in orders:
+        if max_stream_tile < order:
+            # no streams of this order, DEM values are used instead of HAND
+            hand_pcr = terrain_pcr
+        else:
+            stream_ge, subcatch = inun_lib.subcatch_stream(
+                drainage_pcr, order, stream=stream_pcr
+            )
+            hand_pcr, dist_pcr = inun_lib.derive_HAND(
+                terrain_pcr,
+                drainage_pcr,
+                3000,
+                rivers=pcr.boolean(stream_ge),
+                basin=pcr.boolean(subcatch_catch),
+                neg_HAND=options.neg_HAND,
+            )
+        stream_ge, subcatch = inun_lib.subcatch_stream(
+            drainage_pcr,
+            options.catchment_strahler,
+            stream=stream_pcr,
+            basin=pcr.boolean(pcr.cover(subcatch_catch, 0)),
+            assign_existing=True,
+            min_strahler=order,
+            max_strahler=order,
+        )
+        zones = pcr.subcatchment(drainage_pcr, subcatch)
+        np.save(
+            inun_lib.hand_cache_file(options.dest_path, "subcatch", order, tile["n"]),
+            pcr.pcr2numpy(subcatch, -1).astype(np.int32),
+        )
+        np.save(
+            inun_lib.hand_cache_file(options.dest_path, "zones", order, tile["n"]),
+            pcr.pcr2numpy(zones, -1).astype(np.int32),
+        )
+        hand_cuts[order] = cut_tile(pcr.pcr2numpy(hand_pcr, -9999.0), tile)
+    os.unlink(terrain_temp_file)
+    os.unlink(drainage_temp_file)
+    os.unlink(stream_temp_file)
+
+    return tile["x_start"], tile["y_start"], hand_cuts
+
+
+def main():
+    parser = OptionParser()
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage=usage)
+    parser.add_option(
+        "-q",
+        "--quiet",
+        dest="verbose",
+        default=True,
+        action="store_false",
+        help="do not print status messages to stdout",
+    )
+    parser.add_option(
+        "-i",
+        "--ini",
+        dest="inifile",
+        default="hand_contour_inun.ini",
+        nargs=1,
+        help="ini configuration file",
+    )
+    parser.add_option(
+        "-c",
+        "--catchment",
+        dest="catchment_strahler",
+        default=7,
+        type="int",
+        help="Strahler order threshold >= are selected as catchment boundaries",
+    )
+    parser.add_option(
+        "-m",
+        "--max_strahler",
+        dest="max_strahler",
+        default=1000,
+        type="int",
+        help="Maximum Strahler order to loop over",
+    )
+    parser.add_option(
+        "-d",
+        "--destination",
+        dest="dest_path",
+        default="hand_cache",
+        help="Destination path of the cache",
+    )
+    parser.add_option(
+        "-n",
+        "--neg_HAND",
+        dest="neg_HAND",
+        default=0,
+        type="int",
+        help="if set to 1, allow for negative HAND values in HAND maps",
+    )
+    parser.add_option(
+        "-p",
+        "--processes",
+        dest="processes",
+        default=1,
+        type="int",
+        help="number of processes used to compute tiles in parallel",
+    )
+    (options, args) = parser.parse_args()
+
+    if not os.path.exists(options.inifile):
+        print("path to ini file cannot be found")
+        sys.exit(1)
+    options.dest_path = os.path.abspath(options.dest_path)
+    if not (os.path.isdir(options.dest_path)):
+        os.makedirs(options.dest_path)
+
+    logfilename = os.path.join(options.dest_path, "hand_cache.log")
+    logger, ch = inun_lib.setlogger(logfilename, "HAND_CACHE", options.verbose)
+    logger.info("$Id: $")
+    logger.info("Destination path: {:s}".format(options.dest_path))
+
+    config = inun_lib.open_conf(options.inifile)
+    options.dem_file = inun_lib.configget(config, "HighResMaps", "dem_file", True)
+    options.ldd_file = inun_lib.configget(config, "HighResMaps", "ldd_file", True)
+    options.stream_file = inun_lib.configget(config, "HighResMaps", "stream_file", True)
+    options.x_tile = inun_lib.configget(
+        config, "tiling", "x_tile", 10000, datatype="int"
+    )
+    options.y_tile = inun_lib.configget(
+        config, "tiling", "y_tile", 10000, datatype="int"
+    )
+    options.x_overlap = inun_lib.configget(
+        config, "tiling", "x_overlap", 1000, datatype="int"
+    )
+    options.y_overlap = inun_lib.configget(
+        config, "tiling", "y_overlap", 1000, datatype="int"
+    )
+    for fn in [options.dem_file, options.ldd_file, options.stream_file]:
+        if not os.path.exists(fn):
+            msg = "path to file {:s} cannot be found".format(fn)
+            inun_lib.close_with_error(logger, ch, msg)
+            sys.exit(1)
+
+    try:
+        x, y = inun_lib.get_gdal_axes(options.dem_file, logging=logger)
+    except:
+        msg = "Input file {:s} not a gdal compatible file".format(options.dem_file)
+        inun_lib.close_with_error(logger, ch, msg)
+        sys.exit(1)
+
+    max_s = inun_lib.define_max_strahler(options.stream_file, logging=logger)
+    stream_max = int(np.minimum(max_s, options.max_strahler))
+    orders = list(range(options.catchment_strahler, stream_max + 1, 1))
+    settings = inun_lib.hand_cache_settings(options, len(x), len(y))
+
+    metadata_file = os.path.join(options.dest_path, "hand_cache.json")
+    if os.path.isfile(metadata_file):
+        if not inun_lib.HandCache(options.dest_path).check(settings, orders):
+            logger.info("HAND cache {:s} is up to date".format(options.dest_path))
+            logger, ch = inun_lib.closeLogger(logger, ch)
+            sys.exit(0)
+        # the cache is rebuilt, it is only valid again when the metadata is written
+        os.unlink(metadata_file)
+
+    hand_maps = {}
+    for order in orders:
+        hand_maps[order] = np.lib.format.open_memmap(
+            inun_lib.hand_cache_file(options.dest_path, "hand", order),
+            mode="w+",
+            dtype=np.float32,
+            shape=(len(y), len(x)),
+        )
+        hand_maps[order][:] = -9999.0
+
+    tiles = tile_windows(
+        len(x),
+        len(y),
+        options.x_tile,
+        options.y_tile,
+        options.x_overlap,
+        options.y_overlap,
+    )
+    tasks = []
+    for tile in tiles:
+        x_min = tile["x_start"] - tile["x_overlap_min"]
+        x_max = tile["x_end"] + tile["x_overlap_max"]
+        y_min = tile["y_start"] - tile["y_overlap_min"]
+        y_max = tile["y_end"] + tile["y_overlap_max"]
+        tasks.append((options, tile, x[x_min:x_max], y[y_min:y_max], orders))
+    for x_start, y_start, hand_cuts in run_tiles(
+        cache_tile, tasks, processes=options.processes
+    ):
+        for order in orders:
+            hand_cut = hand_cuts[order]
+            hand_maps[order][
+                y_start : y_start + hand_cut.shape[0],
+                x_start : x_start + hand_cut.shape[1],
+            ] = hand_cut
+        logger.info("Cached tile at x: {:d} y: {:d}".format(x_start, y_start))
+    for order in orders:
+        hand_maps[order].flush()
+    hand_maps = None
+
+    with open(metadata_file, "w") as f:
+        json.dump(
+            {
+                "settings": settings,
+                "orders": orders,
+                "tiles": len(tiles),
+            },
+            f,
+            indent=1,
+        )
+    logger.info("Done! HAND cache written to {:s}".format(options.dest_path))
+    logger, ch = inun_lib.closeLogger(logger, ch)
+    del logger, ch
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
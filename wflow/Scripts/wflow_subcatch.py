@@ -31,6 +31,9 @@ Usage::
     -M maxcpu
        maximum number of cpu's/cores to use (default = 4)
 
+The maps are cut out in parallel by maxcpu worker threads, maps that already
+exist in the new case are skipped.
+
 
 """
 
@@ -38,11 +41,15 @@ Usage::
 from wflow.wflow_lib import *
 
 
-import os, sys, shlex, time
+import os, sys
 import os.path
 import glob
+import shutil
 import getopt
-import subprocess
+import logging
+from functools import partial
+
+from wflow.wf_tasks import Task, runTasks
 
 
 def usage(*args):
@@ -53,46 +60,33 @@ def usage(*args):
     sys.exit(0)
 
 
-def runCommands(commands, maxCpu):
+def cutMap(mfile, ofile, subcatchmap, subcatch, repairldd=False):
     """
-    Runs a list of processes dividing
-    over maxCpu number of cores.
+    Cut the subcatchment with id subcatch out of mfile and write it to ofile.
+    If repairldd is True uint8 maps are assumed to be an ldd and repaired.
     """
+    x, y, data, FillVal = readMap(mfile, "PCRaster")
+    try:
+        xn, yn, datan = cutMapById(data, subcatchmap, subcatch, x, y, FillVal)
+    except Exception as e:
+        print("Skipping: " + mfile + " exception: " + str(e))
+        return
 
-    def removeFinishedProcesses(processes):
-        """ given a list of (commandString, process),
-            remove those that have completed and return the result
-        """
-        newProcs = []
-        for pollCmd, pollProc in processes:
-            retCode = pollProc.poll()
-            if retCode == None:
-                # still running
-                newProcs.append((pollCmd, pollProc))
-            elif retCode != 0:
-                # failed
-                raise Exception("Command %s failed" % pollCmd)
-            else:
-                print("Command %s completed successfully" % pollCmd)
-        return newProcs
-
-    processes = []
-    for command in commands:
-        command = command.replace(
-            "\\", "/"
-        )  # otherwise shlex.split removes all path separators
-        proc = subprocess.Popen(shlex.split(command))
-        procTuple = (command, proc)
-        processes.append(procTuple)
-        while len(processes) >= maxCpu:
-            time.sleep(0.2)
-            processes = removeFinishedProcesses(processes)
-
-    # wait for all processes
-    while len(processes) > 0:
-        time.sleep(0.5)
-        processes = removeFinishedProcesses(processes)
-    print("All processes in que (" + str(len(commands)) + ") completed.")
+    if xn is None:
+        print("Skipping: " + mfile + " size does not match...")
+        return
+
+    if data.dtype == np.int32 or data.dtype == np.uint8:
+        writeMap(ofile, "PCRaster", xn, yn, datan.astype(np.int32), FillVal)
+    else:
+        writeMap(ofile, "PCRaster", xn, yn, datan, FillVal)
+
+    # Assume ldd and repair (with the cut map as clone)
+    if repairldd and data.dtype == np.uint8:
+        pcr.setclone(ofile)
+        myldd = pcr.ldd(pcr.readmap(ofile))
+        myldd = pcr.lddrepair(myldd)
+        pcr.report(myldd, ofile)
 
 
 def main():
@@ -157,72 +151,32 @@ def main():
     x, y, subcatchmap, FillVal = readMap(
         os.path.join(caseName, "staticmaps", "wflow_subcatch.map"), "PCRaster"
     )
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    tasks = []
     for ddir in dirs:
         print(ddir)
-        allcmd = []
         for mfile in glob.glob(ddir + "/*.map"):
-            if not os.path.exists(mfile.replace(caseName, caseNameNew)):
-                x, y, data, FillVal = readMap(mfile, "PCRaster")
-                try:
-                    good = 1
-                    xn, yn, datan = cutMapById(
-                        data, subcatchmap, subcatch, x, y, FillVal
-                    )
-                except Exception as e:
-                    good = 0
-                    print("Skipping: " + mfile + " exception: " + str(e))
-
-                if xn == None:
-                    good = 0
-                    print("Skipping: " + mfile + " size does not match...")
-
-                if good:
-                    ofile = mfile.replace(caseName, caseNameNew)
-                    if data.dtype == np.int32 or data.dtype == np.uint8:
-                        writeMap(
-                            ofile, "PCRaster", xn, yn, datan.astype(np.int32), FillVal
-                        )
-                    else:
-                        writeMap(ofile, "PCRaster", xn, yn, datan, FillVal)
-
-                    # Assume ldd and repair
-                    if data.dtype == np.uint8:
-                        myldd = ldd(readmap(ofile))
-                        myldd = lddrepair(myldd)
-                        report(myldd, ofile)
+            ofile = mfile.replace(caseName, caseNameNew)
+            if not os.path.exists(ofile):
+                cut = partial(cutMap, mfile, ofile, subcatchmap, subcatch, True)
+                tasks.append(Task(ofile, cut))
 
         for mfile in glob.glob(ddir + "/*.[0-9][0-9][0-9]"):
-            if not os.path.exists(mfile.replace(caseName, caseNameNew)):
-                x, y, data, FillVal = readMap(mfile, "PCRaster")
-                try:
-                    good = 1
-                    xn, yn, datan = cutMapById(
-                        data, subcatchmap, subcatch, x, y, FillVal
-                    )
-                except Exception as e:
-                    good = 0
-                    print("Skipping: " + mfile + " exception: " + str(e))
-
-                if xn == None:
-                    good = 0
-                    print("Skipping: " + mfile + " size does not match...")
-
-                if good:
-                    ofile = mfile.replace(caseName, caseNameNew)
-                    if data.dtype == np.int32 or data.dtype == np.uint8:
-                        writeMap(
-                            ofile, "PCRaster", xn, yn, datan.astype(np.int32), FillVal
-                        )
-                    else:
-                        writeMap(ofile, "PCRaster", xn, yn, datan, FillVal)
+            ofile = mfile.replace(caseName, caseNameNew)
+            if not os.path.exists(ofile):
+                cut = partial(cutMap, mfile, ofile, subcatchmap, subcatch)
+                tasks.append(Task(ofile, cut))
 
         for ext in ext_to_copy:
             for mfile in glob.glob(os.path.join(ddir, ext)):
                 shutil.copy(mfile, mfile.replace(caseName, caseNameNew))
 
-        # Copy ini files
-        for mfile in glob.glob(os.path.join(caseName, "*.ini")):
-            shutil.copy(mfile, mfile.replace(caseName, caseNameNew))
+    # Copy ini files
+    for mfile in glob.glob(os.path.join(caseName, "*.ini")):
+        shutil.copy(mfile, mfile.replace(caseName, caseNameNew))
+
+    # the ldd is repaired with pcraster, this is not thread safe
+    runTasks(tasks, maxCpu=maxcpu, processes=True)
 
 
 if __name__ == "__main__":
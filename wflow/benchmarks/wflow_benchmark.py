@@ -0,0 +1,431 @@
+#!/usr/bin/python
+
+"""
+wflow_benchmark -- time the kernels and model runs of wflow
+
+Usage::
+
+    -s number of cells of the synthetic grids, comma separated
+       (default = 10000,100000,1000000)
+    -k benchmarks to run, comma separated (default = all: set_dd,sbm_cell,kin_wave,
+       netcdf_write,netcdf_read,timeseries_area)
+    -r number of repeats, the fastest is reported (default = 3)
+    -n number of timesteps of the netcdf and timeseries benchmarks (default = 10)
+    -C case[,inifile] end-to-end run of a case (default inifile = wflow_sbm.ini),
+       may be given more than once, e.g. -C sbmcase -C hbvcase,wflow_hbv.ini
+    -T number of timesteps of the end-to-end runs (default = 10)
+    -o directory in which the results are saved (default = results)
+    -b results file of an earlier run to compare with
+    -t ratio of the run times above which a benchmark is reported as a
+       regression (default = 1.2)
+
+The kernels are timed on synthetic square grids: a main river flows south through
+the middle column to a pit in the bottom row, all other cells drain east or west
+to the main river, with river tributaries every tenth row. Each kernel is called
+once before it is timed (this compiles the numba kernels or loads them from
+the cache), the fastest of the repeats is reported. 10 million cells
+(-s 10000000) needs about 12 GB of memory for sbm_cell.
+
+The end-to-end runs use wflow_warmup and report the time of the initial section,
+the first timestep (including the compilation of the numba kernels) and the
+mean of the other timesteps.
+
+The results are saved as json in the output directory (wflow_<version>.json),
+together with the versions of python, numpy and numba and the machine. With -b the
+results are compared with those of another version, the script exits with
+status 1 if a benchmark is more than -t times slower.
+"""
+
+import datetime
+import getopt
+import json
+import logging
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numba
+import numpy as np
+import pcraster as pcr
+
+import wflow
+from wflow import wf_netcdfio
+from wflow.wf_DynamicFramework import wf_OutputTimeSeriesArea
+from wflow.wflow_funcs import drainage_network, kin_wave
+from wflow.wflow_sbm import dyn_dtype, layer_dtype, sbm_cell, static_dtype
+from wflow.wflow_warmup import warmup
+
+kernels = [
+    "set_dd",
+    "sbm_cell",
+    "kin_wave",
+    "netcdf_write",
+    "netcdf_read",
+    "timeseries_area",
+]
+
+
+def usage(*args):
+    sys.stdout = sys.stderr
+    for msg in args:
+        print(msg)
+    print(__doc__)
+    sys.exit(0)
+
+
+def synthetic_ldd(ncells):
+    """
+    Returns a square ldd (numpy, as read from a PCRaster ldd map) of about
+    ncells cells and a flat array with 1.0 for the river cells
+    """
+    n = max(int(round(math.sqrt(ncells))), 3)
+    mid = n // 2
+    ldd = np.full((n, n), 6, dtype=np.uint8)
+    ldd[:, mid + 1 :] = 4
+    ldd[:, mid] = 2
+    ldd[-1, mid] = 5
+    river = np.zeros((n, n))
+    river[:, mid] = 1.0
+    river[::10, mid - n // 4 : mid + n // 4 + 1] = 1.0
+    return ldd, river.ravel()
+
+
+def setclone(ldd):
+    """
+    Sets a PCRaster clone with the shape of ldd and 1 km cells
+    """
+    nrows, ncols = ldd.shape
+    pcr.setclone(nrows, ncols, 1000.0, 0.0, nrows * 1000.0)
+
+
+def timeit(setup, run, repeat):
+    """
+    Fastest time (seconds) of repeat calls of run(*setup()), only run is timed.
+    run is called once before it is timed.
+    """
+    run(*setup())
+    best = None
+    for i in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def sbm_arrays(ldd, river):
+    """
+    Layer, static and dyn arrays of sbm_cell for a uniform soil of 2 m with
+    four layers, a water table at 0.5 m and the lateral subsurface flow of that
+    water table
+    """
+    ncell = ldd.size
+    layer = np.zeros((4, ncell), dtype=layer_dtype)
+    layer["c"] = 10.0
+    layer["KsatVerFrac"] = 1.0
+    for n, thickness in enumerate([100.0, 300.0, 800.0, 800.0]):
+        layer["UStoreLayerThickness"][n] = thickness
+    for n, depth in enumerate([20.0, 60.0, 20.0]):
+        layer["UStoreLayerDepth"][n] = depth
+
+    static = np.zeros(ncell, dtype=static_dtype)
+    static["KsatVer"] = 250.0
+    static["KsatHorFrac"] = 100.0
+    static["f"] = 0.001
+    static["thetaS"] = 0.6
+    static["thetaR"] = 0.01
+    static["SoilThickness"] = 2000.0
+    static["InfiltCapSoil"] = 100.0
+    static["InfiltCapPath"] = 10.0
+    static["PathFrac"] = 0.01
+    static["neff"] = 0.59
+    static["slope"] = 0.01
+    static["SoilWaterCapacity"] = 2000.0 * 0.59
+    static["CapScale"] = 100.0
+    static["rootdistpar"] = -500.0
+    static["RootingDepth"] = 500.0
+    static["ActRootingDepth"] = 500.0
+    static["River"] = river
+    static["DL"] = 1000.0
+    static["DW"] = 1000.0
+    static["SW"] = np.where(river > 0, 990.0, 1000.0)
+    static["Beta"] = 0.6
+    static["DCL"] = 1000.0
+    static["xl"] = 1000.0
+    static["yl"] = 1000.0
+    static["Bw"] = 10.0
+    static["AlpPow"] = (2.0 / 3.0) * 0.6
+    static["AlpTermR"] = (0.072 / np.sqrt(0.01)) ** 0.6
+    static["ssfmax"] = (
+        (static["KsatHorFrac"] * static["KsatVer"] * static["slope"])
+        / static["f"]
+        * (1.0 - np.exp(-static["f"] * static["SoilThickness"]))
+    )
+
+    dyn = np.zeros(ncell, dtype=dyn_dtype)
+    dyn["restEvap"] = 1.0
+    dyn["PotTransSoil"] = 2.0
+    dyn["AvailableForInfiltration"] = 10.0
+    dyn["TSoil"] = 10.0
+    dyn["zi"] = 500.0
+    dyn["SatWaterDepth"] = (2000.0 - 500.0) * 0.59
+    dyn["ssf"] = (
+        (static["KsatHorFrac"] * static["KsatVer"] * static["slope"])
+        / static["f"]
+        * (np.exp(-static["f"] * dyn["zi"]) - np.exp(-static["f"] * 2000.0))
+        * static["DW"]
+        * 1000.0
+    )
+    dyn["AlphaL"] = static["AlpTermR"] * static["SW"] ** static["AlpPow"]
+    return layer, static, dyn
+
+
+def bench_set_dd(ncells, repeat, nsteps, workdir):
+    ldd, river = synthetic_ldd(ncells)
+    return timeit(lambda: (ldd, river), drainage_network, repeat)
+
+
+def bench_sbm_cell(ncells, repeat, nsteps, workdir):
+    ldd, river = synthetic_ldd(ncells)
+    nodes, nodes_up, rnodes, rnodes_up = drainage_network(ldd, river)
+    layer, static, dyn = sbm_arrays(ldd, river)
+
+    def run(layer, dyn):
+        sbm_cell(
+            nodes,
+            nodes_up,
+            ldd.ravel(),
+            layer,
+            static,
+            dyn,
+            0,
+            0,
+            86400,
+            86400,
+            1.0,
+            0.0,
+            ldd.shape,
+            0,
+            1,
+            0,
+        )
+
+    return timeit(lambda: (layer.copy(), dyn.copy()), run, repeat)
+
+
+def bench_kin_wave(ncells, repeat, nsteps, workdir):
+    ldd, river = synthetic_ldd(ncells)
+    nodes, nodes_up, rnodes, rnodes_up = drainage_network(ldd, river)
+    ones = np.ones(ldd.size)
+    Beta = 0.6 * ones
+    Bw = 10.0 * ones
+    AlpPow = (2.0 / 3.0) * Beta
+    AlpTermR = (0.036 / np.sqrt(0.01)) ** Beta * ones
+    Alpha = AlpTermR * Bw**AlpPow
+    q = 1.0e-4 * ones
+    DCL = 1000.0 * ones
+
+    def run(Qold, Alpha):
+        kin_wave(
+            rnodes,
+            rnodes_up,
+            Qold,
+            q,
+            Alpha,
+            Beta,
+            DCL,
+            river,
+            Bw,
+            AlpTermR,
+            AlpPow,
+            86400,
+            1,
+        )
+
+    return timeit(lambda: (ones.copy(), Alpha.copy()), run, repeat)
+
+
+def _netcdf_write(ncfile, nsteps, pmap):
+    nc = wf_netcdfio.netcdfoutput(
+        ncfile, logging.getLogger(__name__), datetime.datetime(2000, 1, 1), nsteps
+    )
+    return nc, nsteps, pmap
+
+
+def _savetimesteps(nc, nsteps, pmap):
+    for step in range(1, nsteps + 1):
+        nc.savetimestep(step, pmap, var="P")
+    nc.finish()
+
+
+def bench_netcdf_write(ncells, repeat, nsteps, workdir):
+    ldd, river = synthetic_ldd(ncells)
+    setclone(ldd)
+    pmap = pcr.numpy2pcr(pcr.Scalar, np.random.random(ldd.shape), -999.0)
+    ncfile = os.path.join(workdir, "benchmark.nc")
+    return timeit(lambda: _netcdf_write(ncfile, nsteps, pmap), _savetimesteps, repeat)
+
+
+def bench_netcdf_read(ncells, repeat, nsteps, workdir):
+    ldd, river = synthetic_ldd(ncells)
+    setclone(ldd)
+    pmap = pcr.numpy2pcr(pcr.Scalar, np.random.random(ldd.shape), -999.0)
+    ncfile = os.path.join(workdir, "benchmark.nc")
+    _savetimesteps(*_netcdf_write(ncfile, nsteps, pmap))
+    logger = logging.getLogger(__name__)
+
+    def run():
+        nc = wf_netcdfio.netcdfinput(ncfile, logger, vars=["P"])
+        for step in range(1, nsteps + 1):
+            nc.gettimestep(step, logger, var="P")
+
+    return timeit(lambda: (), run, repeat)
+
+
+def bench_timeseries_area(ncells, repeat, nsteps, workdir):
+    ldd, river = synthetic_ldd(ncells)
+    setclone(ldd)
+    # areas of 100 x 100 cells
+    rows, cols = np.indices(ldd.shape)
+    areas = (rows // 100) * (ldd.shape[1] // 100 + 1) + cols // 100 + 1
+    area = pcr.numpy2pcr(pcr.Nominal, areas.astype(np.int32), 0)
+    pmap = pcr.numpy2pcr(pcr.Scalar, np.random.random(ldd.shape), -999.0)
+    csvfile = os.path.join(workdir, "benchmark.csv")
+
+    def run(tss):
+        for step in range(1, nsteps + 1):
+            tss.writestep(pmap, csvfile, timestep=step)
+        tss.closeall()
+
+    return timeit(lambda: (wf_OutputTimeSeriesArea(area),), run, repeat)
+
+
+def bench_run(case, inifile, nsteps):
+    """
+    Time of the initial section, the first timestep and the mean of the other
+    timesteps of a model run
+    """
+    timing = dict(warmup(case, inifile, runId="benchmark", steps=nsteps))
+    res = {"initial": timing["initial"], "first timestep": timing["timestep 1"]}
+    if nsteps > 1:
+        res["timestep"] = sum(
+            timing["timestep %d" % step] for step in range(2, nsteps + 1)
+        ) / (nsteps - 1)
+    return res
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the benchmarks (name, key, ratio) that are more than threshold
+    times slower than in baseline
+    """
+    regressions = []
+    for name in sorted(results):
+        for key in sorted(results[name]):
+            if key not in baseline.get(name, {}):
+                continue
+            ratio = results[name][key] / max(baseline[name][key], 1.0e-9)
+            print("%-16s %-16s %8.2f" % (name, key, ratio))
+            if ratio > threshold:
+                regressions.append((name, key, ratio))
+    return regressions
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hs:k:r:n:C:T:o:b:t:")
+    except getopt.error as msg:
+        usage(msg)
+
+    sizes = [10000, 100000, 1000000]
+    selected = kernels
+    repeat = 3
+    nsteps = 10
+    cases = []
+    runsteps = 10
+    outdir = "results"
+    basefile = None
+    threshold = 1.2
+
+    for o, a in opts:
+        if o == "-s":
+            sizes = [int(float(size)) for size in a.split(",")]
+        if o == "-k":
+            selected = a.split(",")
+        if o == "-r":
+            repeat = int(a)
+        if o == "-n":
+            nsteps = int(a)
+        if o == "-C":
+            case = a.split(",")
+            cases.append((case[0], case[1] if len(case) > 1 else "wflow_sbm.ini"))
+        if o == "-T":
+            runsteps = int(a)
+        if o == "-o":
+            outdir = a
+        if o == "-b":
+            basefile = a
+        if o == "-t":
+            threshold = float(a)
+        if o == "-h":
+            usage()
+
+    for name in selected:
+        if name not in kernels:
+            usage("Unknown benchmark: " + name)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(message)s")
+    results = {}
+    workdir = tempfile.mkdtemp()
+    try:
+        for name in selected:
+            bench = globals()["bench_" + name]
+            results[name] = {}
+            for size in sizes:
+                seconds = bench(size, repeat, nsteps, workdir)
+                results[name][str(size)] = seconds
+                print("%-16s %10d cells %10.4f seconds" % (name, size, seconds))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for case, inifile in cases:
+        name = "run " + os.path.basename(os.path.normpath(case)) + " " + inifile
+        results[name] = bench_run(os.path.abspath(case), inifile, runsteps)
+        for key in sorted(results[name]):
+            print("%-16s %-16s %10.4f seconds" % (name, key, results[name][key]))
+
+    report = {
+        "version": wflow.__version__,
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": numba.__version__,
+        "machine": platform.platform(),
+        "processor": platform.processor(),
+        "results": results,
+    }
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    outfile = os.path.join(outdir, "wflow_" + wflow.__version__ + ".json")
+    with open(outfile, "w") as f:
+        json.dump(report, f, indent=1)
+    print("Results saved in " + outfile)
+
+    if basefile is not None:
+        with open(basefile, "r") as f:
+            baseline = json.load(f)
+        print("Run time relative to version " + baseline["version"])
+        regressions = compare(results, baseline["results"], threshold)
+        if regressions:
+            for name, key, ratio in regressions:
+                print("Regression: %s %s is %.2f times slower" % (name, key, ratio))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
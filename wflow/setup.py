@@ -58,6 +58,9 @@ setup(
         "wflow/wflow_cqf.py",
         "wflow/wflow_floodmap.py",
         "wflow/wflow_upscale.py",
+        "wflow/wflow_decompose.py",
+        "wflow/wflow_warmup.py",
+        "wflow/wflow_service.py",
         "wflow/wflow_fit.py",
         "wflow/wflow_adapt.py",
         "wflow/wflow_delwaq.py",
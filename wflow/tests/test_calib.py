@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+import wflow.wf_calib as wf_calib
+
+"""
+
+Check that the calibration results store is resumed by the multipliers of
+the parameter sets
+
+"""
+
+METRICS = {"NS": 0.5, "BIAS": 0.1, "CORR": 0.9, "MABSE": 1.0}
+
+
+class MyTest(unittest.TestCase):
+    def testresume(self):
+        fname = os.path.join(tempfile.mkdtemp(), "wflow_fit.csv")
+        parsets = [(0.8, 1.0), (1.0, 1.0), (1.2, 1.0)]
+        store = wf_calib.wf_CalibResults(fname, ["M", "RootingDepth"])
+        for nr, pars in enumerate(parsets[:2]):
+            store.add(nr, pars, METRICS)
+        store.close()
+
+        store = wf_calib.wf_CalibResults(fname, ["M", "RootingDepth"])
+        self.assertIn(store.key((0.8, 1.0)), store.done)
+        self.assertIn(store.key((1.0, 1.0)), store.done)
+        self.assertEqual(
+            store.rows(parsets),
+            [[0, 0.8, 1.0, 0.5, 0.1, 0.9, 1.0], [1, 1.0, 1.0, 0.5, 0.1, 0.9, 1.0]],
+        )
+
+        # other ranges: set 0 and 1 now have other multipliers and are not done
+        newsets = [(0.9, 1.0), (1.1, 1.0), (1.0, 1.0)]
+        self.assertEqual(
+            [pars for pars in newsets if store.key(pars) not in store.done],
+            [(0.9, 1.0), (1.1, 1.0)],
+        )
+        self.assertEqual(store.rows(newsets), [[2, 1.0, 1.0, 0.5, 0.1, 0.9, 1.0]])
+        store.close()
+
+        # the results file of other parameters is refused
+        self.assertRaises(ValueError, wf_calib.wf_CalibResults, fname, ["M"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+import wflow.wflow_decompose as wfd
+
+"""
+
+Check the links between partitions and the wavefront levels of wflow_decompose
+
+"""
+
+
+class MyTest(unittest.TestCase):
+    def testlinks(self):
+        # two headwater partitions (1, 2) drain into 3, 3 drains to the outlet (5)
+        ldd = np.array(
+            [
+                [3, 2, 1],
+                [6, 2, 4],
+                [6, 2, 4],
+                [6, 5, 4],
+            ]
+        )
+        partitions = np.array(
+            [
+                [1, 1, 2],
+                [1, 3, 2],
+                [3, 3, 3],
+                [3, 3, 0],
+            ]
+        )
+        links = wfd.partition_links(ldd, partitions)
+        self.assertEqual(
+            sorted(links),
+            [
+                (1, 3, (0, 0), (1, 1)),
+                (1, 3, (0, 1), (1, 1)),
+                (1, 3, (1, 0), (1, 1)),
+                (2, 3, (0, 2), (1, 1)),
+                (2, 3, (1, 2), (1, 1)),
+            ],
+        )
+        # no links into cells outside the partitions (0)
+        partitions[3, 1] = 0
+        self.assertEqual(len(wfd.partition_links(ldd, partitions)), 5)
+
+    def testlevels(self):
+        links = [
+            (1, 3, (0, 0), (0, 1)),
+            (2, 3, (0, 0), (0, 1)),
+            (3, 4, (0, 0), (0, 1)),
+            (5, 4, (0, 0), (0, 1)),
+        ]
+        self.assertEqual(
+            wfd.partition_levels([1, 2, 3, 4, 5, 6], links),
+            {1: 0, 2: 0, 3: 1, 4: 2, 5: 0, 6: 0},
+        )
+        self.assertRaises(
+            ValueError,
+            wfd.partition_levels,
+            [1, 2],
+            [(1, 2, (0, 0), (0, 1)), (2, 1, (0, 0), (0, 1))],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import sys
+import unittest
+
+import numpy as np
+
+sys.path = ["../Scripts"] + sys.path
+import wflow_flood_lib
+
+"""
+
+Check the closed form water levels of spread_level against the bisection that
+volume_spread used before
+
+"""
+
+
+def bisection_level(height, depth, zones, iterations=50):
+    """
+    The iteration of the old volume_spread in numpy (dem_max = 32, dem_min = 0)
+    """
+    dem_min = np.zeros(height.shape)
+    dem_max = np.full(height.shape, 32.0)
+    ids, zone_nr = np.unique(zones, return_inverse=True)
+    count = np.bincount(zone_nr)
+    for n in range(iterations):
+        dem_av = (dem_min + dem_max) / 2
+        average_depth = (
+            np.bincount(zone_nr, weights=np.maximum(dem_av - height, 0)) / count
+        )[zone_nr]
+        error = np.where(
+            depth > 0, (depth - average_depth) / np.where(depth > 0, depth, 1), 0
+        )
+        dem_min = np.where(error > 0, dem_av, dem_min)
+        dem_max = np.where(error <= 0, dem_av, dem_max)
+    return dem_av
+
+
+class MyTest(unittest.TestCase):
+    def testspreadlevel(self):
+        np.random.seed(1)
+        nzones = 200
+        zones = np.repeat(np.arange(nzones), 400)
+        height = (np.random.rand(zones.size) * 30.0).astype(np.float32)
+        # height above the lowest cell in the zone
+        for z in range(nzones):
+            height[zones == z] -= height[zones == z].min()
+        depth = np.repeat(np.random.rand(nzones) * 5.0, 400).astype(np.float32)
+        depth[zones == 3] = 0.0
+
+        level = wflow_flood_lib.spread_level(height, depth, zones)
+        expected = bisection_level(
+            height.astype(np.float64), depth.astype(np.float64), zones
+        )
+        self.assertEqual(level.dtype, np.float64)
+        np.testing.assert_allclose(level, expected, atol=1e-6)
+
+    def testspreadlevel_manyzones(self):
+        # a large tile: the running sum over all cells must not lose precision
+        np.random.seed(2)
+        nzones = 20000
+        zones = np.repeat(np.arange(nzones), 400)
+        height = (np.random.rand(zones.size) * 30.0).astype(np.float32)
+        depth = np.repeat(np.random.rand(nzones) * 2.0, 400).astype(np.float32)
+        level = wflow_flood_lib.spread_level(height, depth, zones)
+        # the average depth over each zone equals the given depth
+        mean_depth = np.bincount(
+            zones, weights=np.maximum(level - height.astype(np.float64), 0)
+        ) / np.bincount(zones)
+        np.testing.assert_allclose(mean_depth, depth[::400], atol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+import wflow.wflow_funcs as funcs
+
+"""
+
+Check the drainage network and the multi-class transport kernels on a small ldd
+against results computed by hand
+
+"""
+
+# 0 1 2      3 2 1
+# 3 4 5  ->  6 2 4
+# 6 7 8      6 5 4
+# cells 0, 1, 2, 3 and 5 drain to 4; 4, 6 and 8 drain to the pit 7
+LDD = np.array([[3, 2, 1], [6, 2, 4], [6, 5, 4]], dtype=np.float64)
+UPSTREAM = {
+    0: [],
+    1: [],
+    2: [],
+    3: [],
+    4: [0, 1, 2, 3, 5],
+    5: [],
+    6: [],
+    7: [4, 6, 8],
+    8: [],
+}
+
+
+class MyTest(unittest.TestCase):
+    def testnetwork(self):
+        nodes, nodes_up, rnodes, rnodes_up = funcs.drainage_network(LDD)
+        order = np.concatenate(nodes)
+        self.assertEqual(sorted(order), list(range(9)))
+        # each cell comes after all its upstream cells
+        pos = {cell: i for i, cell in enumerate(order)}
+        for cell, ups in UPSTREAM.items():
+            for up in ups:
+                self.assertLess(pos[up], pos[cell])
+        for nds, nbs in zip(nodes, nodes_up):
+            for cell, up in zip(nds, nbs):
+                self.assertEqual(sorted(up[up >= 0]), UPSTREAM[cell])
+        self.assertEqual(len(rnodes), 0)
+
+    def testaccucapacity(self):
+        nodes, nodes_up, rnodes, rnodes_up = funcs.drainage_network(LDD)
+        material = np.ones((2, 9))
+        capacity = np.vstack([np.full(9, 10.0), np.full(9, 2.0)])
+        capacity[0, 4] = 3.0
+        flux, state = funcs.accucapacity(nodes, nodes_up, material, capacity)
+
+        # class 0: 4 receives 5 + 1, passes 3; 7 receives 3 + 1 + 1 + 1
+        expected_flux = np.ones(9)
+        expected_flux[4] = 3.0
+        expected_flux[7] = 6.0
+        expected_state = np.zeros(9)
+        expected_state[4] = 3.0
+        np.testing.assert_allclose(flux[0], expected_flux)
+        np.testing.assert_allclose(state[0], expected_state)
+        # class 1: capacity 2 everywhere
+        expected_flux = np.ones(9)
+        expected_flux[[4, 7]] = 2.0
+        expected_state = np.zeros(9)
+        expected_state[4] = 4.0
+        expected_state[7] = 3.0
+        np.testing.assert_allclose(flux[1], expected_flux)
+        np.testing.assert_allclose(state[1], expected_state)
+
+        # a missing value propagates downstream
+        material[0, 5] = np.nan
+        flux, state = funcs.accucapacity(nodes, nodes_up, material, capacity)
+        self.assertTrue(np.isnan(flux[0, [4, 5, 7]]).all())
+        self.assertTrue(np.isnan(state[0, [4, 5, 7]]).all())
+        self.assertFalse(np.isnan(flux[0, [0, 1, 2, 3, 6, 8]]).any())
+        self.assertFalse(np.isnan(flux[1]).any())
+
+    def testupstreamsum(self):
+        nodes, nodes_up, rnodes, rnodes_up = funcs.drainage_network(LDD)
+        values = np.vstack([np.arange(9.0), np.ones(9)])
+        res = funcs.upstream_sum(nodes, nodes_up, values)
+
+        expected = np.zeros(9)
+        expected[4] = 0.0 + 1.0 + 2.0 + 3.0 + 5.0
+        expected[7] = 4.0 + 6.0 + 8.0
+        np.testing.assert_allclose(res[0], expected)
+        expected = np.zeros(9)
+        expected[4] = 5.0
+        expected[7] = 3.0
+        np.testing.assert_allclose(res[1], expected)
+
+        # a missing value of an upstream cell gives a missing value (as pcraster)
+        values[0, 5] = np.nan
+        res = funcs.upstream_sum(nodes, nodes_up, values)
+        self.assertTrue(np.isnan(res[0, 4]))
+        self.assertEqual(res[0, 5], 0.0)
+        self.assertEqual(res[0, 7], 18.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import subprocess
+import sys
+import unittest
+
+"""
+
+Check the startup of wflow: importing the package, the framework or the BMI
+interface should not load the heavy optional dependencies (measured with
+python -X importtime in a fresh interpreter)
+
+"""
+
+heavy = ["osgeo", "netCDF4", "cftime", "pyproj"]
+
+
+def importprofile(module):
+    """
+    Returns a dictionary with the cumulative import time (microseconds) of all
+    modules that are loaded by a new python process that imports module
+    """
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    profile = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # header
+        profile[fields[2].strip()] = int(fields[1])
+    return profile
+
+
+def loaded(profile, package):
+    return [name for name in profile if name.split(".")[0] == package]
+
+
+class MyTest(unittest.TestCase):
+    def testpackage(self):
+        profile = importprofile("wflow")
+        for package in heavy:
+            self.assertEqual(loaded(profile, package), [])
+        self.assertLess(profile["wflow"], 1e6)
+
+    def testframework(self):
+        profile = importprofile("wflow.wf_DynamicFramework")
+        for package in heavy:
+            self.assertEqual(loaded(profile, package), [])
+
+    def testbmi(self):
+        # the model modules are only imported when a model is initialized
+        profile = importprofile("wflow.wflow_bmi")
+        for package in heavy:
+            self.assertEqual(loaded(profile, package), [])
+        self.assertNotIn("wflow.wflow_sbm", profile)
+        self.assertNotIn("wflow.wflow_hbv", profile)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import configparser
+import datetime
+import io
+import os
+import shutil
+import unittest
+from functools import reduce
+from unittest import mock
+
+import wflow.wflow_service as wfs
+
+"""
+Run wflow_sbm twice in one service and check the states kept in memory, also
+check the command protocol of the service
+"""
+
+
+class FakeService(object):
+    def __init__(self):
+        self.time = None
+        self.states = []
+        self.logger = wfs.logging.getLogger("test_service")
+
+    def run(self):
+        self.time = "2000-01-02 00:00:00"
+        self.states.append(self.time)
+        return self.time
+
+    def restore(self, time):
+        raise ValueError("No states for " + str(time) + " in memory")
+
+
+class MyTest(unittest.TestCase):
+    def testserve(self):
+        out = io.StringIO()
+        wfs.serve(
+            FakeService(),
+            infile=io.StringIO(
+                "run\n\ntimes\nrestore 2000-01-01\nnothing\nquit\nrun\n"
+            ),
+            outfile=out,
+        )
+        self.assertEqual(
+            out.getvalue().splitlines(),
+            [
+                "ok 2000-01-02 00:00:00",
+                "ok 2000-01-02 00:00:00",
+                "error No states for 2000-01-01 00:00:00 in memory",
+                "error Unknown command: nothing",
+                "ok",
+            ],
+        )
+
+    def testhotstart(self):
+        runId = "unittestservice"
+        caseName = "wflow_sbm"
+        inifile = "wflow_sbm_service.ini"
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config.read(os.path.join(caseName, "wflow_sbm.ini"))
+        if not config.has_section("run"):
+            config.add_section("run")
+        step = datetime.timedelta(
+            seconds=int(config.get("run", "timestepsecs", fallback="86400"))
+        )
+
+        def setrun(start):
+            # ten steps from start, the states are taken at start - step
+            config.set("run", "starttime", str(start))
+            config.set("run", "endtime", str(start + 9 * step))
+            with open(os.path.join(caseName, inifile), "w") as fp:
+                config.write(fp)
+
+        setrun(datetime.datetime(2000, 1, 2))
+        service = wfs.HotStart(
+            caseName, inifile, runId=runId, loglevel=wfs.logging.WARN
+        )
+        first = service.run()
+        self.assertIn(first, service.states)
+        fw = service.dynModelFw
+
+        # the second run continues from the states in memory: the model is not
+        # initialised again and the instate directory is not read
+        setrun(first + step)
+        with mock.patch.object(fw, "_runResume", wraps=fw._runResume) as resume:
+            second = service.run()
+        self.assertIs(fw, service.dynModelFw)
+        self.assertEqual(resume.call_count, 0)
+        self.assertEqual(second, first + 10 * step)
+        self.assertEqual(list(service.states), [first, second])
+
+        service.restore(first)
+        self.assertEqual(service.time, first)
+        states = os.path.join(caseName, runId, "hotstates")
+        service.save(states)
+        for var in fw._userModel().stateVariables():
+            val = reduce(getattr, var.split("."), fw._userModel())
+            if isinstance(val, list):
+                names = [var + "_" + str(i) for i in range(len(val))]
+            else:
+                names = [var]
+            for name in names:
+                self.assertTrue(os.path.exists(os.path.join(states, name + ".map")))
+        shutil.rmtree(states)
+        os.remove(os.path.join(caseName, inifile))
+
+
+if __name__ == "__main__":
+    unittest.main()
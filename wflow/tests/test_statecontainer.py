@@ -0,0 +1,77 @@
+import os
+import shutil
+import unittest
+
+import numpy as np
+import wflow.wflow_sbm as wf
+
+"""
+Run wflow_sbm for a few steps, write the states to a state container (npz and a
+memory-mapped npy) and check that resuming from the container gives the same
+states, including the list state UStoreLayerDepth and missing values
+"""
+
+
+class MyTest(unittest.TestCase):
+    def testcontainer(self):
+        startTime = 1
+        stopTime = 5
+        runId = "unittestcontainer"
+        caseName = "wflow_sbm"
+
+        myModel = wf.WflowModel(
+            "wflow_catchment.map", caseName, runId, "wflow_sbm.ini"
+        )
+        dynModelFw = wf.wf_DynamicFramework(myModel, stopTime, startTime)
+        dynModelFw.createRunId(NoOverWrite=False, level=wf.logging.WARN)
+        dynModelFw._runInitial()
+        dynModelFw._runResume()
+        for ts in range(startTime, stopTime):
+            dynModelFw._runDynamic(ts, ts)
+
+        # missing values in a state map: MV -> nan -> MV
+        cellid = wf.pcr.uniqueid(wf.pcr.defined(myModel.Snow))
+        myModel.Snow = wf.pcr.ifthen(cellid > 10, myModel.Snow)
+        missing = np.isnan(wf.pcr.pcr2numpy(myModel.Snow, np.nan))
+        self.assertTrue(missing.any())
+
+        before = dynModelFw.wf_supplyStatesAsNumpy()
+        nlayers = len(myModel.UStoreLayerDepth)
+        for i in range(nlayers):
+            self.assertIn("UStoreLayerDepth_" + str(i), before.dtype.names)
+        self.assertNotIn("UStoreLayerDepth", before.dtype.names)
+        np.testing.assert_array_equal(np.isnan(before["Snow"]), missing)
+
+        states = os.path.join(caseName, runId, "containerstates")
+        if not os.path.isdir(states):
+            os.makedirs(states)
+        for container in ["states.npz", "states.npy"]:
+            dynModelFw.statecontainer = container
+            dynModelFw.wf_suspend(states)
+            dynModelFw.wf_waitStates()
+            path = os.path.join(states, container)
+            self.assertTrue(os.path.exists(path))
+            self.assertFalse(os.path.exists(path + ".tmp"))
+            if container.endswith(".npy"):
+                self.assertIsInstance(np.load(path, mmap_mode="r"), np.memmap)
+
+            # overwrite the states in memory, resume must restore them
+            for var in myModel.stateVariables():
+                setattr(myModel, var, wf.pcr.scalar(-1.0))
+            dynModelFw.wf_resume(states)
+
+            self.assertEqual(len(myModel.UStoreLayerDepth), nlayers)
+            after = dynModelFw.wf_supplyStatesAsNumpy()
+            self.assertEqual(after.dtype.names, before.dtype.names)
+            for name in before.dtype.names:
+                np.testing.assert_array_equal(after[name], before[name])
+            np.testing.assert_array_equal(
+                np.isnan(wf.pcr.pcr2numpy(myModel.Snow, np.nan)), missing
+            )
+
+        dynModelFw._wf_shutdown()
+        shutil.rmtree(states)
+
+
+if __name__ == "__main__":
+    unittest.main()
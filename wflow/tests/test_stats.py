@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+import wflow.stats as stats
+
+"""
+
+Check the vectorised goodness of fit metrics against the loop based functions
+
+"""
+
+
+class MyTest(unittest.TestCase):
+    def testmetrics(self):
+        np.random.seed(42)
+        qmeas = np.random.rand(200, 3) * 100.0
+        qmeas[10, 0] = np.nan
+        qmeas[20:25, 2] = np.nan
+        mult = np.array([0.8, 1.0, 1.3])
+        qsim = qmeas[np.newaxis, :, :] * mult[:, np.newaxis, np.newaxis]
+        qsim = qsim + np.random.rand(3, 200, 3)
+
+        res = stats.get_metrics(qmeas, qsim)
+        self.assertEqual(res["NS"].shape, (3, 3))
+        self.assertEqual(res["N"][0, 0], 199)
+        self.assertEqual(res["N"][0, 2], 195)
+
+        for s in range(3):
+            for st in range(3):
+                mask = ~np.isnan(qmeas[:, st])
+                meas = qmeas[mask, st]
+                sim = qsim[s, mask, st]
+                ns = stats.get_nash_sutcliffe(meas, sim, NoData=np.nan)[0]
+                bias = stats.get_bias(meas, sim, NoData=np.nan)[0]
+                corr = stats.get_correlation(meas, sim, NoData=np.nan)[0]
+                mabse = stats.get_mean_absolute_error(meas, sim, NoData=np.nan)[0]
+                self.assertAlmostEqual(res["NS"][s, st], ns)
+                self.assertAlmostEqual(res["BIAS"][s, st], bias)
+                self.assertAlmostEqual(res["CORR"][s, st], corr)
+                self.assertAlmostEqual(res["MABSE"][s, st], mabse)
+
+        # perfect fit
+        res = stats.get_metrics(qmeas[:, 1], qmeas[:, 1])
+        self.assertAlmostEqual(float(res["NS"]), 1.0)
+        self.assertAlmostEqual(float(res["KGE"]), 1.0)
+
+        # a mask that is given is used as is
+        mask = stats.get_mask(qmeas, qsim)
+        mask[:, 100:, :] = False
+        res = stats.get_metrics(qmeas, qsim, mask=mask)
+        self.assertEqual(res["N"][1, 1], 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from functools import partial
+
+import wflow.wf_tasks as wf_tasks
+
+"""
+
+Check the ordering, retries and resuming of the task runner
+
+"""
+
+
+def writepid(fname):
+    with open(fname, "w") as f:
+        f.write(str(os.getpid()))
+
+
+class MyTest(unittest.TestCase):
+    def testdependencies(self):
+        order = []
+        lock = threading.Lock()
+
+        def step(name):
+            def run():
+                with lock:
+                    order.append(name)
+
+            run.__name__ = name
+            return run
+
+        tasks = [
+            wf_tasks.Task("c", step("c"), deps=["b"]),
+            wf_tasks.Task("b", step("b"), deps=["a"]),
+            wf_tasks.Task("a", step("a")),
+            wf_tasks.Task("d", step("d")),
+        ]
+        res = wf_tasks.runTasks(tasks, maxCpu=2)
+        self.assertEqual(sorted(res), ["a", "b", "c", "d"])
+        self.assertLess(order.index("a"), order.index("b"))
+        self.assertLess(order.index("b"), order.index("c"))
+
+        # circular dependencies are detected
+        tasks = [
+            wf_tasks.Task("a", step("a"), deps=["b"]),
+            wf_tasks.Task("b", step("b"), deps=["a"]),
+        ]
+        self.assertRaises(wf_tasks.TaskError, wf_tasks.runTasks, tasks)
+
+    def testfailures(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 2:
+                raise RuntimeError("first attempt fails")
+
+        def broken():
+            raise RuntimeError("always fails")
+
+        res = wf_tasks.runTasks([wf_tasks.Task("flaky", flaky, retries=1)])
+        self.assertEqual(res["flaky"]["attempts"], 2)
+
+        ran = []
+        tasks = [
+            wf_tasks.Task("broken", broken),
+            wf_tasks.Task("after", lambda: ran.append(1), deps=["broken"]),
+            wf_tasks.Task("later", lambda: ran.append(1), deps=["after"]),
+        ]
+        self.assertRaises(wf_tasks.TaskError, wf_tasks.runTasks, tasks)
+        self.assertEqual(ran, [])
+
+    def testprocesses(self):
+        # functions run in other processes (e.g. PCRaster calls)
+        tmpdir = tempfile.mkdtemp()
+        fnames = [os.path.join(tmpdir, "pid%d" % i) for i in range(3)]
+        tasks = [wf_tasks.Task(fname, partial(writepid, fname)) for fname in fnames]
+        res = wf_tasks.runTasks(tasks, maxCpu=2, processes=True)
+        self.assertEqual(sorted(res), sorted(fnames))
+        for fname in fnames:
+            with open(fname) as f:
+                self.assertNotEqual(int(f.read()), os.getpid())
+
+    def testresume(self):
+        statefile = os.path.join(tempfile.mkdtemp(), "tasks.json")
+        command = sys.executable + ' -c "pass"'
+        res = wf_tasks.runCommands([command, command], 2, statefile=statefile)
+        self.assertEqual(res[command]["status"], "done")
+        self.assertTrue(os.path.exists(statefile))
+
+        # completed tasks are skipped in a next run
+        res = wf_tasks.runCommands([command], 2, statefile=statefile)
+        self.assertEqual(res, {})
+
+        failing = sys.executable + ' -c "import sys; sys.exit(1)"'
+        self.assertRaises(
+            wf_tasks.TaskError, wf_tasks.runCommands, [failing], 1, statefile
+        )
+        self.assertEqual(wf_tasks.readState(statefile)[failing]["status"], "failed")
+
+    def testresumearguments(self):
+        # a function task runs again if its arguments changed
+        tmpdir = tempfile.mkdtemp()
+        statefile = os.path.join(tmpdir, "tasks.json")
+        fname = os.path.join(tmpdir, "pid")
+        other = os.path.join(tmpdir, "other")
+        task = wf_tasks.Task("write", partial(writepid, fname))
+        res = wf_tasks.runTasks([task], statefile=statefile)
+        self.assertEqual(res["write"]["status"], "done")
+
+        task = wf_tasks.Task("write", partial(writepid, fname))
+        self.assertEqual(wf_tasks.runTasks([task], statefile=statefile), {})
+
+        task = wf_tasks.Task("write", partial(writepid, other))
+        res = wf_tasks.runTasks([task], statefile=statefile)
+        self.assertEqual(res["write"]["status"], "done")
+        self.assertTrue(os.path.exists(other))
+
+        task = wf_tasks.Task("write", partial(writepid, fname=other))
+        res = wf_tasks.runTasks([task], statefile=statefile)
+        self.assertEqual(res["write"]["status"], "done")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,6 +13,56 @@ Run wflow_hbv for 30 steps and checks if the outcome is approx that of the refer
 
 """
 
+FLUXES = [
+    "IntEvap",
+    "SnowMelt",
+    "InSoil",
+    "ActEvap",
+    "Percolation",
+    "CapFlux",
+    "QuickFlow",
+    "BaseFlow",
+    "InwaterMM",
+    "SurfaceRunoff",
+]
+
+
+def runhbv(runId, **options):
+    """
+    Run the test case for 30 steps with the model section options given, returns
+    the states and fluxes (numpy arrays) of each step
+    """
+    myModel = wf.WflowModel("wflow_catchment.map", "wflow_hbv", runId, "wflow_hbv.ini")
+    dynModelFw = wf.wf_DynamicFramework(
+        myModel, 30, firstTimestep=1, datetimestart=datetime.datetime(1990, 1, 1)
+    )
+    dynModelFw.createRunId(NoOverWrite=False, level=wf.logging.WARN)
+    for opt, value in options.items():
+        wf.configset(myModel.config, "model", opt, str(value), overwrite=True)
+    dynModelFw._runInitial()
+    dynModelFw._runResume()
+
+    res = []
+    for ts in range(1, 31):
+        if 10 <= ts <= 15:
+            dynModelFw.wf_setValues("P", 10.0)
+        else:
+            dynModelFw.wf_setValues("P", 0.0)
+        dynModelFw.wf_setValues("PET", 2.0)
+        dynModelFw.wf_setValues("TEMP", 10.0)
+        dynModelFw._runDynamic(ts, ts)
+
+        step = {}
+        states = dynModelFw.wf_supplyStatesAsNumpy()
+        for name in states.dtype.names:
+            step[name] = states[name].copy()
+        for var in FLUXES:
+            step[var] = wf.pcr.pcr2numpy(getattr(myModel, var), np.nan)
+        res.append(step)
+    dynModelFw._wf_shutdown()
+
+    return res
+
 
 class MyTest(unittest.TestCase):
     def testapirun(self):
@@ -68,6 +118,30 @@ class MyTest(unittest.TestCase):
         print("Checking  discharge ....")
         self.assertAlmostEqual(1086.9438420613608, my_data[:, 2].mean(), places=4)
 
+    def testnumba(self):
+        # the fused numba kernel gives the same states and fluxes as pcraster,
+        # pcraster computes in float32
+        pcrrun = runhbv("unittestpcr", UseNumba=0)
+        numbarun = runhbv("unittestnumba", UseNumba=1)
+        for pcrstep, numbastep in zip(pcrrun, numbarun):
+            self.assertEqual(sorted(pcrstep), sorted(numbastep))
+            for var in pcrstep:
+                np.testing.assert_allclose(
+                    numbastep[var], pcrstep[var], rtol=1e-4, atol=1e-5, err_msg=var
+                )
+
+    def testnumbarouter(self):
+        # the numba kinematic wave gives the same discharge as pcr.kinematic,
+        # also with more than one time slice
+        pcrrun = runhbv("unittestpcrkin", RoutingEngine="pcraster", Tslice=4)
+        numbarun = runhbv("unittestnumbakin", RoutingEngine="numba", Tslice=4)
+        self.assertGreater(np.nanmax(pcrrun[-1]["SurfaceRunoff"]), 0.0)
+        for pcrstep, numbastep in zip(pcrrun, numbarun):
+            for var in pcrstep:
+                np.testing.assert_allclose(
+                    numbastep[var], pcrstep[var], rtol=1e-4, atol=1e-5, err_msg=var
+                )
+
 
 if __name__ == "__main__":
     unittest.main()
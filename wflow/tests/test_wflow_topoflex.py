@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import wflow.wflow_topoflex as wf
+
+"""
+Run wflow_topoflex for 20 steps with the reservoirs that have a version for all
+classes run at once, and check that the outcome is that of the run with the per
+class reservoir functions only
+"""
+
+STATES = ["Si", "Sw", "Sa", "Su", "Sf", "Sfa"]
+FLUXES = ["WB", "Qtlag", "Ei", "Ea", "Eu", "Ew"]
+
+
+def runtopoflex(runId):
+    """
+    Run the test case for 20 steps, returns the states of all classes and the
+    fluxes (numpy arrays) of each step
+    """
+    myModel = wf.WflowModel(
+        "wflow_subcatch.map", "wflow_topoflex", runId, "wflow_topoflex.ini"
+    )
+    dynModelFw = wf.wf_DynamicFramework(myModel, 20, firstTimestep=1)
+    dynModelFw.createRunId(NoOverWrite=False, level=wf.logging.WARN)
+    dynModelFw._runInitial()
+    dynModelFw._runResume()
+
+    res = []
+    for ts in range(1, 21):
+        dynModelFw._runDynamic(ts, ts)
+        step = {}
+        for var in STATES:
+            step[var] = getattr(myModel, var).array.copy()
+        for var in FLUXES:
+            step[var] = wf.pcr.pcr2numpy(getattr(myModel, var), np.nan)
+        res.append(step)
+    dynModelFw._wf_shutdown()
+
+    return myModel, res
+
+
+class MyTest(unittest.TestCase):
+    def testclasses(self):
+        with mock.patch.object(wf, "classesFunction", return_value=None):
+            perclass, reference = runtopoflex("unittestperclass")
+        self.assertEqual(perclass.beforeClassFunctions, [])
+        self.assertEqual(perclass.afterClassFunctions, [])
+
+        myModel, res = runtopoflex("unittestclasses")
+        self.assertTrue(myModel.beforeClassFunctions or myModel.afterClassFunctions)
+
+        for ts, (step, refstep) in enumerate(zip(res, reference)):
+            for var in STATES + FLUXES:
+                np.testing.assert_allclose(
+                    step[var],
+                    refstep[var],
+                    rtol=1e-5,
+                    atol=1e-6,
+                    err_msg="%s at step %d" % (var, ts + 1),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
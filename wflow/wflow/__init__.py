@@ -9,8 +9,6 @@ __all__ = [
 import os
 import sys
 
-import osgeo.gdal as gdal
-
 if getattr(sys, "frozen", False):
     # running in a bundle
     # sys._MEIPASS is set by PyInstaller
@@ -19,9 +17,9 @@ if getattr(sys, "frozen", False):
     if not basedir:
         basedir = os.path.dirname(sys.executable)
 
-    # use the included gdal-data
-    gdal_data_path = os.path.join(basedir, "gdal-data")
-    gdal.SetConfigOption("GDAL_DATA", gdal_data_path)
+    # use the included gdal-data, gdal is not imported here (this is slow) but
+    # reads the environment variable when it is loaded
+    os.environ["GDAL_DATA"] = os.path.join(basedir, "gdal-data")
 
     # set environment variable instead of pyproj_datadir such
     # that child processes will inherit it
@@ -200,6 +200,114 @@ def netcdf2PCRobjCloneWithoutTime(
     return outPCR
 
 
+# variable names in PCR-GLOBWB and the names used in the netcdf files
+ncVariableAliases = {
+    "evapotranspiration": "referencePotET",
+    "kc": "Cropcoefficient",
+    "interceptCapInput": "Interceptioncapacity",
+    "coverFractionInput": "Coverfraction",
+    "fracVegCover": "vegetation_fraction",
+    "minSoilDepthFrac": "minRootDepthFraction",
+    "maxSoilDepthFrac": "maxRootDepthFraction",
+    "arnoBeta": "arnoSchemeBeta",
+}
+
+# reader cache: one reader for each (file, variable)
+readercache = dict()
+
+
+class NetcdfCloneReader:
+    """
+    Reads the timesteps of one variable in a netcdf file (cached in filecache).
+    The time table, the first and last year and the variable aliasing are
+    determined once. Each read also fetches the next prefetch-1 timesteps so
+    sequential reads are served from memory.
+    """
+
+    def __init__(self, ncFile, varName, LatitudeLongitude=True, prefetch=2):
+
+        if ncFile in list(filecache.keys()):
+            f = filecache[ncFile]
+        else:
+            f = nc.Dataset(ncFile)
+            filecache[ncFile] = f
+
+        if LatitudeLongitude == True:
+            try:
+                f.variables["lat"] = f.variables["latitude"]
+                f.variables["lon"] = f.variables["longitude"]
+            except:
+                pass
+
+        varName = str(varName)
+        if varName in ncVariableAliases:
+            try:
+                f.variables[varName] = f.variables[ncVariableAliases[varName]]
+            except:
+                pass
+
+        self.ncFile = ncFile
+        self.varName = varName
+        self.variable = f.variables[varName]
+        self.fillValue = float(self.variable._FillValue)
+        self.prefetch = max(int(prefetch), 1)
+        self.first = None
+        self.buffer = None
+
+        if "time" in f.variables:
+            self.time = f.variables["time"]
+            self.units = self.time.units
+            self.calendar = self.time.calendar
+            self.timevalues = np.asarray(self.time[:], dtype=np.float64)
+            self.first_year = findFirstYearInNCTime(self.time)
+            self.last_year = findLastYearInNCTime(self.time)
+
+    def getIndex(self, date, select="exact"):
+        """
+        Index of date in the time table (as cftime.date2index). Raises a
+        ValueError if there is no matching time.
+        """
+        value = cftime.date2num(date, self.units, calendar=self.calendar)
+        if select == "exact":
+            idx = np.searchsorted(self.timevalues, value)
+            if idx < self.timevalues.size and self.timevalues[idx] == value:
+                return int(idx)
+        elif select == "before":
+            idx = np.searchsorted(self.timevalues, value, side="right") - 1
+            if idx >= 0:
+                return int(idx)
+        elif select == "after":
+            idx = np.searchsorted(self.timevalues, value, side="left")
+            if idx < self.timevalues.size:
+                return int(idx)
+        raise ValueError(
+            "No " + select + " match for " + str(date) + " in " + str(self.ncFile)
+        )
+
+    def read(self, idx):
+        """
+        Returns the (masked) data of timestep idx
+        """
+        if (
+            self.buffer is None
+            or idx < self.first
+            or idx >= self.first + self.buffer.shape[0]
+        ):
+            self.first = idx
+            self.buffer = self.variable[idx : idx + self.prefetch, :, :]
+        return self.buffer[idx - self.first]
+
+
+def getNetcdfCloneReader(ncFile, varName, LatitudeLongitude=True):
+    """
+    Returns the cached reader of a (file, variable)
+    """
+    key = (ncFile, str(varName), LatitudeLongitude)
+    if key not in readercache:
+        readercache[key] = NetcdfCloneReader(ncFile, varName, LatitudeLongitude)
+    return readercache[key]
+
+
 def netcdf2PCRobjClone(
     ncFile,
     varName,
@@ -215,89 +323,16 @@ def netcdf2PCRobjClone(
     #     Only works if cells are 'square'.
     #     Only works if cellsizeClone <= cellsizeInput
     # Get netCDF file and variable name:
+    #
+    # The time table, the first/last year and the variable aliases are
+    # determined once per (file, variable), see NetcdfCloneReader.
 
     # ~ print ncFile
 
     logger.debug("reading variable: " + str(varName) + " from the file: " + str(ncFile))
 
-    if ncFile in list(filecache.keys()):
-        f = filecache[ncFile]
-        # ~ print "Cached: ", ncFile
-    else:
-        f = nc.Dataset(ncFile)
-        filecache[ncFile] = f
-        # ~ print "New: ", ncFile
-
-    varName = str(varName)
-
-    if LatitudeLongitude == True:
-        try:
-            f.variables["lat"] = f.variables["latitude"]
-            f.variables["lon"] = f.variables["longitude"]
-        except:
-            pass
-
-    if varName == "evapotranspiration":
-        try:
-            f.variables["evapotranspiration"] = f.variables["referencePotET"]
-        except:
-            pass
-
-    if varName == "kc":  # the variable name in PCR-GLOBWB
-        try:
-            f.variables["kc"] = f.variables[
-                "Cropcoefficient"
-            ]  # the variable name in the netcdf file
-        except:
-            pass
-
-    if varName == "interceptCapInput":  # the variable name in PCR-GLOBWB
-        try:
-            f.variables["interceptCapInput"] = f.variables[
-                "Interceptioncapacity"
-            ]  # the variable name in the netcdf file
-        except:
-            pass
-
-    if varName == "coverFractionInput":  # the variable name in PCR-GLOBWB
-        try:
-            f.variables["coverFractionInput"] = f.variables[
-                "Coverfraction"
-            ]  # the variable name in the netcdf file
-        except:
-            pass
-
-    if varName == "fracVegCover":  # the variable name in PCR-GLOBWB
-        try:
-            f.variables["fracVegCover"] = f.variables[
-                "vegetation_fraction"
-            ]  # the variable name in the netcdf file
-        except:
-            pass
-
-    if varName == "minSoilDepthFrac":  # the variable name in PCR-GLOBWB
-        try:
-            f.variables["minSoilDepthFrac"] = f.variables[
-                "minRootDepthFraction"
-            ]  # the variable name in the netcdf file
-        except:
-            pass
-
-    if varName == "maxSoilDepthFrac":  # the variable name in PCR-GLOBWB
-        try:
-            f.variables["maxSoilDepthFrac"] = f.variables[
-                "maxRootDepthFraction"
-            ]  # the variable name in the netcdf file
-        except:
-            pass
-
-    if varName == "arnoBeta":  # the variable name in PCR-GLOBWB
-        try:
-            f.variables["arnoBeta"] = f.variables[
-                "arnoSchemeBeta"
-            ]  # the variable name in the netcdf file
-        except:
-            pass
+    reader = getNetcdfCloneReader(ncFile, varName, LatitudeLongitude)
+    varName = reader.varName
 
     # date
     date = dateInput
@@ -327,8 +362,8 @@ def netcdf2PCRobjClone(
             date = datetime.datetime(date.year, date.month, int(1))
         if useDoy == "yearly" or useDoy == "monthly" or useDoy == "daily_seasonal":
             # if the desired year is not available, use the first year or the last year that is available
-            first_year_in_nc_file = findFirstYearInNCTime(f.variables["time"])
-            last_year_in_nc_file = findLastYearInNCTime(f.variables["time"])
+            first_year_in_nc_file = reader.first_year
+            last_year_in_nc_file = reader.last_year
             #
             if date.year < first_year_in_nc_file:
                 if (
@@ -393,12 +428,7 @@ def netcdf2PCRobjClone(
                 # msg += "\n"
                 logger.warning(msg)
         try:
-            idx = cftime.date2index(
-                date,
-                f.variables["time"],
-                calendar=f.variables["time"].calendar,
-                select="exact",
-            )
+            idx = reader.getIndex(date, select="exact")
             msg = (
                 "The date "
                 + str(date.year)
@@ -421,12 +451,7 @@ def netcdf2PCRobjClone(
             )
             logger.debug(msg)
             try:
-                idx = cftime.date2index(
-                    date,
-                    f.variables["time"],
-                    calendar=f.variables["time"].calendar,
-                    select="before",
-                )
+                idx = reader.getIndex(date, select="before")
                 # msg  = "\n"
                 msg = (
                     "WARNING related to the netcdf file: "
@@ -446,12 +471,7 @@ def netcdf2PCRobjClone(
                 )
                 # msg += "\n"
             except:
-                idx = cftime.date2index(
-                    date,
-                    f.variables["time"],
-                    calendar=f.variables["time"].calendar,
-                    select="after",
-                )
+                idx = reader.getIndex(date, select="after")
                 # msg  = "\n"
                 msg = (
                     "WARNING related to the netcdf file: "
@@ -475,74 +495,15 @@ def netcdf2PCRobjClone(
     idx = int(idx)
     logger.debug("Using the date index " + str(idx))
 
-    #    sameClone = True
-    #    # check whether clone and input maps have the same attributes:
-    #    if cloneMapFileName != None:
-    #        # get the attributes of cloneMap
-    #        #attributeClone = getMapAttributesALL(cloneMapFileName)
-    #        #cellsizeClone = attributeClone['cellsize']
-    #        #rowsClone = attributeClone['rows']
-    #        #colsClone = attributeClone['cols']
-    #        #xULClone = attributeClone['xUL']
-    #        #yULClone = attributeClone['yUL']
-    #        attributeClone = getgridparams()
-    #        cellsizeClone = attributeClone[2]
-    #        rowsClone = attributeClone[4]
-    #        colsClone = attributeClone[5]
-    #        xULClone = attributeClone[0] - 0.5*cellsizeClone
-    #        yULClone = attributeClone[1] + 0.5*cellsizeClone
-    #        # get the attributes of input (netCDF)
-    #        cellsizeInput = f.variables['lat'][0]- f.variables['lat'][1]
-    #        cellsizeInput = float(cellsizeInput)
-    #        rowsInput = len(f.variables['lat'])
-    #        colsInput = len(f.variables['lon'])
-    #        xULInput = f.variables['lon'][0]-0.5*cellsizeInput
-    #        yULInput = f.variables['lat'][0]+0.5*cellsizeInput
-    #        # check whether both maps have the same attributes
-    #        if cellsizeClone != cellsizeInput: sameClone = False
-    #        if rowsClone != rowsInput: sameClone = False
-    #        if colsClone != colsInput: sameClone = False
-    #        if xULClone != xULInput: sameClone = False
-    #        if yULClone != yULInput: sameClone = False
-
-    cropData = f.variables[varName][int(idx), :, :]  # still original data
-    #    factor = 1                          # needed in regridData2FinerGrid
+    # the data in the file must match the clone, so no cropping/regridding is needed
+    cropData = reader.read(idx)  # still original data
 
-    #    if sameClone == False:
-    #
-    #        logger.debug('Crop to the clone map with lower left corner (x,y): '+str(xULClone)+' , '+str(yULClone))
-    #        # crop to cloneMap:
-    #        #~ xIdxSta = int(np.where(f.variables['lon'][:] == xULClone + 0.5*cellsizeInput)[0])
-    #        minX    = min(abs(f.variables['lon'][:] - (xULClone + 0.5*cellsizeInput))) # ; print(minX)
-    #        xIdxSta = int(np.where(abs(f.variables['lon'][:] - (xULClone + 0.5*cellsizeInput)) == minX)[0])
-    #        xIdxEnd = int(math.ceil(xIdxSta + colsClone /(cellsizeInput/cellsizeClone)))
-    #        #~ yIdxSta = int(np.where(f.variables['lat'][:] == yULClone - 0.5*cellsizeInput)[0])
-    #        minY    = min(abs(f.variables['lat'][:] - (yULClone - 0.5*cellsizeInput))) # ; print(minY)
-    #        yIdxSta = int(np.where(abs(f.variables['lat'][:] - (yULClone - 0.5*cellsizeInput)) == minY)[0])
-    #        yIdxEnd = int(math.ceil(yIdxSta + rowsClone /(cellsizeInput/cellsizeClone)))
-    #        cropData = f.variables[varName][idx,yIdxSta:yIdxEnd,xIdxSta:xIdxEnd]
-    #
-    #        factor = int(round(float(cellsizeInput)/float(cellsizeClone)))
-    #        if factor > 1: logger.debug('Resample: input cell size = '+str(float(cellsizeInput))+' ; output/clone cell size = '+str(float(cellsizeClone)))
-
-    # convert to PCR object and close f
+    # convert to PCR object
     if specificFillValue != None:
-        outPCR = pcr.numpy2pcr(
-            pcr.Scalar,
-            cropData,
-            #                  regridData2FinerGrid(factor,cropData,MV), \
-            float(specificFillValue),
-        )
+        outPCR = pcr.numpy2pcr(pcr.Scalar, cropData, float(specificFillValue))
     else:
-        outPCR = pcr.numpy2pcr(
-            pcr.Scalar,
-            cropData,
-            #                  regridData2FinerGrid(factor,cropData,MV), \
-            float(f.variables[varName]._FillValue),
-        )
+        outPCR = pcr.numpy2pcr(pcr.Scalar, cropData, reader.fillValue)
 
-    # f.close();
-    f = None
     cropData = None
     # PCRaster object
     return outPCR
@@ -80,6 +80,24 @@ def agriZone_no_reservoir(self, k):
     )
 
 
+def agriZone_no_reservoir_classes(self):
+    """
+    agriZone_no_reservoir for all classes at once
+    """
+    self.Qa_.set(0.0)
+    self.Ea_.set(0.0)
+    self.Sa.set(0.0)
+    self.Fa_.set(np.maximum(self.Pe_.array, 0))
+    self.wbSa_.set(
+        self.Pe_.array
+        - self.Ea_.array
+        - self.Qa_.array
+        - self.Fa_.array
+        - self.Sa.array
+        + self.Sa_t.array
+    )
+
+
 def agriZone_Jarvis(self, k):
     """
     - Potential evaporation is decreased by energy used for interception evaporation    
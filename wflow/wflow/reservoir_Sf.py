@@ -12,6 +12,7 @@ try:
     from wflow.wf_DynamicFramework import *
 except ImportError:
     from .wf_DynamicFramework import *
+from .reservoir_classes import mapArray
 
 
 def selectSfR(i):
@@ -59,6 +60,24 @@ def fastAgriRunoff_no_reservoir(self, k):
     )
 
 
+def fastAgriRunoff_no_reservoir_classes(self):
+    """
+    fastAgriRunoff_no_reservoir for all classes at once
+    """
+    convQa = np.stack([mapArray(sum(self.convQa[k])) for k in self.Classes])
+    convQa_t = np.stack([mapArray(sum(self.convQa_t[k])) for k in self.Classes])
+    self.Qfa_.set(self.Qa_.array)
+    self.Sfa.set(0.0)
+    self.wbSfa_.set(
+        self.Qfa_.array
+        - self.Qfa_.array
+        - self.Sfa.array
+        + self.Sfa_t.array
+        - convQa
+        + convQa_t
+    )
+
+
 # @profile
 def fastRunoff_lag2(self, k):
     """
@@ -437,8 +456,7 @@ def kinematic_wave_routing(self):
     q = self.Qtotal / self.DCL
     self.OldSurfaceRunoff = self.Qstate
 
-    self.Qstate = pcr.kinematic(
-        self.TopoLdd,
+    self.Qstate = self.Router.kinematic(
         self.Qstate,
         q,
         self.Alpha,
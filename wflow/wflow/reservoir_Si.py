@@ -12,6 +12,7 @@ try:
 except ImportError:
     from .wf_DynamicFramework import *
 from . import JarvisCoefficients
+from .reservoir_classes import mapArray
 
 
 def selectSiR(i):
@@ -42,6 +43,23 @@ def interception_no_reservoir(self, k):
     )
 
 
+def interception_no_reservoir_classes(self):
+    """
+    interception_no_reservoir for all classes at once
+    """
+    Precipitation = mapArray(self.Precipitation)
+    self.Pe_.set(np.maximum(Precipitation, 0))
+    self.Ei_.set(0.0)
+    self.Si_.set(0.0)
+    self.wbSi_.set(
+        Precipitation
+        - self.Ei_.array
+        - self.Pe_.array
+        - self.Si.array
+        + self.Si_t.array
+    )
+
+
 def interception_overflow2(self, k):
     """
     - Effective rainfall is all that does not fit into the interception reservoir
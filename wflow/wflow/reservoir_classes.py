@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+States and fluxes of all classes of wflow_topoflex in one array
+
+The reservoir functions that work on a single class k use stack[k] as a PCRaster
+map, the reservoir functions for all classes (named <function>_classes) use the
+(classes x rows x cols) array. The values are only converted between the two
+when the other form is used.
+"""
+
+import numpy as np
+import pcraster as pcr
+
+
+def mapArray(value):
+    """
+    Returns a map (or a single value) as a numpy array, missing values are nan
+    """
+    return pcr.pcr2numpy(pcr.spatial(pcr.scalar(value)), np.nan)
+
+
+class ClassStack(object):
+    """
+    Values (maps) of all classes, see the module documentation
+
+    :var stack[k]: the PCRaster map (or value) of class k
+    :var stack.array: the (classes x rows x cols) array of all classes
+    """
+
+    def __init__(self, maps):
+        self._maps = list(maps)
+        self._array = None
+        self._changed = set(range(len(self._maps)))
+
+    def __len__(self):
+        return len(self._maps)
+
+    def __iter__(self):
+        return (self[k] for k in range(len(self)))
+
+    def __getitem__(self, k):
+        if self._maps[k] is None:
+            values = self._array[k]
+            self._maps[k] = pcr.numpy2pcr(
+                pcr.Scalar, np.where(np.isnan(values), -999.0, values), -999.0
+            )
+        return self._maps[k]
+
+    def __setitem__(self, k, value):
+        self._maps[k] = value
+        self._changed.add(k)
+
+    @property
+    def array(self):
+        if self._changed:
+            if self._array is None:
+                self._array = np.stack([mapArray(m) for m in self._maps])
+            else:
+                for k in self._changed:
+                    self._array[k] = mapArray(self._maps[k])
+            self._changed.clear()
+        return self._array
+
+    def set(self, values):
+        """
+        Sets the values of all classes, values is broadcast to the shape of the array
+        """
+        array = self.array
+        self._array = np.empty_like(array)
+        self._array[...] = values
+        self._maps = [None] * len(self._maps)
+
+    def copy(self):
+        """
+        Returns a copy, used to keep the states of the previous time step
+        """
+        stack = ClassStack(self._maps)
+        stack._array = self.array.copy()
+        stack._changed.clear()
+        return stack
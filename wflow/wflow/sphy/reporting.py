@@ -1,3 +1,10 @@
+import queue
+import threading
+
+import numpy as np
+import pcraster.framework
+
+
 # -Function to report the output
 def REPM(self, pcr, tot, var, fname, outops, TSS=False, MAP=False):
     if outops == "Day":
@@ -39,57 +46,115 @@ def REPM(self, pcr, tot, var, fname, outops, TSS=False, MAP=False):
     return tot
 
 
+# -Class that writes maps in a separate thread
+class MapWriter:
+    def __init__(self, pcr):
+        self.pcr = pcr
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._write)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            values, fname = item
+            self.pcr.report(self.pcr.numpy2pcr(self.pcr.Scalar, values, np.nan), fname)
+
+    def write(self, values, fname):
+        self.queue.put((values.copy(), fname))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+# -Class to report one variable. The reporting options (Day, Month, Year, Final)
+# -are resolved once, totals are kept in numpy arrays and maps are written by a MapWriter
+class Reporter:
+    def __init__(self, model, pcr, tot, writer):
+        self.model = model
+        self.pcr = pcr
+        self.writer = writer
+        self.fname = getattr(model, tot + "_fname", None)
+        self.targets = []
+        for outops in ["Day", "Month", "Year", "Final"]:
+            hasTSS = hasattr(model, tot + "_" + outops + "TS")
+            hasMAP = hasattr(model, tot + "_" + outops + "_map")
+            if hasTSS or hasMAP:
+                TSS = getattr(model, tot + "_" + outops + "TS", False)
+                MAP = getattr(model, tot + "_" + outops + "_map", False)
+                self.targets.append([outops, TSS, MAP, 0.0])
+
+    def report(self, var):
+        if not self.targets:
+            return
+        model = self.model
+        values = self.pcr.pcr2numpy(self.pcr.scalar(var), np.nan)
+        for target in self.targets:
+            outops, TSS, MAP, tot = target
+            if outops == "Day":
+                if TSS:
+                    TSS.sample(var)
+                if MAP:
+                    self.writer.write(values, self.mapname(""))
+                continue
+            # -accumulate in place
+            if isinstance(tot, np.ndarray):
+                tot += values
+            else:
+                tot = values + tot
+                target[3] = tot
+            if outops == "Month":
+                end = (
+                    model.curdate.day
+                    == model.calendar.monthrange(
+                        model.curdate.year, model.curdate.month
+                    )[1]
+                )
+                suffix = "M"
+            elif outops == "Year":
+                if model.calendar.isleap(model.curdate.year):
+                    ydays = 366
+                else:
+                    ydays = 365
+                end = model.timecalc.julian(model)[0] == ydays
+                suffix = "Y"
+            else:
+                end = model.curdate == model.enddate
+                suffix = ".map"
+            if end:
+                if TSS and outops != "Final":
+                    TSS.sample(self.pcr.numpy2pcr(self.pcr.Scalar, tot, np.nan))
+                if outops == "Final":
+                    self.writer.write(tot, model.outpath + self.fname + suffix)
+                elif MAP:
+                    self.writer.write(tot, self.mapname(suffix))
+                target[3] = 0.0
+
+    def mapname(self, suffix):
+        # -same name as the framework report function
+        return pcraster.framework.generateNameT(
+            self.model.outpath + self.fname + suffix, self.model.currentTimeStep()
+        )
+
+
 # -Function to initialise the reporting
 def reporting(self, pcr, tot, var):
-    for outops in ["Day", "Month", "Year", "Final"]:
-        try:
-            TSS = eval("self." + tot + "_" + outops + "TS")
-            try:
-                MAP = eval("self." + tot + "_" + outops + "_map")
-                setattr(
-                    self,
-                    tot + "_" + outops,
-                    REPM(
-                        self,
-                        pcr,
-                        eval("self." + tot + "_" + outops),
-                        var,
-                        eval("self." + tot + "_fname"),
-                        outops,
-                        TSS,
-                        MAP,
-                    ),
-                )
-            except:
-                setattr(
-                    self,
-                    tot + "_" + outops,
-                    REPM(
-                        self,
-                        pcr,
-                        eval("self." + tot + "_" + outops),
-                        var,
-                        eval("self." + tot + "_fname"),
-                        outops,
-                        TSS,
-                    ),
-                )
-        except:
-            try:
-                MAP = eval("self." + tot + "_" + outops + "_map")
-                setattr(
-                    self,
-                    tot + "_" + outops,
-                    REPM(
-                        self,
-                        pcr,
-                        eval("self." + tot + "_" + outops),
-                        var,
-                        eval("self." + tot + "_fname"),
-                        outops,
-                        False,
-                        MAP,
-                    ),
-                )
-            except:
-                pass
+    # -the reporters are created the first time a variable is reported
+    if not hasattr(self, "reporters"):
+        self.reporters = {}
+        self.mapwriter = MapWriter(pcr)
+    if tot not in self.reporters:
+        self.reporters[tot] = Reporter(self, pcr, tot, self.mapwriter)
+    self.reporters[tot].report(var)
+
+
+# -Function to finish the reporting (waits until all maps are written)
+def closereporting(self):
+    if hasattr(self, "mapwriter"):
+        self.mapwriter.close()
+        del self.mapwriter
+        del self.reporters
@@ -35,12 +35,15 @@
 #  get_last_day
 #  get_first_day
 #  get_box_plot_parameters
+#  get_metrics (vectorised NS, KGE, bias, correlation and MAE)
 #
 
 
+import math
 from math import fabs
 from math import sqrt
 
+import numpy as np
 from numpy import isnan
 
 NoDataVal = -999
@@ -795,3 +798,79 @@ def get_box_plot_parameters(values, N="", NoData=NoDataVal):
         MildOutliers,
         ExtremeOutliers,
     )
+
+
+def get_mask(Avalues, Bvalues):
+    """This function returns the mask of the values that can be compared
+    (both values finite) for use in get_metrics. Avalues and Bvalues must
+    have shapes that can be broadcast against each other."""
+    return np.isfinite(Avalues) & np.isfinite(Bvalues)
+
+
+def get_metrics(Avalues, Bvalues, mask=None):
+    """This function computes the nash-sutcliffe efficiency (NS), the
+    Kling-Gupta efficiency (KGE), the bias (mean of A - B), the correlation
+    coefficient (CORR) and the mean absolute error (MABSE) between observed
+    (Avalues) and simulated (Bvalues) data in one pass.
+
+    The arrays are shaped (..., time, stations), e.g. observations as
+    (time x stations) and simulations of many parameter sets as
+    (sets x time x stations); they are broadcast against each other.
+    One dimensional arrays are treated as a single station. The mask
+    (same broadcasting rules, True for values to use) is computed with
+    get_mask if it is not given, so it can be determined once and reused.
+    MABSE is square-rooted, as in get_mean_absolute_error.
+
+    A dictionary with arrays shaped (..., stations) for NS, KGE, BIAS, CORR,
+    MABSE and the number of comparisons (N) is returned. Metrics that
+    cannot be computed (no data, zero variance) are nan."""
+    Avalues = np.asarray(Avalues, dtype=np.float64)
+    Bvalues = np.asarray(Bvalues, dtype=np.float64)
+    single = Avalues.ndim == 1 and Bvalues.ndim == 1
+    if Avalues.ndim == 1:
+        Avalues = Avalues[:, np.newaxis]
+    if Bvalues.ndim == 1:
+        Bvalues = Bvalues[:, np.newaxis]
+
+    if mask is None:
+        mask = get_mask(Avalues, Bvalues)
+    else:
+        mask = np.asarray(mask, dtype=bool)
+        if mask.ndim == 1:
+            mask = mask[:, np.newaxis]
+    shape = np.broadcast_shapes(Avalues.shape, Bvalues.shape, mask.shape)
+    mask = np.broadcast_to(mask, shape)
+
+    A = np.where(mask, Avalues, 0.0)
+    B = np.where(mask, Bvalues, 0.0)
+    N = mask.sum(axis=-2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Amean = A.sum(axis=-2) / N
+        Bmean = B.sum(axis=-2) / N
+        Adev = np.where(mask, A - Amean[..., np.newaxis, :], 0.0)
+        Bdev = np.where(mask, B - Bmean[..., np.newaxis, :], 0.0)
+        Avar = (Adev * Adev).sum(axis=-2)
+        Bvar = (Bdev * Bdev).sum(axis=-2)
+        cov = (Adev * Bdev).sum(axis=-2)
+        diff = A - B
+
+        res = {}
+        res["N"] = N
+        res["NS"] = 1.0 - (diff * diff).sum(axis=-2) / Avar
+        res["BIAS"] = diff.sum(axis=-2) / N
+        res["MABSE"] = np.sqrt(np.abs(diff).sum(axis=-2) / N)
+        res["CORR"] = cov / np.sqrt(Avar * Bvar)
+        alpha = np.sqrt(Bvar / Avar)
+        beta = Bmean / Amean
+        res["KGE"] = 1.0 - np.sqrt(
+            (res["CORR"] - 1.0) ** 2 + (alpha - 1.0) ** 2 + (beta - 1.0) ** 2
+        )
+
+    for key in res:
+        if key != "N":
+            res[key] = np.where(np.isfinite(res[key]), res[key], np.nan)
+        if single:
+            res[key] = res[key][..., 0]
+
+    return res
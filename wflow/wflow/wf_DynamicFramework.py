@@ -13,6 +13,7 @@ and interrogate the model.
 # TODO: Fix timestep not forewarding in BMI runs (for reading writing maps)
 
 import calendar
+import concurrent.futures
 import configparser
 import csv
 import datetime
@@ -499,6 +500,20 @@ class wf_OutputTimeSeriesArea:
             # self.flatres = np.insert(self.flatres,0,self.steps)
 
 
+def _writeStates(path, states):
+    """
+    Writes the state container made by wf_suspendContainer (npz: compressed,
+    otherwise npy). A temporary file is renamed so the container is always complete.
+    """
+    tmpfile = path + ".tmp"
+    with open(tmpfile, "wb") as f:
+        if path.endswith(".npz"):
+            np.savez_compressed(f, states=states)
+        else:
+            np.save(f, states)
+    os.replace(tmpfile, path)
+
+
 class wf_DynamicFramework(pcraster.framework.frameworkBase.FrameworkBase):
     ## \brief Constructor
     #
@@ -517,6 +532,10 @@ class wf_DynamicFramework(pcraster.framework.frameworkBase.FrameworkBase):
     ):
         pcraster.framework.frameworkBase.FrameworkBase.__init__(self)
 
+        # time from the creation of the framework to the end of the first timestep
+        self._startTime = time.time()
+        self.startupTime = None
+
         self.ParamType = namedtuple(
             "ParamType", "name stack type default verbose lookupmaps"
         )
@@ -549,6 +568,10 @@ class wf_DynamicFramework(pcraster.framework.frameworkBase.FrameworkBase):
         self.setviaAPI = {}
         # Flag for each variable. If 1 it is set by the API before this timestep. Reset is done at the end of each timestep
 
+        # background writer of the state containers (see wf_suspendContainer)
+        self._stateWriter = None
+        self._stateWrites = []
+
         if firstTimestep > lastTimeStep:
             msg = (
                 "Cannot run dynamic framework: Start timestep smaller than end timestep"
@@ -879,6 +902,7 @@ class wf_DynamicFramework(pcraster.framework.frameworkBase.FrameworkBase):
         """
         Makes sure the logging closed
         """
+        self.wf_waitStates()
         if hasattr(self, "NcOutput"):
             self.NcOutput.finish()
 
@@ -1394,6 +1418,9 @@ class wf_DynamicFramework(pcraster.framework.frameworkBase.FrameworkBase):
         self.ncinfilestates = configget(
             self._userModel().config, "framework", "netcdfstatesinput", "None"
         )
+        self.statecontainer = configget(
+            self._userModel().config, "framework", "statecontainer", "None"
+        )
         self.ncoutfile = configget(
             self._userModel().config, "framework", "netcdfoutput", "None"
         )
@@ -1758,8 +1785,9 @@ class wf_DynamicFramework(pcraster.framework.frameworkBase.FrameworkBase):
 
     def wf_suspend(self, directory):
         """
-        Suspend the state variables to disk as .map files
-        Also saves the summary maps
+        Suspend the state variables to disk as .map files (or to a single
+        container if statecontainer is set in the framework section, see
+        wf_suspendContainer). Also saves the summary maps
 
         """
 
@@ -1768,43 +1796,108 @@ class wf_DynamicFramework(pcraster.framework.frameworkBase.FrameworkBase):
 
         allvars = self._userModel().stateVariables()
 
-        for var in allvars:
-            try:
-                fname = os.path.join(directory, var).replace("\\", "/") + ".map"
-                # savevar = getattr(self._userModel(), var)
-                savevar = reduce(getattr, var.split("."), self._userModel())
-
-                try:  # Check if we have a list of maps
-                    b = len(savevar)
-                    a = 0
-                    for z in savevar:
-                        fname = (
-                            os.path.join(directory, var + "_" + str(a)).replace(
-                                "\\", "/"
+        if self.statecontainer != "None":
+            self.wf_suspendContainer(directory)
+        else:
+            for var in allvars:
+                try:
+                    fname = os.path.join(directory, var).replace("\\", "/") + ".map"
+                    # savevar = getattr(self._userModel(), var)
+                    savevar = reduce(getattr, var.split("."), self._userModel())
+
+                    try:  # Check if we have a list of maps
+                        b = len(savevar)
+                        a = 0
+                        for z in savevar:
+                            fname = (
+                                os.path.join(directory, var + "_" + str(a)).replace(
+                                    "\\", "/"
+                                )
+                                + ".map"
                             )
-                            + ".map"
-                        )
 
+                            self.reportState(
+                                pcr.cover(z), fname, style=1, gzipit=False, longname=fname
+                            )
+                            a = a + 1
+                    except:
+                        # thevar = getattr(self._userModel(), var)
+                        thevar = reduce(getattr, var.split("."), self._userModel())
                         self.reportState(
-                            pcr.cover(z), fname, style=1, gzipit=False, longname=fname
+                            thevar, fname, style=1, gzipit=False, longname=fname
                         )
-                        a = a + 1
                 except:
-                    # thevar = getattr(self._userModel(), var)
-                    thevar = reduce(getattr, var.split("."), self._userModel())
-                    self.reportState(
-                        thevar, fname, style=1, gzipit=False, longname=fname
-                    )
-            except:
-                self.logger.warning("Problem saving state variable: " + var)
-                # self.logger.warning(execstr)
-                self.logger.warning(sys.exc_info())
+                    self.logger.warning("Problem saving state variable: " + var)
+                    # self.logger.warning(execstr)
+                    self.logger.warning(sys.exc_info())
 
         # Save the summary maps
         self.wf_savesummarymaps()
         self._traceOut("suspend")
         self._decrementIndentLevel()
 
+    def wf_suspendContainer(self, directory):
+        """
+        Suspend the state variables to a single file in directory, the name is set
+        with statecontainer in the framework section. If the name ends with .npz
+        the file is compressed, otherwise it is a .npy file that is memory-mapped
+        when resumed.
+
+        The file holds one structured numpy array with a (rows x cols) field for
+        each map, lists of maps are saved as var_0, var_1, ... The field names are
+        the manifest of the container. The maps are converted in the model thread,
+        the file is written in a background thread: use wf_waitStates to wait until
+        it is on disk.
+        """
+        states = self.wf_supplyStatesAsNumpy()
+        if self._stateWriter is None:
+            self._stateWriter = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        path = os.path.join(directory, self.statecontainer)
+        self.logger.debug(
+            "Writing " + str(len(states.dtype.names)) + " state maps to " + path
+        )
+        self._stateWrites.append(self._stateWriter.submit(_writeStates, path, states))
+
+    def wf_supplyStatesAsNumpy(self):
+        """
+        Returns a copy of all state variables as one structured numpy array with a
+        (rows x cols) field for each map, lists of maps are stored as var_0,
+        var_1, ... Missing values are nan.
+        """
+        names = []
+        data = []
+        for var in self._userModel().stateVariables():
+            try:
+                savevar = reduce(getattr, var.split("."), self._userModel())
+                try:  # Check if we have a list of maps
+                    len(savevar)
+                    maps = [(var + "_" + str(a), z) for a, z in enumerate(savevar)]
+                except TypeError:
+                    maps = [(var, savevar)]
+                for name, z in maps:
+                    data.append(pcr.pcr2numpy(pcr.spatial(pcr.scalar(z)), np.nan))
+                    names.append(name)
+            except:
+                self.logger.warning("Problem saving state variable: " + var)
+                self.logger.warning(sys.exc_info())
+
+        shape = (pcr.clone().nrRows(), pcr.clone().nrCols())
+        states = np.zeros((), dtype=[(name, np.float32, shape) for name in names])
+        for name, arr in zip(names, data):
+            states[name] = arr
+
+        return states
+
+    def wf_waitStates(self):
+        """
+        Waits until all state containers of wf_suspendContainer are written, an
+        error of the background writer is raised here
+        """
+        writes = self._stateWrites
+        self._stateWrites = []
+        for write in writes:
+            write.result()
+
     def wf_saveTimeSeries(self):
         """
         Print .ini defined output csv/tss timeseries per timestep
@@ -2033,13 +2126,21 @@ class wf_DynamicFramework(pcraster.framework.frameworkBase.FrameworkBase):
     def wf_resume(self, directory):
         """
         Resumes the state variables from disk as .map files (or arrays of maps files using
-        a _? postfix)
+        a _? postfix). If statecontainer is set in the framework section and the
+        container exists in directory the states are read from the container.
 
         """
         self._incrementIndentLevel()
         self._traceIn("resume")
         allvars = self._userModel().stateVariables()
 
+        self.wf_waitStates()
+        if self.statecontainer != "None" and os.path.exists(
+            os.path.join(directory, self.statecontainer)
+        ):
+            self.wf_resumeContainer(os.path.join(directory, self.statecontainer))
+            allvars = []
+
         for var in allvars:
             # First try to read a stack of state files
             stop = 0
@@ -2096,6 +2197,60 @@ class wf_DynamicFramework(pcraster.framework.frameworkBase.FrameworkBase):
         self._traceOut("resume")
         self._decrementIndentLevel()
 
+    def wf_resumeContainer(self, path):
+        """
+        Resumes the state variables from a container written by wf_suspendContainer
+        with a single read (a .npy container is memory-mapped)
+        """
+        if path.endswith(".npz"):
+            with np.load(path) as f:
+                states = f["states"]
+        else:
+            states = np.load(path, mmap_mode="r")
+        self.wf_setStatesFromNumpy(states, source=path)
+
+    def wf_setStatesFromNumpy(self, states, source="memory"):
+        """
+        Sets all state variables from a structured numpy array as returned by
+        wf_supplyStatesAsNumpy
+        """
+        names = states.dtype.names
+
+        def tomap(name):
+            arr = np.where(np.isnan(states[name]), -999.0, states[name])
+            return pcr.numpy2pcr(pcr.Scalar, arr, -999.0)
+
+        for var in self._userModel().stateVariables():
+            if var + "_0" in names:
+                stack = []
+                while var + "_" + str(len(stack)) in names:
+                    stack.append(tomap(var + "_" + str(len(stack))))
+                self.logger.info(
+                    "state variable "
+                    + str(var)
+                    + " contains "
+                    + str(len(stack))
+                    + " state maps (stack)"
+                )
+                setattr(self._userModel(), var, stack)
+            elif var in names:
+                # check for nested objects
+                if "." in var:
+                    attrs = var.split(".")
+                    c = getattr(self._userModel(), attrs[0])
+                    setattr(c, attrs[1], tomap(var))
+                else:
+                    setattr(self._userModel(), var, tomap(var))
+            else:
+                self.logger.error(
+                    "state variable "
+                    + var
+                    + " not found in "
+                    + source
+                    + " Suggest to use the -I option to restart"
+                )
+                sys.exit(1)
+
     def wf_QuickSuspend(self):
         """
         Save the state variable of the current timestep in memory
@@ -2938,6 +3093,15 @@ class wf_DynamicFramework(pcraster.framework.frameworkBase.FrameworkBase):
             step += 1
             self.setviaAPI = {}
 
+            if self.startupTime is None:
+                # includes the compilation (or loading from the cache) of the
+                # numba kernels, these are compiled on first use
+                self.startupTime = time.time() - self._startTime
+                self.logger.info(
+                    "Startup time (until the end of the first timestep): %.2f seconds"
+                    % self.startupTime
+                )
+
         self._userModel()._setInDynamic(False)
 
     ## \brief Re-implemented from ShellScript.
@@ -0,0 +1,445 @@
+"""
+wf_calib
+--------
+
+Parallel calibration engine for wflow models. Used by wflow_fit and
+wflow_fit_brute.
+
+Each worker process holds one model instance. The model is initialised
+(``_runInitial``/``_runResume``) only once per worker; the initial states and
+the original values of the calibration parameters are kept in memory and are
+restored before each parameter set is evaluated. Simulated discharge is
+sampled directly from the model in memory at the gauge locations, so no
+tss file has to be written and read back.
+
+The model state at the end of the warm-up period can be kept in memory as a
+checkpoint. The checkpoint is keyed by the area code and the multipliers of
+the parameters that affect the warm-up (warmuppars); parameter sets that only
+differ in the other parameters (e.g. routing parameters) resume from the
+checkpoint and only run the period after the warm-up. Leaving a parameter out
+of warmuppars means accepting that its effect on the state at the end of the
+warm-up is neglected.
+
+Results of finished parameter sets are appended to a csv file (the results
+store). If a calibration is interrupted, re-running it with the same results
+file skips all sets whose multipliers are already in the store. Results are
+matched by their multipliers, not by the number of the set, so changing the
+ranges of the parameters never reuses the results of other multipliers.
+
+usage (from python)::
+
+    import itertools
+    import wflow.wf_calib as calib
+
+    workerargs = dict(modeltofit="wflow_hbv", casename="rhine",
+                      runId="calib", configfile="wflow_hbv.ini",
+                      startTime=1, stopTime=365,
+                      calibpars=["FC", "BetaSeepage"])
+    parsets = itertools.product([0.8, 1.0, 1.2], [0.9, 1.0, 1.1])
+    res = calib.calibrate(parsets, workerargs, qmeas, colsim=0,
+                          resultsfile="rhine/calib/results.csv", ncpu=8)
+
+"""
+
+import copy
+import csv
+import importlib
+import multiprocessing
+import multiprocessing.util
+import os
+import shutil
+import sys
+from collections import OrderedDict
+from functools import reduce
+
+import numpy as np
+import pcraster as pcr
+
+from wflow import stats
+
+
+def _import_model(modeltofit):
+    """
+    Import the model module to calibrate. First try it as a module in the wflow
+    package, next as a stand-alone module.
+    """
+    try:
+        return importlib.import_module("wflow." + modeltofit)
+    except ImportError:
+        return importlib.import_module(modeltofit)
+
+
+def warmupkey(pars, calibpars, warmuppars=None):
+    """
+    Returns the key of the warm-up checkpoint for a parameter set: the
+    multipliers of the parameters in warmuppars (all if None).
+    """
+    if warmuppars is None:
+        warmuppars = calibpars
+    return tuple(
+        float(mult) for par, mult in zip(calibpars, pars) if par in warmuppars
+    )
+
+
+class wf_CalibWorker:
+    """
+    A wflow model that can be run many times with different parameter
+    multipliers without re-initialising it from disk.
+    """
+
+    def __init__(
+        self,
+        modeltofit,
+        casename,
+        runId,
+        configfile,
+        startTime,
+        stopTime,
+        calibpars,
+        areamap="wflow_catchment.map",
+        areacode=1,
+        qvar="SurfaceRunoff",
+        gaugemap="staticmaps/wflow_gauges.map",
+        clonemap="wflow_subcatch.map",
+        loglevel=30,
+        warmupsteps=0,
+        warmuppars=None,
+        warmupcachesize=8,
+    ):
+        self.WF = _import_model(modeltofit)
+        self.caseName = casename
+        self.runId = runId
+        self.startTime = startTime
+        self.stopTime = stopTime
+        self.calibpars = list(calibpars)
+        self.areacode = int(areacode)
+        self.qvar = qvar
+        self.warmupsteps = int(warmupsteps)
+        self.warmuppars = warmuppars
+        self.warmupcachesize = int(warmupcachesize)
+        self.warmupcache = OrderedDict()
+
+        self.myModel = self.WF.WflowModel(clonemap, casename, runId, configfile)
+        self.dynModelFw = self.WF.wf_DynamicFramework(
+            self.myModel, stopTime, startTime
+        )
+        self.dynModelFw.createRunId(NoOverWrite=False, level=loglevel)
+        self.log = self.dynModelFw._userModel().logger
+
+        # Initialise once, everything after this is done in memory
+        self.dynModelFw._runInitial()
+        self.dynModelFw._runResume()
+        self.DT = copy.copy(self.dynModelFw.DT)
+        self.orgstates = self.getstates()
+        self.orgpars = {}
+        for par in self.calibpars:
+            self.orgpars[par] = self.dynModelFw.wf_supplyMapAsPcrMap(par)
+
+        self.area = pcr.readmap(os.path.join(casename, areamap))
+        gauges = pcr.pcr2numpy(pcr.readmap(os.path.join(casename, gaugemap)), 0)
+        # Same column order as the pcraster timeseries output (sorted by id)
+        self.gaugeids, self.gaugeidx = np.unique(gauges.flatten(), return_index=True)
+        self.gaugeidx = self.gaugeidx[self.gaugeids > 0]
+        self.gaugeids = self.gaugeids[self.gaugeids > 0]
+
+    def getstates(self):
+        """
+        Returns a dictionary with (references to) the current state variables
+        of the model. The pcraster maps are not changed in place by the
+        models so references are enough.
+        """
+        states = {}
+        for var in self.myModel.stateVariables():
+            val = reduce(getattr, var.split("."), self.myModel)
+            if isinstance(val, list):
+                val = list(val)
+            elif isinstance(val, np.ndarray):
+                val = val.copy()
+            states[var] = val
+
+        return states
+
+    def setstates(self, states):
+        """
+        Sets the state variables of the model from a dictionary made
+        by getstates()
+        """
+        for var in states:
+            val = states[var]
+            if isinstance(val, list):
+                val = list(val)
+            elif isinstance(val, np.ndarray):
+                val = val.copy()
+            attrs = var.split(".")
+            obj = reduce(getattr, attrs[:-1], self.myModel)
+            setattr(obj, attrs[-1], val)
+
+    def setpars(self, pars):
+        """
+        Multiply the original parameter maps with pars within the area
+        given by the areacode.
+        """
+        inarea = self.area == self.areacode
+        for par, mult in zip(self.calibpars, pars):
+            themap = pcr.ifthenelse(
+                inarea, self.orgpars[par] * float(mult), self.orgpars[par]
+            )
+            self.dynModelFw.wf_setValuesAsPcrMap(par, themap)
+
+    def resettime(self):
+        """
+        Set the framework back to the start of the run
+        """
+        self.dynModelFw.DT = copy.copy(self.DT)
+        self.dynModelFw._update_time_from_DT()
+
+    def sample(self):
+        """
+        Returns the value of the discharge variable at the gauges for the
+        current timestep.
+        """
+        qmap = pcr.pcr2numpy(getattr(self.myModel, self.qvar), np.nan)
+        return qmap.flatten()[self.gaugeidx]
+
+    def run(self, pars):
+        """
+        Run the model for a parameter set and return the simulated discharge
+        as a numpy array (timesteps x gauges). If a warm-up checkpoint exists
+        for the parameter set the run starts at the end of the warm-up.
+        """
+        self.log.info("Running parameter set: " + str(pars))
+        q = np.zeros((self.stopTime - self.startTime, self.gaugeidx.size))
+        start = self.startTime
+        # The area code is part of the key as wflow_fit reuses the worker for
+        # each catchment
+        key = (self.areacode,) + warmupkey(pars, self.calibpars, self.warmuppars)
+
+        if self.warmupsteps > 0 and key in self.warmupcache:
+            states, DT, qwarm = self.warmupcache[key]
+            self.warmupcache.move_to_end(key)
+            self.dynModelFw.DT = copy.copy(DT)
+            self.dynModelFw._update_time_from_DT()
+            self.setstates(states)
+            q[: self.warmupsteps, :] = qwarm
+            start = self.startTime + self.warmupsteps
+        else:
+            self.resettime()
+            self.setstates(self.orgstates)
+        self.setpars(pars)
+
+        for ts in range(start, self.stopTime):
+            self.dynModelFw._runDynamic(ts, ts)
+            q[ts - self.startTime, :] = self.sample()
+            if ts == self.startTime + self.warmupsteps - 1:
+                self.savewarmup(key, q[: self.warmupsteps, :])
+
+        return q
+
+    def savewarmup(self, key, qwarm):
+        """
+        Keep the current state as the warm-up checkpoint for key. Only the
+        last warmupcachesize checkpoints are kept.
+        """
+        self.warmupcache[key] = (
+            self.getstates(),
+            copy.copy(self.dynModelFw.DT),
+            qwarm.copy(),
+        )
+        self.warmupcache.move_to_end(key)
+        while len(self.warmupcache) > self.warmupcachesize:
+            self.warmupcache.popitem(last=False)
+
+    def shutdown(self, remove=False):
+        """
+        Shuts the model down, if remove is True the run directory of the
+        worker is removed
+        """
+        self.dynModelFw._wf_shutdown()
+        if remove:
+            for handler in list(self.log.handlers):
+                handler.close()
+                self.log.removeHandler(handler)
+            shutil.rmtree(os.path.join(self.caseName, self.runId), ignore_errors=True)
+
+
+class wf_CalibResults:
+    """
+    Resumable store for calibration results. Each finished parameter set is
+    appended as one row to a csv file and flushed directly. The results are
+    kept (done) by the tuple of multipliers of the set, see key().
+    """
+
+    def __init__(self, filename, calibpars, metrics=("NS", "BIAS", "CORR", "MABSE")):
+        self.filename = filename
+        self.calibpars = list(calibpars)
+        self.metrics = list(metrics)
+        self.header = ["set"] + self.calibpars + self.metrics
+        self.done = {}
+
+        if os.path.exists(filename):
+            with open(filename, "r", newline="") as fp:
+                reader = csv.reader(fp)
+                header = next(reader, None)
+                if header is not None and header != self.header:
+                    raise ValueError(
+                        "Results file "
+                        + filename
+                        + " was made with other parameters: "
+                        + str(header)
+                    )
+                for row in reader:
+                    if len(row) == len(self.header):
+                        values = [float(x) for x in row[1:]]
+                        self.done[self.key(values[: len(self.calibpars)])] = values
+            self.fp = open(filename, "a", newline="")
+            self.writer = csv.writer(self.fp)
+        else:
+            self.fp = open(filename, "w", newline="")
+            self.writer = csv.writer(self.fp)
+            self.writer.writerow(self.header)
+            self.fp.flush()
+
+    @staticmethod
+    def key(pars):
+        """
+        Returns the key of a parameter set in done: the multipliers as floats
+        (these are written to and read from the csv file without loss)
+        """
+        return tuple(float(x) for x in pars)
+
+    def add(self, setnr, pars, metrics):
+        row = [float(x) for x in pars] + [float(metrics[m]) for m in self.metrics]
+        self.done[self.key(pars)] = row
+        self.writer.writerow([setnr] + row)
+        self.fp.flush()
+
+    def rows(self, parsets):
+        """
+        Returns the results of the parameter sets in parsets that are done as a
+        list of [set, pars..., metrics...], set is the index in parsets
+        """
+        return [
+            [nr] + self.done[self.key(pars)]
+            for nr, pars in enumerate(parsets)
+            if self.key(pars) in self.done
+        ]
+
+    def close(self):
+        self.fp.close()
+
+
+def get_metrics(qmeas, qsim):
+    """
+    Returns the goodness of fit of qsim compared to qmeas as a dictionary.
+    Timesteps that are missing (nan) in either series are skipped.
+    """
+    metrics = stats.get_metrics(qmeas, qsim)
+
+    return {key: float(metrics[key]) for key in ("NS", "BIAS", "CORR", "MABSE", "KGE")}
+
+
+# One model instance per worker process
+_worker = None
+
+
+def _init_worker(workerargs):
+    global _worker
+    workerargs = dict(workerargs)
+    # Each worker writes its (unused) output to its own run directory
+    workerargs["runId"] = workerargs.get("runId", "_fitrun") + "_" + str(os.getpid())
+    _worker = wf_CalibWorker(**workerargs)
+    # Remove the run directory when the worker process exits
+    multiprocessing.util.Finalize(None, _exit_worker, exitpriority=10)
+
+
+def _exit_worker():
+    global _worker
+    if _worker is not None:
+        _worker.shutdown(remove=True)
+        _worker = None
+
+
+def _run_worker(task):
+    setnr, pars = task
+    try:
+        return setnr, pars, _worker.run(pars)
+    except Exception:
+        _worker.log.error("Parameter set " + str(pars) + " failed: " + str(sys.exc_info()))
+        return setnr, pars, None
+
+
+def calibrate(
+    parsets,
+    workerargs,
+    qmeas,
+    colsim=0,
+    resultsfile="wflow_fit.csv",
+    ncpu=None,
+    warmupsteps=0,
+    callback=None,
+):
+    """
+    Evaluate all parameter sets in parsets and store the goodness of fit
+    in the resultsfile.
+
+    Input:
+        - parsets - iterable of parameter multiplier sets (e.g. itertools.product)
+        - workerargs - dictionary with the arguments for wf_CalibWorker
+        - qmeas - measured discharge for the timesteps after the warm-up period
+        - colsim - column (gauge) of the simulated discharge to compare with qmeas
+        - resultsfile - csv file to store (and resume) the results in
+        - ncpu - number of worker processes (default: all cpu's), 1 runs in
+          the current process
+        - warmupsteps - number of simulated steps to skip before comparing
+        - callback - optional function(setnr, pars, qsim, metrics) called in
+          the main process for each finished set
+
+    Output:
+        - list of [set, pars..., NS, BIAS, CORR, MABSE]
+    """
+    if ncpu is None:
+        ncpu = multiprocessing.cpu_count()
+
+    workerargs = dict(workerargs)
+    workerargs.setdefault("warmupsteps", warmupsteps)
+    calibpars = workerargs["calibpars"]
+    warmuppars = workerargs.get("warmuppars")
+
+    parsets = [tuple(p) for p in parsets]
+    store = wf_CalibResults(resultsfile, calibpars)
+    todo = [(nr, p) for nr, p in enumerate(parsets) if store.key(p) not in store.done]
+    # Keep sets that share a warm-up checkpoint together so they end up in
+    # the same chunk (and thus worker)
+    todo.sort(key=lambda task: warmupkey(task[1], calibpars, warmuppars))
+    chunksize = max(1, len(todo) // (4 * max(1, ncpu)))
+
+    def _collect(results):
+        for setnr, pars, q in results:
+            if q is None:
+                continue
+            qsim = q[warmupsteps:, colsim]
+            metrics = get_metrics(qmeas, qsim)
+            store.add(setnr, pars, metrics)
+            if callback:
+                callback(setnr, pars, qsim, metrics)
+
+    try:
+        if ncpu <= 1:
+            _init_worker(workerargs)
+            _collect(_run_worker(task) for task in todo)
+            _exit_worker()
+        elif len(todo) > 0:
+            pool = multiprocessing.Pool(
+                processes=min(ncpu, len(todo)),
+                initializer=_init_worker,
+                initargs=(workerargs,),
+            )
+            try:
+                _collect(pool.imap_unordered(_run_worker, todo, chunksize=chunksize))
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        store.close()
+
+    return store.rows(parsets)
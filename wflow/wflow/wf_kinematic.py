@@ -0,0 +1,157 @@
+"""
+wf_kinematic
+------------
+
+Kinematic wave routing engines for the wflow models that use pcr.kinematic
+(wflow_hbv, wflow_routing and wflow_topoflex).
+
+The engine is selected with the RoutingEngine entry in the model section of the
+ini file:
+
+::
+
+    [model]
+    # pcraster (default) or numba
+    RoutingEngine = numba
+
+The numba engine determines the drainage network (set_dd) once and solves the
+kinematic wave per cell from upstream to downstream with the same Newton-Raphson
+scheme as pcr.kinematic (kinematic_wave in wflow_funcs). The initial estimate of
+each cell is the solution of the linear scheme, this is close to the final answer
+so only a few iterations are needed. Both engines return the discharge at the end
+of the time step, so the KinWaveVolume and WaterLevel of the models are
+determined in the same way.
+
+Usage::
+
+    self.Router = kinematicRouter(self.RoutingEngine, self.TopoLdd)
+    self.SurfaceRunoff = self.Router.kinematic(
+        self.SurfaceRunoff, q, self.Alpha, self.Beta, self.Tslice, self.timestepsecs, self.DCL
+    )
+"""
+
+import math
+
+import numpy as np
+import pcraster as pcr
+from numba import jit
+
+from wflow.wflow_funcs import drainage_network, kinematic_wave
+
+
+@jit(nopython=True, cache=True)
+def kinematic_route(nodes, nodes_up, Qold, q, alpha, beta, nrTimeSlices, deltaT, dx):
+    """
+    Kinematic wave for all cells of a drainage network (nodes and nodes_up as made by
+    set_dd) with nrTimeSlices sub steps, as pcr.kinematic.
+
+    Input:
+        - Qold - discharge at the start of the time step [m3/s] (flat array)
+        - q - lateral inflow per unit length [m2/s]
+        - alpha, beta - kinematic wave parameters
+        - nrTimeSlices - number of sub steps
+        - deltaT - length of the time step [s]
+        - dx - length of the cells [m]
+
+    Output:
+        - discharge at the end of the time step [m3/s], nan for cells outside the
+          network or with missing input (this propagates downstream)
+    """
+    ncell = Qold.size
+    dt = deltaT / nrTimeSlices
+    Qprev = Qold.copy()
+    # append zero to end to deal with nodata (-1) in upstream indices
+    Qnew = np.full(ncell + 1, np.nan)
+    Qnew[ncell] = 0.0
+
+    for s in range(nrTimeSlices):
+        for i in range(len(nodes)):
+            for j in range(len(nodes[i])):
+                idx = nodes[i][j]
+                Qin = 0.0
+                for nb in nodes_up[i][j]:
+                    Qin = Qin + Qnew[nb]
+                if (
+                    math.isnan(Qin)
+                    or math.isnan(Qprev[idx])
+                    or math.isnan(q[idx])
+                    or math.isnan(alpha[idx])
+                    or math.isnan(beta[idx])
+                    or math.isnan(dx[idx])
+                ):
+                    Qnew[idx] = np.nan
+                else:
+                    Qnew[idx] = kinematic_wave(
+                        Qin, Qprev[idx], q[idx], alpha[idx], beta[idx], dt, dx[idx]
+                    )
+        Qprev = Qnew[:ncell].copy()
+
+    return Qprev
+
+
+def _flat(pcrmap):
+    """
+    Flat float64 array of a (non)spatial PCRaster map, missing values become nan
+    """
+    return (
+        pcr.pcr2numpy(pcr.spatial(pcr.scalar(pcrmap)), np.nan)
+        .astype(np.float64)
+        .ravel()
+    )
+
+
+class PCRasterRouter(object):
+    """
+    Kinematic wave using pcr.kinematic on a fixed ldd
+    """
+
+    def __init__(self, ldd):
+        self.ldd = ldd
+
+    def kinematic(self, Qold, q, alpha, beta, nrTimeSlices, timestepsecs, dx):
+        return pcr.kinematic(
+            self.ldd, Qold, q, alpha, beta, nrTimeSlices, timestepsecs, dx
+        )
+
+
+class NumbaRouter(PCRasterRouter):
+    """
+    Kinematic wave using kinematic_route on a fixed ldd, the drainage network is
+    only determined once.
+    """
+
+    def __init__(self, ldd, mv=-999.0):
+        PCRasterRouter.__init__(self, ldd)
+        self.mv = mv
+        np_ldd = pcr.pcr2numpy(ldd, 0)
+        self.shape = np_ldd.shape
+        self.nodes, self.nodes_up, rnodes, rnodes_up = drainage_network(np_ldd)
+
+    def kinematic(self, Qold, q, alpha, beta, nrTimeSlices, timestepsecs, dx):
+        Q = kinematic_route(
+            self.nodes,
+            self.nodes_up,
+            _flat(Qold),
+            _flat(q),
+            _flat(alpha),
+            _flat(beta),
+            int(nrTimeSlices),
+            float(timestepsecs),
+            _flat(dx),
+        )
+        Q[np.isnan(Q)] = self.mv
+        return pcr.numpy2pcr(pcr.Scalar, Q.reshape(self.shape), self.mv)
+
+
+def kinematicRouter(engine, ldd):
+    """
+    Returns the kinematic wave router for engine (pcraster or numba) and ldd
+    """
+    if engine == "pcraster":
+        return PCRasterRouter(ldd)
+    elif engine == "numba":
+        return NumbaRouter(ldd)
+    else:
+        raise ValueError(
+            "Unknown RoutingEngine: " + str(engine) + " (use pcraster or numba)"
+        )
@@ -13,14 +13,12 @@ import datetime as dt
 import os
 import sys
 
-import cftime
-import netCDF4
-import osgeo
-import osgeo.ogr
-import pyproj
 import numpy as np
 import pcraster as pcr
 
+# cftime, netCDF4, osgeo and pyproj are imported in the functions that use them,
+# so they are only loaded if a model actually reads or writes netcdf files
+
 globmetadata = {}
 globmetadata["title"] = "wflow output mapstack"
 globmetadata["institution"] = "Deltares"
@@ -42,6 +40,8 @@ def convertCoord(proj_src, proj_trg, x, y):
         X:          NumPy array, vector or 2D array of x-coordinates (target)
         Y:          NumPy array, vector or 2D array of y-coordinates (target)
     """
+    import pyproj
+
     srs1 = pyproj.Proj(proj_src)  # OPT['proj4_params'])
     srs2 = pyproj.Proj(proj_trg)  # wgs84
     X, Y = pyproj.transform(srs1, srs2, x, y)  # Do add 0. to avoid trunc issues.
@@ -68,6 +68,9 @@ def prepare_nc(
     This function prepares a NetCDF file with given metadata, for a certain year, daily basis data
     The function assumes a gregorian calendar and a time unit 'Days since 1900-01-01 00:00:00'
     """
+    import cftime
+    import netCDF4
+    import osgeo.osr
 
     logger.info("Setting up netcdf output: " + trgFile)
 
@@ -305,6 +308,8 @@ class netcdfoutput:
             - var - variable string
             - name - name of the variable
         """
+        import netCDF4
+
         # Open target netCDF file
         var = os.path.basename(var)
         if not self.nc_trg:
@@ -477,6 +482,8 @@ class netcdfoutputstatic:
             - var - variable string
             - name - name of the variable
         """
+        import netCDF4
+
         # Open target netCDF file
         var = os.path.basename(var)
         self.nc_trg = netCDF4.Dataset(
@@ -578,6 +585,8 @@ class netcdfinput:
         logging: python logging object
         vars: list of variables to get from file
         """
+        import cftime
+        import netCDF4
 
         if os.path.exists(netcdffile):
             self.dataset = netCDF4.Dataset(netcdffile, mode="r")
@@ -799,6 +808,8 @@ class netcdfinputstates:
         logging: python logging object
         vars: list of variables to get from file
         """
+        import cftime
+        import netCDF4
 
         self.fname = netcdffile
         if os.path.exists(netcdffile):
@@ -968,6 +979,7 @@ class netcdfinputstatic:
         logging: python logging object
         vars: list of variables to get from file
         """
+        import netCDF4
 
         if os.path.exists(netcdffile):
             self.dataset = netCDF4.Dataset(netcdffile, mode="r")
@@ -0,0 +1,288 @@
+"""
+wf_tasks
+--------
+
+Run a set of tasks (external commands or python functions) in parallel.
+
+Tasks are handled by a pool of maxCpu worker threads. A command is started as a
+subprocess and the worker waits for it to finish, a python function is called in
+the worker thread. Functions that use PCRaster (which has a global clone and is
+not thread safe) must be run with processes=True: they are then called in a pool
+of maxCpu processes and must be picklable (e.g. a functools.partial of a module
+level function). A task can depend on other tasks and is only started once all
+of these have completed successfully. Failed tasks can be retried, the time used by
+each task is logged and returned.
+
+If a state file is given, each completed task is recorded in it. When the same
+tasks are run again (e.g. after a crash or a failed task) the recorded tasks are
+skipped, so a long preprocessing job can be resumed. Remove the state file to
+redo everything.
+
+Usage::
+
+    tasks = [
+        Task("dem", "resample -r 2 case/dem.map new/dem.map"),
+        Task("run1", "wflow_sbm.py -C new -R run1", deps=["dem"], retries=1),
+    ]
+    result = runTasks(tasks, maxCpu=4, statefile="new/tasks.json")
+
+runCommands is kept for scripts that only need to run a list of commands.
+"""
+
+import concurrent.futures
+import json
+import logging
+import os
+import shlex
+import subprocess
+import time
+
+
+class TaskError(Exception):
+    """
+    Raised when one or more tasks failed or could not be scheduled
+    """
+
+    pass
+
+
+class Task(object):
+    """
+    A command (string) or python callable that is run by runTasks.
+
+    :param name: unique name of the task, used for dependencies and the state file
+    :param command: command line to run or callable without arguments
+    :param deps: names of the tasks that must be completed first
+    :param retries: number of times a failed task is started again
+    :param timeout: maximum run time of a command in seconds (None is no limit)
+    """
+
+    def __init__(self, name, command, deps=(), retries=0, timeout=None):
+        self.name = name
+        self.command = command
+        self.deps = list(deps)
+        self.retries = retries
+        self.timeout = timeout
+
+    def signature(self):
+        """
+        Returns a string that identifies what the task does, a task in the state
+        file is only skipped if its signature did not change.
+        """
+        if callable(self.command):
+            # use the wrapped function and the arguments of a functools.partial
+            func = getattr(self.command, "func", self.command)
+            signature = getattr(func, "__name__", repr(func))
+            if hasattr(self.command, "args"):
+                signature += repr(self.command.args)
+            if getattr(self.command, "keywords", None):
+                signature += repr(sorted(self.command.keywords.items()))
+            return signature
+        return self.command
+
+    def run(self, procpool=None):
+        if callable(self.command):
+            if procpool is None:
+                self.command()
+            else:
+                procpool.submit(self.command).result()
+        else:
+            command = self.command.replace(
+                "\\", "/"
+            )  # otherwise shlex.split removes all path separators
+            subprocess.run(shlex.split(command), check=True, timeout=self.timeout)
+
+
+def _attempt(task, logger, procpool=None):
+    """
+    Run a task (with retries) in a worker thread, callables are run in procpool
+    if given
+
+    :return: seconds, number of attempts and the last error (None if the task succeeded)
+    """
+    start = time.time()
+    error = None
+    for attempt in range(1, task.retries + 2):
+        try:
+            task.run(procpool)
+            return time.time() - start, attempt, None
+        except Exception as e:
+            error = e
+            if attempt <= task.retries:
+                logger.warning(
+                    "Task %s failed (%s), retrying (%d)" % (task.name, e, attempt)
+                )
+    return time.time() - start, task.retries + 1, error
+
+
+def _overloaded(maxLoad):
+    """
+    True if the 1 minute load average of the system is above maxLoad
+    """
+    if maxLoad is None or not hasattr(os, "getloadavg"):
+        return False
+    return os.getloadavg()[0] >= maxLoad
+
+
+def readState(statefile):
+    """
+    Read the state file of runTasks, returns an empty dictionary if it does not exist
+    """
+    if statefile is None or not os.path.exists(statefile):
+        return {}
+    with open(statefile, "r") as f:
+        return json.load(f)
+
+
+def writeState(statefile, state):
+    """
+    Write the state file of runTasks. A temporary file is renamed so the
+    state file is always complete.
+    """
+    tmpfile = statefile + ".tmp"
+    with open(tmpfile, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmpfile, statefile)
+
+
+def runTasks(
+    tasks, maxCpu=4, statefile=None, logger=None, maxLoad=None, processes=False
+):
+    """
+    Runs a list of tasks in a pool of maxCpu workers, respecting the dependencies
+    between the tasks.
+
+    Input:
+        - tasks - list of Task objects
+        - maxCpu - maximum number of tasks that run at the same time
+        - statefile - optional json file in which completed tasks are recorded, these
+          are skipped in a next run
+        - logger - logger to use (default: logger of this module)
+        - maxLoad - if set, no new task is started while the 1 minute system load
+          average is above maxLoad (at least one task is always running)
+        - processes - if True python functions are run in a pool of maxCpu
+          processes instead of in the worker threads
+
+    Output:
+        - dictionary with for each task that was run the status ("done" or "failed"),
+          the number of attempts and the run time in seconds
+
+    A TaskError is raised after all other tasks have finished if a task failed,
+    tasks that depend on a failed task are not started.
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    bytask = {}
+    for task in tasks:
+        if task.name in bytask:
+            raise TaskError("Task %s is defined more than once" % task.name)
+        bytask[task.name] = task
+    for task in tasks:
+        for dep in task.deps:
+            if dep not in bytask:
+                raise TaskError("Task %s depends on unknown task %s" % (task.name, dep))
+
+    state = readState(statefile)
+    done = set()
+    for task in tasks:
+        if (
+            task.name in state
+            and state[task.name]["status"] == "done"
+            and state[task.name]["signature"] == task.signature()
+        ):
+            done.add(task.name)
+    if done:
+        logger.info("Skipping %d tasks completed in a previous run" % len(done))
+
+    pending = [task for task in tasks if task.name not in done]
+    start = time.time()
+    failed = set()
+    result = {}
+    running = {}
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=maxCpu)
+    procpool = None
+    if processes and any(callable(task.command) for task in pending):
+        procpool = concurrent.futures.ProcessPoolExecutor(max_workers=maxCpu)
+    try:
+        while pending or running:
+            # tasks that depend (indirectly) on a failed task are never started
+            skipped = True
+            while skipped:
+                skipped = [
+                    task for task in pending if any(dep in failed for dep in task.deps)
+                ]
+                for task in skipped:
+                    logger.error(
+                        "Task %s not started, a task it depends on failed" % task.name
+                    )
+                    pending.remove(task)
+                    failed.add(task.name)
+            for task in list(pending):
+                if len(running) >= maxCpu:
+                    break
+                if all(dep in done for dep in task.deps):
+                    if running and _overloaded(maxLoad):
+                        break
+                    logger.debug("Starting task %s" % task.name)
+                    pending.remove(task)
+                    running[pool.submit(_attempt, task, logger, procpool)] = task
+
+            if not running:
+                if pending:
+                    raise TaskError(
+                        "Circular dependencies between tasks: "
+                        + ", ".join(task.name for task in pending)
+                    )
+                break
+
+            finished, notfinished = concurrent.futures.wait(
+                running,
+                timeout=None if maxLoad is None else 5.0,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in finished:
+                task = running.pop(future)
+                seconds, attempts, error = future.result()
+                if error is None:
+                    done.add(task.name)
+                    status = "done"
+                    logger.info(
+                        "Task %s completed successfully in %.1f seconds"
+                        % (task.name, seconds)
+                    )
+                else:
+                    failed.add(task.name)
+                    status = "failed"
+                    logger.error("Task %s failed: %s" % (task.name, error))
+                result[task.name] = {
+                    "status": status,
+                    "attempts": attempts,
+                    "seconds": seconds,
+                }
+                if statefile is not None:
+                    state[task.name] = dict(
+                        result[task.name], signature=task.signature()
+                    )
+                    writeState(statefile, state)
+    finally:
+        pool.shutdown(wait=True)
+        if procpool is not None:
+            procpool.shutdown(wait=True)
+
+    if failed:
+        raise TaskError("Tasks failed: " + ", ".join(sorted(failed)))
+    logger.info(
+        "All tasks in que (%d) completed in %.1f seconds"
+        % (len(result), time.time() - start)
+    )
+    return result
+
+
+def runCommands(commands, maxCpu, statefile=None, logger=None):
+    """
+    Runs a list of independent commands dividing
+    over maxCpu number of cores.
+    """
+    tasks = [Task(command, command) for command in dict.fromkeys(commands)]
+    return runTasks(tasks, maxCpu=maxCpu, statefile=statefile, logger=logger)
@@ -23,7 +23,12 @@ functionality for converting PI-XML files to .tss and back.
 
 *Usage pre adapter:*
 
-**wflow_adapt** -M Pre -t InputTimeseriesXml -I inifile
+**wflow_adapt** -M Pre -t InputTimeseriesXml -I inifile [-n areamap]
+
+If -n is given and netcdfinput is set in the framework section of the ini file the
+timeseries are written to the netcdfinput file instead of .tss files. The series
+are mapped to the grid with the area map (relative to the case): cells with id n get
+the values of series n.
 
 *Usage postadapter:*
     
@@ -56,6 +61,7 @@ import logging.handlers
 import os
 import shutil
 import sys
+from collections import OrderedDict, namedtuple
 from datetime import *
 from xml.etree.ElementTree import *
 
@@ -95,6 +101,8 @@ def _f10(seq, idfun=None):
 
 fewsNamespace = "http://www.wldelft.nl/fews/PI"
 
+PISeries = namedtuple("PISeries", "dates locations members values")
+
 
 def setlogger(logfilename, loggername, thelevel=logging.INFO):
     """
@@ -200,16 +208,21 @@ def pixml_totss_dates(nname, outputdir):
         - Hour of day
         - Others may follow
 
+    Only the first series of the file is read.
     """
 
     if os.path.exists(nname):
-        with open(nname, "r") as f:
-            tree = parse(f)
-
-        PItimeSeries = tree.getroot()
-        series = PItimeSeries.findall(".//{" + fewsNamespace + "}series")
+        dates = []
+        for event, elem in iterparse(nname):
+            if elem.tag == "{" + fewsNamespace + "}event":
+                dates.append(
+                    datetime.strptime(
+                        elem.attrib["date"] + elem.attrib["time"], "%Y-%m-%d%H:%M:%S"
+                    )
+                )
+            elif elem.tag == "{" + fewsNamespace + "}series":
+                break
 
-        events = series[0].findall(".//{" + fewsNamespace + "}event")
         with open(outputdir + "/YearDay.tss", "w") as f:
             with open(outputdir + "/Hour.tss", "w") as ff:
                 # write the header
@@ -220,18 +233,77 @@ def pixml_totss_dates(nname, outputdir):
                 for i in range(1, 3):
                     f.write("Data column " + str(i) + "\n")
                     ff.write("Data column " + str(i) + "\n")
-                i = 1
-                for ev in events:
-                    dt = datetime.strptime(
-                        ev.attrib["date"] + ev.attrib["time"], "%Y-%m-%d%H:%M:%S"
-                    )
-                    f.write(str(i) + "\t" + dt.strftime("%j\n"))
-                    ff.write(str(i) + "\t" + dt.strftime("%H\n"))
-                    i += 1
+                for i, dt in enumerate(dates):
+                    f.write(str(i + 1) + "\t" + dt.strftime("%j\n"))
+                    ff.write(str(i + 1) + "\t" + dt.strftime("%H\n"))
     else:
         print((nname + " does not exists."))
 
 
+def pixml_toarrays(nname):
+    """
+    Reads a PI xml timeseries file into numpy arrays. The file is read with
+    iterparse, only the current series is kept in memory.
+
+    Output:
+        - ordered dictionary with a PISeries tuple per parameterId (in order of
+          appearance in the XML file):
+
+            - dates - list with the datetime of each event (of the first series)
+            - locations - list with the locationId of each series
+            - members - numpy array with the ensembleMemberIndex of each series
+              (0 if not given)
+            - values - numpy array (events x series), the missVal of the series
+              and missing events are nan
+
+        Each series is a column, in order of appearance in the XML file.
+    """
+    ns = "{" + fewsNamespace + "}"
+    series = OrderedDict()
+    root = None
+    for event, elem in iterparse(nname, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event == "start":
+            if elem.tag == ns + "series":
+                values = []
+                dates = []
+            continue
+
+        if elem.tag == ns + "event":
+            values.append(elem.attrib["value"])
+            dates.append(elem.attrib["date"] + elem.attrib["time"])
+        elif elem.tag == ns + "header":
+            par = elem.findtext(ns + "parameterId")
+            loc = elem.findtext(ns + "locationId")
+            member = int(elem.findtext(ns + "ensembleMemberIndex", "0"))
+            missval = float(elem.findtext(ns + "missVal", "nan"))
+        elif elem.tag == ns + "series":
+            col = numpy.array(values, dtype=numpy.float64)
+            col[col == missval] = numpy.nan
+            if par not in series:
+                series[par] = (
+                    [datetime.strptime(d, "%Y-%m-%d%H:%M:%S") for d in dates],
+                    [],
+                    [],
+                    [],
+                )
+            series[par][1].append(loc)
+            series[par][2].append(member)
+            series[par][3].append(col)
+            # drop the parsed series
+            root.clear()
+
+    for par in series:
+        dates, locs, members, cols = series[par]
+        values = numpy.full((max([len(c) for c in cols]), len(cols)), numpy.nan)
+        for i, col in enumerate(cols):
+            values[: len(col), i] = col
+        series[par] = PISeries(dates, locs, numpy.array(members), values)
+
+    return series
+
+
 def pixml_totss(nname, outputdir):
     """
     Converts and PI xml timeseries file to a number of tss files.
@@ -242,57 +314,14 @@ def pixml_totss(nname, outputdir):
         - files are created in "outputdir"
         - multiple locations will be multiple columns in the tss file written in order
           of appearance in the XML file
+        - missing values are written as -999.0
      
     """
 
     if os.path.exists(nname):
-        with open(nname, "r") as f:
-            tree = parse(f)
-
-        PItimeSeries = tree.getroot()
-        seriesStationList = PItimeSeries.findall(
-            ".//{" + fewsNamespace + "}stationName"
-        )
-        LocList = []
-        for station in seriesStationList:
-            LocList.append(station.text)
-
-        Parameters = PItimeSeries.findall(".//{" + fewsNamespace + "}parameterId")
-        ParList = []
-        for par in Parameters:
-            ParList.append(par.text)
-
-        uniqueParList = make_uniek(ParList)
-
-        colsinfile = len(ParList)
-
-        series = PItimeSeries.findall(".//{" + fewsNamespace + "}series")
-
-        # put whole lot in a dictionary
-        val = {}
-        parlocs = {}
-        i = 0
-        for par in uniqueParList:
-            parlocs[par] = 1
-
-        for thisS in series:
-            par = thisS.find(".//{" + fewsNamespace + "}parameterId").text
-            events = thisS.findall(".//{" + fewsNamespace + "}event")
-            locs = thisS.findall(".//{" + fewsNamespace + "}locationId")
-
-            i = 0
-            for ev in events:
-                parlocs[par] = 1
-                if (i, par) in val:
-                    theval = val[i, par] + "\t" + ev.attrib["value"]
-                    val[i, par] = theval
-                    parlocs[par] = parlocs[par] + 1
-                else:
-                    val[i, par] = ev.attrib["value"]
-                i += 1
-        nrevents = i
-
-        for par in uniqueParList:
+        for par, pis in pixml_toarrays(nname).items():
+            values = numpy.where(numpy.isnan(pis.values), -999.0, pis.values)
+            colsinfile = values.shape[1]
             with open(outputdir + "/" + par + ".tss", "w") as f:
                 # write the header
                 f.write("Parameter " + par + " taken from " + nname + "\n")
@@ -300,13 +329,100 @@ def pixml_totss(nname, outputdir):
                 f.write("Timestep\n")
                 for i in range(0, colsinfile):
                     f.write("Data column " + str(i) + "\n")
-                for i in range(0, nrevents):
-                    f.write(str(i + 1) + "\t" + val[i, par] + "\n")
+                numpy.savetxt(
+                    f,
+                    numpy.column_stack((numpy.arange(1, len(values) + 1), values)),
+                    fmt=["%d"] + ["%.9g"] * colsinfile,
+                    delimiter="\t",
+                )
 
     else:
         print((nname + " does not exists."))
 
 
+def pixml_tonetcdf(
+    nname,
+    ncfile,
+    areamap,
+    x,
+    y,
+    logger,
+    EPSG="EPSG:4326",
+    member=None,
+    varnames={},
+    metadata={},
+    maxbuf=100,
+):
+    """
+    Converts PI xml timeseries files to a netcdf forcing file (netcdfinput in
+    the framework section). Each parameter becomes a (time, y, x) variable, the
+    series are mapped to the grid with areamap: cells with id n get the values of
+    series n (in order of appearance, as the columns of the tss files).
+
+    Input:
+        - nname - PI xml timeseries file or list of files
+        - ncfile - netcdf file to write
+        - areamap - numpy array with the ids (1..nr of series) of the grid,
+          cells with other values are missing
+        - x, y - coordinates of the columns and rows of the grid
+        - logger - logger to use
+        - EPSG - projection of the grid
+        - member - only use the series of this ensembleMemberIndex (default: all)
+        - varnames - dictionary with the netcdf variable name of a parameterId
+          (default: the parameterId)
+        - metadata - global attributes of the netcdf file
+        - maxbuf - number of timesteps written at once
+    """
+    import netCDF4
+    import wflow.wf_netcdfio as wf_netcdfio
+
+    if isinstance(nname, str):
+        nname = [nname]
+    allseries = OrderedDict()
+    for xmlfile in nname:
+        allseries.update(pixml_toarrays(xmlfile))
+    if len(allseries) == 0:
+        logger.warning("No series found in " + " ".join(nname))
+        return
+
+    dates = list(allseries.values())[0].dates
+    wf_netcdfio.prepare_nc(ncfile, dates, x, y, metadata, logger, EPSG=EPSG)
+    if EPSG.lower() == "epsg:4326":
+        dims = ("time", "lat", "lon")
+    else:
+        dims = ("time", "y", "x")
+
+    ids = numpy.where(numpy.isfinite(areamap), areamap, 0).astype(int)
+    nc_trg = netCDF4.Dataset(ncfile, "a")
+    for par, pis in allseries.items():
+        values = pis.values
+        if member is not None:
+            values = values[:, pis.members == member]
+        if len(values) != len(dates):
+            logger.warning(
+                "Skipping "
+                + par
+                + ": the number of events differs from the first series"
+            )
+            continue
+        # append a missing column for the cells outside the series
+        values = numpy.hstack((values, numpy.full((len(values), 1), -9999.0)))
+        values[numpy.isnan(values)] = -9999.0
+        idx = numpy.where((ids >= 1) & (ids < values.shape[1]), ids - 1, -1)
+
+        logger.info("Writing " + par + " to " + ncfile)
+        nc_var = nc_trg.createVariable(
+            varnames.get(par, par), "f4", dims, fill_value=-9999.0, zlib=True
+        )
+        nc_var.coordinates = "lat lon"
+        nc_var.standard_name = par
+        for start in range(0, len(dates), maxbuf):
+            nc_var[start : start + maxbuf, :, :] = values[start : start + maxbuf][
+                :, idx
+            ]
+    nc_trg.close()
+
+
 def tss_topixml(tssfile, xmlfile, locationname, parametername, Sdate, timestep):
     """
     Converts a .tss file to a PI-xml file
@@ -348,6 +464,17 @@ def tss_topixml(tssfile, xmlfile, locationname, parametername, Sdate, timestep):
 
     Edatestr = Edate.strftime("%Y-%m-%d")
     Etimestr = Edate.strftime("%H:%M:%S")
+
+    # the date/time of the events is the same for all series (the first row is
+    # the dummy timestep)
+    events = [
+        '<event date="'
+        + (Sdate + timedelta(seconds=timestep * i)).strftime("%Y-%m-%d")
+        + '" time="'
+        + (Sdate + timedelta(seconds=timestep * i)).strftime("%H:%M:%S")
+        + '" value="'
+        for i in range(tss.shape[0] - 1)
+    ]
     with open(xmlfile, "w") as fo:
         fo.write('<?xml version="1.0" encoding="UTF-8"?>\n')
         fo.write(
@@ -370,23 +497,9 @@ def tss_topixml(tssfile, xmlfile, locationname, parametername, Sdate, timestep):
             fo.write("<stationName>" + header[count - 1] + "</stationName>\n")
             fo.write("</header>\n")
             # add data here
-            xdate = Sdate
-            xcount = 1
-            for pt in col:
-                if xcount > 1:
-                    Ndatestr = xdate.strftime("%Y-%m-%d")
-                    Ntimestr = xdate.strftime("%H:%M:%S")
-                    fo.write(
-                        '<event date="'
-                        + Ndatestr
-                        + '" time="'
-                        + Ntimestr
-                        + '" value="'
-                        + str(pt)
-                        + '" />\n'
-                    )
-                    xdate = xdate + timedelta(seconds=timestep)
-                xcount = xcount + 1
+            fo.writelines(
+                [ev + str(pt) + '" />\n' for ev, pt in zip(events, col[1:].tolist())]
+            )
             fo.write("</series>\n")
 
         fo.write("</TimeSeries>\n")
@@ -511,8 +624,16 @@ def getMapStacksFromRuninfo(xmlfile):
     return ed
 
 
-def pre_adapter(INxmlTimeSeries, logger):
+def pre_adapter(INxmlTimeSeries, logger, ncfile=None, areamap=None, EPSG="EPSG:4326"):
     list_xmlTimeSeries = INxmlTimeSeries.split()
+    if ncfile is not None:
+        # netcdf forcing, no tss files
+        logger.info("Converting " + INxmlTimeSeries + " to " + ncfile)
+        x, y, ids, FillVal = wflow_lib.readMap(areamap, "PCRaster")
+        ids = numpy.where(ids == FillVal, numpy.nan, ids)
+        pixml_tonetcdf(list_xmlTimeSeries, ncfile, ids, x, y, logger, EPSG=EPSG)
+        return
+
     for xmlTimeSeries in list_xmlTimeSeries:
         logger.info("Converting " + xmlTimeSeries + " ..... ")
         pixml_totss(xmlTimeSeries, case + "/intss/")
@@ -521,7 +642,7 @@ def pre_adapter(INxmlTimeSeries, logger):
 
 
 def usage():
-    print("wflow_adapter -M Pre -t InputTimeseriesXml -I inifile")
+    print("wflow_adapter -M Pre -t InputTimeseriesXml -I inifile [-n areamap]")
     print("wflow_adapter -M Post -t InputTimeseriesXml -s inputStateFile -I inifile")
     print("              -o outputStateFile -r runinfofile -w workdir -C case")
 
@@ -537,9 +658,10 @@ def main():
     adaptxmldiagfname = "wflow_adapt_diag.xml"
     logfname = "wflow.log"
     netcdfoutput = False
+    areamap = None
 
     try:
-        opts, _ = getopt.getopt(sys.argv[1:], "-M:-t:-s:-o:-r:-w:-C:-I:R:")
+        opts, _ = getopt.getopt(sys.argv[1:], "-M:-t:-s:-o:-r:-w:-C:-I:R:n:")
     except getopt.GetoptError as err:
         # print help information and exit:
         print(str(err))
@@ -575,6 +697,8 @@ def main():
             iniFile = a
         elif o in ("-M"):
             mode = a
+        elif o in ("-n"):
+            areamap = a
         else:
             assert False, "unhandled option"
 
@@ -595,7 +719,17 @@ def main():
 
     if mode == "Pre":
         logger.info("Starting preadapter")
-        pre_adapter(xmlTimeSeries, logger)
+        ncinput = wflow_lib.configget(config, "framework", "netcdfinput", "None")
+        if areamap is not None and ncinput != "None":
+            pre_adapter(
+                xmlTimeSeries,
+                logger,
+                ncfile=workdir + "/" + case + "/" + ncinput,
+                areamap=workdir + "/" + case + "/" + areamap,
+                EPSG=wflow_lib.configget(config, "framework", "EPSG", "EPSG:4326"),
+            )
+        else:
+            pre_adapter(xmlTimeSeries, logger)
         logger.info("Ending preadapter")
         sys.exit(0)
     elif mode == "Post":
@@ -2,40 +2,33 @@ __author__ = "schelle"
 
 import configparser
 import datetime
+import importlib
 import logging
 import os
 
 import numpy as np
 import wflow.bmi as bmi
-import wflow.wflow_floodmap
-import wflow.wflow_hbv
-import wflow.wflow_lintul
-import wflow.wflow_routing
-import wflow.wflow_sbm
-import wflow.wflow_sceleton
-import wflow.wflow_w3ra
 import pcraster as pcr
 from wflow.pcrut import setlogger
 
-# wflow models we want to support
+# wflow models we want to support, a model module is only imported when it is used
 wflow_models = [
-    wflow.wflow_sbm,
-    wflow.wflow_hbv,
-    wflow.wflow_routing,
-    wflow.wflow_floodmap,
-    wflow.wflow_lintul,
-    wflow.wflow_sceleton,
-    wflow.wflow_w3ra,
+    "wflow.wflow_sbm",
+    "wflow.wflow_hbv",
+    "wflow.wflow_routing",
+    "wflow.wflow_floodmap",
+    "wflow.wflow_lintul",
+    "wflow.wflow_sceleton",
+    "wflow.wflow_w3ra",
 ]
 
 
 def wflow_model(name):
     for model in wflow_models:
-        model_name = model.__name__.replace("wflow.wflow_", "", 1)
+        model_name = model.replace("wflow.wflow_", "", 1)
         if model_name in name:
-            return model
-    model_names = [model.__name__ for model in wflow_models]
-    raise ValueError("Model {} not recognized as one of {}".format(name, model_names))
+            return importlib.import_module(model)
+    raise ValueError("Model {} not recognized as one of {}".format(name, wflow_models))
 
 
 def iniFileSetUp(configfile):
@@ -869,6 +862,7 @@ class wflowbmi_csdms(bmi.Bmi):
         """
         self.bmilogger.debug("save_state: " + destination_directory)
         self.dynModel.wf_suspend(destination_directory)
+        self.dynModel.wf_waitStates()
 
     def load_state(self, source_directory):
         """
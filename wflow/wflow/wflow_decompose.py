@@ -0,0 +1,480 @@
+#!/usr/bin/python
+
+# Wflow is Free software, see below:
+#
+# Copyright (c) J. Schellekens 2005-2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+wflow_decompose -- run one wflow model as concurrent sub-catchment partitions
+
+Usage::
+
+    -C CaseName
+    -c inifile (default = wflow_sbm.ini)
+    -N directory in which the partition cases are made (default = CaseName_partitions)
+    -O streamorder used to derive the partitions with subcatch_order_b (default = 4)
+    -P map with a partition id for each cell (used instead of -O)
+    -I variable that receives the inflow from upstream partitions (default = Inflow)
+    -Q variable with the discharge leaving a partition [m3/s] (default = RiverRunoff)
+    -d number of timesteps a partition may run ahead of its downstream partition (default = 8)
+    -M maxcpu
+       maximum number of cpu's/cores to use to cut the partition cases (default = 4)
+    -f remove the existing partition cases and cut them again
+
+The clone is divided into sub-catchments (partitions). Each partition is cut out
+of the case, like wflow_subcatch does, and run through the BMI interface
+in its own process. All processes run at the same time: a partition computes a
+timestep as soon as all partitions upstream of it have finished that timestep, so
+the partitions advance as a wavefront from the headwaters to the outlet. The
+discharge (-Q) of the outlet cell of each partition is passed through shared memory
+and set as inflow (-I) in the cell it drains to in the downstream partition.
+
+Partitions with an upstream partition get their inflow only from the upstream
+partitions. The inflow values are set through the BMI and wflow only keeps these
+if the name of the mapstack equals the variable, so the inflow mapstack is set
+to /inmaps/<-I> in the ini file of these partitions and the inflow mapstack of
+the original case ([inputmapstacks] in the ini file) is not cut for them. A
+partition refuses to run if the mapstack name does not match. The input mapstacks
+must be PCRaster mapstacks (netcdf input is not cut). The output of each
+partition is written in its own case.
+"""
+
+import configparser
+import fnmatch
+import getopt
+import glob
+import logging
+import multiprocessing
+import os.path
+import shutil
+import sys
+from functools import partial
+
+import numpy as np
+import pcraster as pcr
+
+import wflow.wflow_bmi as wfbmi
+from wflow.wflow_lib import (
+    readMap,
+    writeMap,
+    cutMapById,
+    subcatch_order_b,
+)
+from wflow.wf_tasks import Task, runTasks
+
+# row and column offsets of the PCRaster ldd directions
+lddrow = np.array([0, 1, 1, 1, 0, 0, 0, -1, -1, -1])
+lddcol = np.array([0, -1, 0, 1, -1, 0, 1, -1, 0, 1])
+
+
+def usage(*args):
+    sys.stdout = sys.stderr
+    for msg in args:
+        print(msg)
+    print(__doc__)
+    sys.exit(0)
+
+
+def partition_links(ldd, partitions):
+    """
+    Find the cells where water flows from one partition into another
+
+    Input:
+        - ldd - 2d numpy array with the PCRaster ldd directions (1-9)
+        - partitions - 2d numpy array with the partition id of each cell (> 0)
+
+    Output:
+        - list of (upstream id, downstream id, outlet (row, col), entry (row, col))
+    """
+    nrows, ncols = partitions.shape
+    rows, cols = np.nonzero((partitions > 0) & (ldd >= 1) & (ldd <= 9) & (ldd != 5))
+    code = ldd[rows, cols].astype(int)
+    drows = rows + lddrow[code]
+    dcols = cols + lddcol[code]
+    inside = (drows >= 0) & (drows < nrows) & (dcols >= 0) & (dcols < ncols)
+    rows, cols, drows, dcols = rows[inside], cols[inside], drows[inside], dcols[inside]
+    up = partitions[rows, cols]
+    down = partitions[drows, dcols]
+    cross = (down > 0) & (down != up)
+
+    return [
+        (
+            int(up[i]),
+            int(down[i]),
+            (int(rows[i]), int(cols[i])),
+            (int(drows[i]), int(dcols[i])),
+        )
+        for i in np.flatnonzero(cross)
+    ]
+
+
+def partition_levels(ids, links):
+    """
+    Returns the wavefront level of each partition: 0 for partitions without
+    upstream partitions, else one more than the highest upstream level.
+    """
+    upstream = dict((pid, set()) for pid in ids)
+    for up, down, outlet, entry in links:
+        upstream[down].add(up)
+    levels = {}
+    while len(levels) < len(ids):
+        ready = [
+            pid
+            for pid in ids
+            if pid not in levels and all(up in levels for up in upstream[pid])
+        ]
+        if not ready:
+            raise ValueError("Partitions drain into each other in a loop")
+        for pid in ready:
+            levels[pid] = max([levels[up] + 1 for up in upstream[pid]] + [0])
+    return levels
+
+
+def partition_offset(partitions, pid):
+    """
+    Returns the row and column of the upper left cell of the window that
+    cutMapById cuts out for partition pid.
+    """
+    scid = partitions == pid
+    (xid,) = np.where(scid.max(axis=0))
+    (yid,) = np.where(scid.max(axis=1))
+    return int(max(yid.min() - 1, 0)), int(max(xid.min() - 1, 0))
+
+
+def cut_map(mfile, ofile, partitions, pid, repairldd=False):
+    """
+    Cut partition pid out of mfile and write it to ofile. uint8 maps are
+    assumed to be an ldd and repaired if repairldd is True.
+    """
+    x, y, data, FillVal = readMap(mfile, "PCRaster")
+    xn, yn, datan = cutMapById(data, partitions, pid, x, y, FillVal)
+    if xn is None:
+        logging.getLogger(__name__).warning(
+            "Skipping: " + mfile + " size does not match..."
+        )
+        return
+    if data.dtype == np.int32 or data.dtype == np.uint8:
+        writeMap(ofile, "PCRaster", xn, yn, datan.astype(np.int32), FillVal)
+    else:
+        writeMap(ofile, "PCRaster", xn, yn, datan, FillVal)
+    if repairldd and data.dtype == np.uint8:
+        # called in a separate process (see runTasks), the clone is the cut map
+        pcr.setclone(ofile)
+        pcr.report(pcr.lddrepair(pcr.ldd(pcr.readmap(ofile))), ofile)
+
+
+def inflow_stack(inifile, invar):
+    """
+    Returns the inflow mapstack of invar in the [inputmapstacks] section of
+    inifile (e.g. /inmaps/IF) or None if it is not set
+    """
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(inifile)
+    if config.has_option("inputmapstacks", invar):
+        return config.get("inputmapstacks", invar)
+    return None
+
+
+def set_inflow_stack(inifile, invar):
+    """
+    Sets the inflow mapstack of invar in inifile to /inmaps/<invar>, so the
+    values set through the BMI are used by the model
+    """
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(inifile)
+    if not config.has_section("inputmapstacks"):
+        config.add_section("inputmapstacks")
+    config.set("inputmapstacks", invar, "/inmaps/" + invar)
+    with open(inifile, "w") as f:
+        config.write(f)
+
+
+def partition_tasks(caseName, partCase, partitions, pid, skipstack=None):
+    """
+    Makes the directories of a partition case, copies the non-map files and
+    returns the tasks that cut the maps. The files of mapstack skipstack (e.g.
+    /inmaps/IF) are not cut.
+    """
+    tasks = []
+    if skipstack is not None:
+        skipdir = os.path.normpath(caseName + os.path.dirname(skipstack))
+        skipfiles = os.path.basename(skipstack) + "[0-9]*.[0-9][0-9][0-9]"
+    for path, thedirs, files in os.walk(caseName):
+        npath = path.replace(caseName, partCase, 1)
+        if not os.path.isdir(npath):
+            os.makedirs(npath)
+        for fname in files:
+            mfile = os.path.join(path, fname)
+            ofile = os.path.join(npath, fname)
+            if os.path.exists(ofile):
+                continue
+            if (
+                skipstack is not None
+                and os.path.normpath(path) == skipdir
+                and fnmatch.fnmatch(fname, skipfiles)
+            ):
+                continue
+            if fname.endswith(".map"):
+                cut = partial(cut_map, mfile, ofile, partitions, pid, True)
+                tasks.append(Task(ofile, cut))
+            elif fnmatch.fnmatch(fname, "*.[0-9][0-9][0-9]"):
+                cut = partial(cut_map, mfile, ofile, partitions, pid)
+                tasks.append(Task(ofile, cut))
+            elif os.path.splitext(fname)[1] in [".ini", ".tss", ".tbl", ".col", ".xml"]:
+                shutil.copy(mfile, ofile)
+    return tasks
+
+
+def run_partition(
+    pid, slot, inifile, inlinks, outlinks, invar, outvar, depth, cond, done, abort, buf
+):
+    """
+    Runs one partition (in its own process).
+
+    :param pid: partition id
+    :param slot: index of this partition in done
+    :param inifile: ini file in the partition case
+    :param inlinks: list of (buffer index, upstream slot, local entry (row, col))
+    :param outlinks: list of (buffer index, downstream slot, local outlet (row, col))
+    :param invar: name of the inflow variable
+    :param outvar: name of the discharge variable
+    :param depth: number of timesteps in the exchange buffer
+    :param cond: multiprocessing.Condition used to signal progress
+    :param done: shared array with the number of finished timesteps of each partition
+    :param abort: shared value, set if one of the partitions failed
+    :param buf: shared array (links x depth) with the exchanged discharges
+    """
+    logger = logging.getLogger(__name__)
+    exchange = np.frombuffer(buf, dtype=np.float64).reshape((-1, depth))
+
+    def wait_for(predicate):
+        with cond:
+            cond.wait_for(lambda: abort.value or predicate())
+        if abort.value:
+            raise RuntimeError("Partition %d stopped, another partition failed" % pid)
+
+    try:
+        # each partition writes its log files in its own case
+        os.chdir(os.path.dirname(inifile))
+        model = wfbmi.wflowbmi_csdms()
+        model.initialize_config(inifile, loglevel=logging.WARNING)
+        model.initialize_model()
+        if inlinks:
+            # values set through the BMI are only used if the mapstack has the
+            # name of the variable, otherwise they are overwritten from disk
+            for par in model.dynModel.modelparameters:
+                if par.name == invar and os.path.basename(par.stack) != invar:
+                    raise ValueError(
+                        "Inflow mapstack "
+                        + par.stack
+                        + " of partition %d does not match -I %s" % (pid, invar)
+                    )
+        step = 0
+        while model.get_current_time() < model.get_end_time():
+            pos = step % depth
+            if inlinks:
+                # the upstream partitions must have finished this timestep
+                wait_for(lambda: all(done[up] > step for idx, up, cell in inlinks))
+                inflow = np.zeros_like(model.get_value(outvar))
+                for idx, up, cell in inlinks:
+                    inflow[cell] += exchange[idx, pos]
+                model.set_value(invar, inflow)
+            model.update()
+            if outlinks:
+                # the downstream partitions must have read the values in this position
+                wait_for(
+                    lambda: all(done[dn] > step - depth for idx, dn, cell in outlinks)
+                )
+                discharge = model.get_value(outvar)
+                for idx, dn, cell in outlinks:
+                    exchange[idx, pos] = discharge[cell]
+            step = step + 1
+            with cond:
+                done[slot] = step
+                cond.notify_all()
+        model.finalize()
+        logger.info("Partition %d finished %d timesteps" % (pid, step))
+    except:
+        with cond:
+            abort.value = 1
+            cond.notify_all()
+        raise
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "fhC:c:N:O:P:I:Q:d:M:")
+    except getopt.error as msg:
+        usage(msg)
+
+    caseName = "thecase"
+    caseNameNew = None
+    inifile = "wflow_sbm.ini"
+    order = 4
+    partmap = None
+    invar = "Inflow"
+    outvar = "RiverRunoff"
+    depth = 8
+    maxcpu = 4
+    force = False
+
+    for o, a in opts:
+        if o == "-C":
+            caseName = a
+        if o == "-c":
+            inifile = a
+        if o == "-N":
+            caseNameNew = a
+        if o == "-O":
+            order = int(a)
+        if o == "-P":
+            partmap = a
+        if o == "-I":
+            invar = a
+        if o == "-Q":
+            outvar = a
+        if o == "-d":
+            depth = int(a)
+        if o == "-M":
+            maxcpu = int(a)
+        if o == "-f":
+            force = True
+        if o == "-h":
+            usage()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    logger = logging.getLogger(__name__)
+    caseName = os.path.normpath(caseName)
+    if caseNameNew is None:
+        caseNameNew = caseName + "_partitions"
+    statefile = os.path.join(caseNameNew, "wflow_decompose_tasks.json")
+    if os.path.isdir(caseNameNew) and not force:
+        print("Refusing to write into an existing directory:" + caseNameNew)
+        sys.exit()
+    if force and os.path.isdir(caseNameNew):
+        # the partitioning may have changed (-O, -P), cut all partitions again
+        for pdir in glob.glob(os.path.join(caseNameNew, "part_[0-9]*")):
+            shutil.rmtree(pdir)
+        if os.path.exists(statefile):
+            os.remove(statefile)
+
+    # derive the partitions
+    clonefile = os.path.join(caseName, "staticmaps", "wflow_subcatch.map")
+    pcr.setclone(clonefile)
+    ldd = pcr.readmap(os.path.join(caseName, "staticmaps", "wflow_ldd.map"))
+    inclone = pcr.pcr2numpy(pcr.defined(pcr.readmap(clonefile)), 0) > 0
+    if partmap is None:
+        sc, dif, nldd = subcatch_order_b(ldd, order, fill=True, fillcomplete=True)
+        partitions = pcr.pcr2numpy(sc, 0).astype(np.int64)
+    else:
+        partitions = pcr.pcr2numpy(pcr.readmap(partmap), 0).astype(np.int64)
+    partitions[~inclone] = 0
+    rest = inclone & (partitions <= 0)
+    if rest.any():
+        logger.warning(
+            "%d cells are not in a partition, they form one extra partition"
+            % rest.sum()
+        )
+        partitions[rest] = partitions.max() + 1
+    ids = [int(pid) for pid in np.unique(partitions) if pid > 0]
+    links = partition_links(pcr.pcr2numpy(ldd, 0), partitions)
+    levels = partition_levels(ids, links)
+    logger.info(
+        "%d partitions in %d wavefront levels" % (len(ids), max(levels.values()) + 1)
+    )
+
+    # cut the partition cases, partitions with upstream partitions get their
+    # inflow through the BMI
+    stack = inflow_stack(os.path.join(caseName, inifile), invar)
+    if stack is None:
+        logger.warning(
+            "No %s in [inputmapstacks], the default inflow mapstack is cut" % invar
+        )
+    downstream = set(down for up, down, outlet, entry in links)
+    tasks = []
+    for pid in ids:
+        tasks.extend(
+            partition_tasks(
+                caseName,
+                os.path.join(caseNameNew, "part_%04d" % pid),
+                partitions,
+                pid,
+                skipstack=stack if pid in downstream else None,
+            )
+        )
+    for pid in downstream:
+        set_inflow_stack(os.path.join(caseNameNew, "part_%04d" % pid, inifile), invar)
+    # the ldd's are repaired with pcraster, this is not thread safe
+    runTasks(
+        tasks,
+        maxCpu=maxcpu,
+        statefile=statefile,
+        processes=True,
+    )
+
+    # shared memory for the exchange between the partitions
+    slots = dict((pid, n) for n, pid in enumerate(ids))
+    offsets = dict((pid, partition_offset(partitions, pid)) for pid in ids)
+    cond = multiprocessing.Condition()
+    done = multiprocessing.Array("i", len(ids), lock=False)
+    abort = multiprocessing.Value("i", 0, lock=False)
+    buf = multiprocessing.RawArray("d", max(len(links), 1) * depth)
+    inlinks = dict((pid, []) for pid in ids)
+    outlinks = dict((pid, []) for pid in ids)
+    for idx, (up, down, outlet, entry) in enumerate(links):
+        ur, uc = offsets[up]
+        dr, dc = offsets[down]
+        outlinks[up].append((idx, slots[down], (outlet[0] - ur, outlet[1] - uc)))
+        inlinks[down].append((idx, slots[up], (entry[0] - dr, entry[1] - dc)))
+
+    # headwater partitions are started first
+    procs = []
+    for pid in sorted(ids, key=lambda pid: levels[pid]):
+        proc = multiprocessing.Process(
+            target=run_partition,
+            args=(
+                pid,
+                slots[pid],
+                os.path.abspath(os.path.join(caseNameNew, "part_%04d" % pid, inifile)),
+                inlinks[pid],
+                outlinks[pid],
+                invar,
+                outvar,
+                depth,
+                cond,
+                done,
+                abort,
+                buf,
+            ),
+        )
+        proc.start()
+        procs.append((pid, proc))
+    failed = []
+    for pid, proc in procs:
+        proc.join()
+        if proc.exitcode != 0:
+            failed.append(pid)
+    if failed:
+        logger.error("Partitions failed: " + ", ".join(str(pid) for pid in failed))
+        sys.exit(1)
+    logger.info("All partitions completed.")
+
+
+if __name__ == "__main__":
+    main()
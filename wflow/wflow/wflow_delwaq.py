@@ -52,6 +52,9 @@ Command line options::
     -c: Name of the wflow configuration file
     -n: Name of the wflow netCDF output file, expected in caseDir/runId/. If not
         present, mapstacks will be used.
+    -P: Number of timesteps to read from the netCDF output file (-n) at once.
+        The dynamic data is then generated in chunks and each output file is
+        written by a separate worker. Default is 0 (read timestep by timestep).
 
   
 .. todo::
@@ -75,11 +78,15 @@ Command line options::
     
 
 """
+import concurrent.futures
 import getopt
 import os.path
+import queue
 import struct
+import threading
 from datetime import *
 
+import netCDF4
 from wflow import wf_netcdfio
 from wflow.wf_DynamicFramework import *
 
@@ -239,37 +246,105 @@ def dw_WriteSegmentOrExchangeData(ttime, fname, datablock, boundids, WriteAscii=
         - datablock - array with data
         - boundids to write more than 1 block
         - WriteAscii - set to 1 to alse make an ascii dump
-        
+
+    Use dw_DataFileWriter to write many timesteps to the same file.
     """
-    # First convert the array to a 32 bit float
-    totareas = datablock
-    for i in range(boundids - 1):
-        totareas = np.vstack((totareas, datablock))
-
-    artow = np.array(totareas, dtype=np.float32).copy()
-    timear = np.array(ttime, dtype=np.int32)
-    if os.path.isfile(fname):  # append to existing file
-        fp = open(fname, "ab")
-        tstr = timear.tostring() + artow.tostring()
-        fp.write(tstr)
-        if WriteAscii:
-            fpa = open(fname + ".asc", "a")
-            timear.tofile(fpa, format="%d\t", sep=":")
-            artow.tofile(fpa, format="%10.8f", sep="\t")
-            fpa.write("\n")
-    else:
-        fp = open(fname, "wb")
-        tstr = timear.tostring() + artow.tostring()
-        fp.write(tstr)
+    writer = dw_DataFileWriter(fname, boundids=boundids, WriteAscii=WriteAscii)
+    writer.write(ttime, datablock)
+    writer.close()
+
+
+class dw_DataFileWriter:
+    """
+    Streaming writer for delwaq segment/exchange data files (volume, flow, area etc.).
+
+    The binary file (and the optional ascii dump) stay open for the whole run and each
+    timestep is written from a preallocated float32 record buffer: a 32 bit integer
+    time followed by boundids copies of the datablock. If the file exists
+    data is appended (as dw_WriteSegmentOrExchangeData does).
+
+    The ascii dump is written by a separate thread so it does not slow down
+    writing the binary file. Call close() at the end of the run.
+
+    Input:
+        - fname - File path of the segment/exchange data file
+        - boundids - number of times the datablock is repeated in each record
+        - WriteAscii - set to True to also make an ascii dump
+    """
+
+    def __init__(self, fname, boundids=1, WriteAscii=False):
+        self.fname = fname
+        self.boundids = boundids
+        self.WriteAscii = WriteAscii
+        mode = "ab" if os.path.isfile(fname) else "wb"
+        self.fp = open(fname, mode)
+        self.record = np.zeros(1, dtype=np.float32)
+        self.fpa = None
+        self.asciiqueue = None
         if WriteAscii:
-            fpa = open(fname + ".asc", "w")
-            timear.tofile(fpa, format="%d\t", sep=":")
-            artow.tofile(fpa, format="%10.8f", sep="\t")
-            fpa.write("\n")
+            self.fpa = open(fname + ".asc", mode.replace("b", ""))
+            self.asciiqueue = queue.Queue(maxsize=16)
+            self.asciithread = threading.Thread(target=self._writeascii)
+            self.asciithread.daemon = True
+            self.asciithread.start()
+
+    def _writeascii(self):
+        while True:
+            record = self.asciiqueue.get()
+            if record is None:
+                break
+            record[:1].view(np.int32).tofile(self.fpa, format="%d\t", sep=":")
+            record[1:].tofile(self.fpa, format="%10.8f", sep="\t")
+            self.fpa.write("\n")
+
+    def write(self, ttime, datablock):
+        """
+        Write one timestep
 
-    fp.close()
-    if WriteAscii:
-        fpa.close()
+        Input:
+            - ttime - time for this timestep
+            - datablock - array with data
+        """
+        datablock = np.asarray(datablock)
+        nvalues = datablock.size * self.boundids
+        if self.record.size != nvalues + 1:
+            self.record = np.zeros(nvalues + 1, dtype=np.float32)
+        self.record[:1].view(np.int32)[0] = ttime
+        self.record[1:].reshape(self.boundids, -1)[:] = datablock.ravel()
+        self.fp.write(self.record.tobytes())
+        if self.WriteAscii:
+            self.asciiqueue.put(self.record.copy())
+
+    def writechunk(self, ttimes, datablocks):
+        """
+        Write a number of timesteps at once
+
+        Input:
+            - ttimes - times of the timesteps
+            - datablocks - 2D array with the data of each timestep in a row
+        """
+        datablocks = np.asarray(datablocks).reshape(len(ttimes), -1)
+        records = np.zeros(
+            (len(ttimes), datablocks.shape[1] * self.boundids + 1), dtype=np.float32
+        )
+        records[:, :1].view(np.int32)[:, 0] = ttimes
+        records[:, 1:].reshape(len(ttimes), self.boundids, -1)[:] = datablocks[
+            :, np.newaxis, :
+        ]
+        self.fp.write(records.tobytes())
+        if self.WriteAscii:
+            for record in records:
+                self.asciiqueue.put(record)
+
+    def close(self):
+        """
+        Close the files (waits until the ascii dump is complete)
+        """
+        if self.WriteAscii:
+            self.asciiqueue.put(None)
+            self.asciithread.join()
+            self.fpa.close()
+        self.fp.close()
 
 
 def dw_mkDelwaqPointers(ldd, amap, difboun, layers):
@@ -1215,6 +1290,127 @@ def read_timestep(nc, var, timestep, logger, caseId, runId):
         return _readTS(caseId + "/" + runId + "/outmaps/" + var, timestep)
 
 
+def read_chunk(nc, var, timesteps, segidx):
+    """
+    Returns the values of the given variable for a number of timesteps
+    at the segments (flat indices in the map given by segidx) as a 2D
+    array (timesteps, segments). The timesteps are read from the netCDF
+    file in one go.
+    """
+    if var not in nc.alldat:
+        raise ValueError("Variable " + var + " not found in netcdf file")
+    ncindex = np.minimum(
+        np.asarray(timesteps) - 1 + nc.offset, nc.datetimelist.size - 1
+    )
+    window = [
+        slice(ncindex.min(), ncindex.max() + 1),
+        slice(nc.latidx.min(), nc.latidx.max() + 1),
+        slice(nc.lonidx.min(), nc.lonidx.max() + 1),
+    ]
+    if len(nc.alldat[var].dimensions) == 4:
+        window.insert(1, 0)
+    np_chunk = np.ma.filled(
+        np.ma.asarray(nc.alldat[var][tuple(window)], dtype=np.float64), np.nan
+    )
+    np_chunk = np_chunk[ncindex - ncindex.min()]
+    if nc.flip:
+        np_chunk = np_chunk[:, ::-1, :]
+
+    return np_chunk.reshape(len(ncindex), -1)[:, segidx]
+
+
+def dw_WriteDynamicChunked(
+    nc,
+    dwdir,
+    comroot,
+    sourcesMap,
+    ptid,
+    internalflowwidth,
+    surface_block,
+    timeSteps,
+    timestepsecs,
+    chunksteps,
+    WriteAscii,
+    logger,
+    firstTimeStep=0,
+):
+    """
+    Writes the dynamic data (volume, flow and area) from a wflow netCDF output
+    file. Instead of converting the maps of each timestep via pcraster the
+    netCDF data is read in chunks of chunksteps timesteps and the segment
+    and exchange blocks are taken from it using the flat indices of the segments.
+    Each output file is written by its own worker thread.
+
+    Missing values are determined from the segments (ptid map) so all
+    wflow output maps must be defined for all segments.
+    """
+    segidx = np.flatnonzero(np.isfinite(pcr.pcr2numpy(pcr.scalar(ptid), np.nan)))
+    width = pcr.pcr2numpy(internalflowwidth, np.nan).flatten()[segidx]
+
+    names = {
+        "volume": [dwdir + "/includes_flow/volume.dat", comroot + ".vol"],
+        "flow": [dwdir + "/includes_flow/flow.dat", comroot + ".flo"],
+        "area": [dwdir + "/includes_flow/area.dat", comroot + ".are"],
+    }
+    writers = {}
+    workers = {}
+    for name in sum(names.values(), []):
+        writers[name] = dw_DataFileWriter(name, WriteAscii=WriteAscii)
+        # one worker per file so the timesteps are written in order
+        workers[name] = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def submit(blocktype, ttimes, blocks):
+        return [
+            workers[name].submit(writers[name].writechunk, ttimes, blocks)
+            for name in names[blocktype]
+        ]
+
+    ttimes = np.arange(firstTimeStep, int(timeSteps) * timestepsecs, timestepsecs)
+    pending = []
+    for first in range(0, len(ttimes), chunksteps):
+        last = min(first + chunksteps, len(ttimes))
+        timesteps = np.arange(first, last) + 1
+        logger.info(
+            "Reading timesteps " + str(timesteps[0]) + " to " + str(timesteps[-1])
+        )
+        volume_blocks = read_chunk(nc, "vol", timesteps, segidx)
+        flow_blocks = np.hstack(
+            [read_chunk(nc, "run", timesteps, segidx)]
+            + [read_chunk(nc, source, timesteps, segidx) for source in sourcesMap]
+        )
+        area_blocks = np.hstack(
+            [read_chunk(nc, "lev", timesteps, segidx) * width]
+            + [np.tile(surface_block, (len(timesteps), 1)) for source in sourcesMap]
+        )
+        # limit memory use: wait until the previous chunk has been written
+        for future in pending:
+            future.result()
+        pending = (
+            submit("volume", ttimes[first:last], volume_blocks)
+            + submit("flow", ttimes[first:last], flow_blocks)
+            + submit("area", ttimes[first:last], area_blocks)
+        )
+
+    """
+    Write last volume block with current kinwavevol
+    """
+    logger.info("Writing last step..")
+    i = ttimes[-1] + timestepsecs
+    volume_block = read_chunk(nc, "voln", [len(ttimes)], segidx)
+    pending = (
+        pending
+        + submit("area", [i], area_blocks[-1:])
+        + submit("flow", [i], flow_blocks[-1:])
+        + submit("volume", [i], volume_block)
+    )
+    for future in pending:
+        future.result()
+
+    for name in writers:
+        workers[name].shutdown()
+        writers[name].close()
+
+
 def usage(*args):
     sys.stdout = sys.stderr
     for msg in args:
@@ -1245,11 +1441,12 @@ def main():
     # T0 = datetime.strptime("2000-01-01 00:00:00",'%Y-%m-%d %H:%M:%S')
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "adD:C:R:S:hT:s:O:A:jc:n:")
+        opts, args = getopt.getopt(sys.argv[1:], "adD:C:R:S:hT:s:O:A:jc:n:P:")
     except getopt.error as msg:
         pcrut.usage(msg)
 
     nc_outmap_file = None
+    chunksteps = 0
 
     for o, a in opts:
         if o == "-C":
@@ -1276,6 +1473,8 @@ def main():
         # if o == '-O': T0 = datetime.strptime(a,'%Y-%m-%d %H:%M:%S')
         if o == "-n":
             nc_outmap_file = a.strip()
+        if o == "-P":
+            chunksteps = int(a)
 
     global pointer
     dw_CreateDwRun(dwdir)
@@ -1474,93 +1673,115 @@ def main():
     if Write_Dynamic:
         dw_Write_Times(dwdir + "/includes_deltashell/", T0, timeSteps - 1, timestepsecs)
 
-        for i in range(firstTimeStep, timeSteps * timestepsecs, timestepsecs):
-
-            volume_map = read_timestep(nc, "vol", ts, logger, caseId, runId)
-            volume_block = dw_pcrToDataBlock(volume_map)
-
-            # volume for each timestep and number of segments
-
-            logger.info(
-                "Writing volumes.dat. Nr of points: " + str(np.size(volume_block))
-            )
-            dw_WriteSegmentOrExchangeData(
-                i, dwdir + "/includes_flow/volume.dat", volume_block, 1, WriteAscii
+        if chunksteps > 0 and nc is not None:
+            dw_WriteDynamicChunked(
+                nc,
+                dwdir,
+                comroot,
+                sourcesMap,
+                ptid,
+                internalflowwidth,
+                surface_block,
+                timeSteps,
+                timestepsecs,
+                chunksteps,
+                WriteAscii,
+                logger,
+                firstTimeStep=firstTimeStep,
             )
+        else:
+            # keep the dynamic data files open during the whole run
+            writers = {}
+            for name in [
+                dwdir + "/includes_flow/volume.dat",
+                dwdir + "/includes_flow/flow.dat",
+                dwdir + "/includes_flow/area.dat",
+                comroot + ".vol",
+                comroot + ".flo",
+                comroot + ".are",
+            ]:
+                writers[name] = dw_DataFileWriter(name, WriteAscii=WriteAscii)
+
+            for i in range(firstTimeStep, timeSteps * timestepsecs, timestepsecs):
+
+                volume_map = read_timestep(nc, "vol", ts, logger, caseId, runId)
+                volume_block = dw_pcrToDataBlock(volume_map)
+
+                # volume for each timestep and number of segments
+
+                logger.info(
+                    "Writing volumes.dat. Nr of points: " + str(np.size(volume_block))
+                )
+                writers[dwdir + "/includes_flow/volume.dat"].write(i, volume_block)
+
+                # Now write the flows (exchnages)
+                # First read the flows in the kinematic wave reservoir (internal exchnages)
+                flow = read_timestep(nc, "run", ts, logger, caseId, runId)
+                flow_block_Q = dw_pcrToDataBlock(flow)
+                # now the inw
+                flowblock = flow_block_Q
+
+                wlevel = read_timestep(nc, "lev", ts, logger, caseId, runId)
+                areadyn = wlevel * internalflowwidth
+                area_block_Q = dw_pcrToDataBlock(areadyn)
+                area_block = area_block_Q
+
+                # Now read the inflows in each segment (water that enters the kinamatic
+                # wave reservoir). Also write the areas
+                for source in sourcesMap:
+                    logger.info("Step: " + str(ts) + " source: " + str(source))
+                    thesource = read_timestep(nc, source, ts, logger, caseId, runId)
+                    thesource = zero_map + thesource
+                    flow_block_IN = dw_pcrToDataBlock(thesource)
+                    flowblock = np.hstack((flowblock, flow_block_IN))
+                    area_block = np.hstack((area_block, surface_block))
+
+                logger.info(
+                    "Writing flow.dat. Nr of points: " + str(np.size(flowblock))
+                )
+                writers[dwdir + "/includes_flow/flow.dat"].write(i, flowblock)
+                logger.info(
+                    "Writing area.dat. Nr of points: " + str(np.size(area_block))
+                )
+                writers[dwdir + "/includes_flow/area.dat"].write(i, area_block)
+
+                # write dynamic data for hyd-file set
+                writers[comroot + ".vol"].write(i, volume_block)
+                writers[comroot + ".flo"].write(i, flowblock)
+                writers[comroot + ".are"].write(i, area_block)
+
+                ts = ts + 1
+
+            """
+            Write last volume block with current kinwavevol
+            """
+            ts = ts - 1
+            i = i + timestepsecs
+            logger.info("Writing last step..")
 
-            # Now write the flows (exchnages)
-            # First read the flows in the kinematic wave reservoir (internal exchnages)
-            flow = read_timestep(nc, "run", ts, logger, caseId, runId)
-            flow_block_Q = dw_pcrToDataBlock(flow)
-            # now the inw
-            flowblock = flow_block_Q
-
-            wlevel = read_timestep(nc, "lev", ts, logger, caseId, runId)
-            areadyn = wlevel * internalflowwidth
-            area_block_Q = dw_pcrToDataBlock(areadyn)
-            area_block = area_block_Q
-
-            # Now read the inflows in each segment (water that enters the kinamatic
-            # wave reservoir). Also write the areas
-            for source in sourcesMap:
-                logger.info("Step: " + str(ts) + " source: " + str(source))
-                thesource = read_timestep(nc, source, ts, logger, caseId, runId)
-                thesource = zero_map + thesource
-                flow_block_IN = dw_pcrToDataBlock(thesource)
-                flowblock = np.hstack((flowblock, flow_block_IN))
-                area_block = np.hstack((area_block, surface_block))
-
-            logger.info("Writing flow.dat. Nr of points: " + str(np.size(flowblock)))
-            dw_WriteSegmentOrExchangeData(
-                i, dwdir + "/includes_flow/flow.dat", flowblock, 1, WriteAscii
-            )
             logger.info("Writing area.dat. Nr of points: " + str(np.size(area_block)))
-            dw_WriteSegmentOrExchangeData(
-                i, dwdir + "/includes_flow/area.dat", area_block, 1, WriteAscii
-            )
-
-            # write dynamic data for hyd-file set
-            dw_WriteSegmentOrExchangeData(
-                i, comroot + ".vol", volume_block, 1, WriteAscii
-            )
-            dw_WriteSegmentOrExchangeData(i, comroot + ".flo", flowblock, 1, WriteAscii)
-            dw_WriteSegmentOrExchangeData(
-                i, comroot + ".are", area_block, 1, WriteAscii
-            )
-
-            ts = ts + 1
-
-        """
-        Write last volume block with current kinwavevol
-        """
-        ts = ts - 1
-        i = i + timestepsecs
-        logger.info("Writing last step..")
+            writers[dwdir + "/includes_flow/area.dat"].write(i, area_block)
 
-        logger.info("Writing area.dat. Nr of points: " + str(np.size(area_block)))
-        dw_WriteSegmentOrExchangeData(
-            i, dwdir + "/includes_flow/area.dat", area_block, 1, WriteAscii
-        )
+            # logger.info("Writing surface.dat. Nr of points: " + str(np.size(surface_block)))
+            # dw_WriteSegmentOrExchangeData(i,dwdir + '/includes_flow/surface.dat',surface_block,1,WriteAscii)
 
-        # logger.info("Writing surface.dat. Nr of points: " + str(np.size(surface_block)))
-        # dw_WriteSegmentOrExchangeData(i,dwdir + '/includes_flow/surface.dat',surface_block,1,WriteAscii)
+            logger.info("Writing flow.dat. Nr of points: " + str(np.size(flowblock)))
+            writers[dwdir + "/includes_flow/flow.dat"].write(i, flowblock)
 
-        logger.info("Writing flow.dat. Nr of points: " + str(np.size(flowblock)))
-        dw_WriteSegmentOrExchangeData(
-            i, dwdir + "/includes_flow/flow.dat", flowblock, 1, WriteAscii
-        )
+            volume_map = read_timestep(nc, "voln", ts, logger, caseId, runId)
+            volume_block = dw_pcrToDataBlock(volume_map)
+            logger.info(
+                "Writing volumes.dat. Nr of points: " + str(np.size(volume_block))
+            )
+            writers[dwdir + "/includes_flow/volume.dat"].write(i, volume_block)
 
-        volume_map = read_timestep(nc, "voln", ts, logger, caseId, runId)
-        volume_block = dw_pcrToDataBlock(volume_map)
-        logger.info("Writing volumes.dat. Nr of points: " + str(np.size(volume_block)))
-        dw_WriteSegmentOrExchangeData(
-            i, dwdir + "/includes_flow/volume.dat", volume_block, 1, WriteAscii
-        )
+            # for hyd-file set
+            writers[comroot + ".are"].write(i, area_block)
+            writers[comroot + ".flo"].write(i, flowblock)
+            writers[comroot + ".vol"].write(i, volume_block)
 
-        # for hyd-file set
-        dw_WriteSegmentOrExchangeData(i, comroot + ".are", area_block, 1, WriteAscii)
-        dw_WriteSegmentOrExchangeData(i, comroot + ".flo", flowblock, 1, WriteAscii)
-        dw_WriteSegmentOrExchangeData(i, comroot + ".vol", volume_block, 1, WriteAscii)
+            for writer in writers.values():
+                writer.close()
 
         # Generate attribute file
         atr_file = comroot + ".atr"
@@ -69,6 +69,7 @@ import pylab
 import scipy.optimize
 import wflow.pcrut as pcrut
 import wflow.stats as stats
+import wflow.wf_calib as wf_calib
 
 
 # TODO: do not read results from file
@@ -159,6 +160,12 @@ class wfmodel_fit_API:
             item = item + 1
         self.qmeasname = configget(self.conf, "fit", "Q", "calib.tss")
         self.qmodname = configget(self.conf, "fit", "Qmod", "run.tss")
+        self.inmemory = int(configget(self.conf, "fit", "inmemory", "0"))
+        self.qvar = configget(self.conf, "fit", "Qvar", "SurfaceRunoff")
+        self.gaugemap = configget(
+            self.conf, "fit", "gaugemap", "staticmaps/wflow_gauges.map"
+        )
+        self.worker = None
         self.epsfcn = float(configget(self.conf, "fit", "epsfcn", "0.00001"))
         self.ftol = float(configget(self.conf, "fit", "ftol", "0.0001"))
         self.xtol = float(configget(self.conf, "fit", "xtol", "0.0001"))
@@ -168,6 +175,18 @@ class wfmodel_fit_API:
         exec("self.ColSimS  = " + configget(self.conf, "fit", "ColSim", "[1]"))
         exec("self.ColMeasS = " + configget(self.conf, "fit", "ColMeas", "[1]"))
         self.WarmUpSteps = int(configget(self.conf, "fit", "WarmUpSteps", "1"))
+        # Parameters that change the state at the end of the warm-up, the
+        # others (e.g. routing parameters) reuse the warm-up checkpoint
+        self.WarmUpParameters = [
+            par.strip()
+            for par in configget(
+                self.conf, "fit", "WarmUpParameters", ",".join(self.calibpars)
+            ).split(",")
+            if par.strip()
+        ]
+        self.WarmUpCacheSize = int(
+            configget(self.conf, "fit", "WarmUpCacheSize", "8")
+        )
         self.AreaMapName = configget(self.conf, "fit", "areamap", "wflow_catchment.map")
         self.AreaMap = self.WF.readmap(os.path.join(self.caseName, self.AreaMapName))
         exec("self.AreaCodeS = " + configget(self.conf, "fit", "areacode", "[1]"))
@@ -182,6 +201,9 @@ class wfmodel_fit_API:
         self.ColSim = self.ColSimS[0]
         self.ColMeas = self.ColMeasS[0]
         self.AreaCode = self.AreaCodeS[0]
+        self.modeltofit = modeltofit
+        self.configfile = configfile
+        self.clonemap = clonemap
 
     def multVarWithPar(self, pars):
         """
@@ -236,6 +258,8 @@ class wfmodel_fit_API:
         """
         Run the model for the number of timesteps.
         """
+        if self.inmemory:
+            return self.runinmemory(pars)
 
         # Run the initial part of the model (reads parameters and sets initial values)
         self.dynModelFw._runInitial()  # Runs initial part
@@ -256,6 +280,35 @@ class wfmodel_fit_API:
         results, head = pcrut.readtss(tssfile)
         return results[self.WarmUpSteps :, self.ColSim].astype(np.float64)
 
+    def runinmemory(self, pars):
+        """
+        Run the model using a wf_calib worker. The model is only initialised
+        once, the discharge is sampled (variable Qvar at the gauges in
+        gaugemap) from memory.
+        """
+        if self.worker is None:
+            self.worker = wf_calib.wf_CalibWorker(
+                self.modeltofit,
+                self.caseName,
+                self.runId,
+                self.configfile,
+                self.startTime,
+                self.stopTime,
+                self.calibpars,
+                areamap=self.AreaMapName,
+                areacode=self.AreaCode,
+                qvar=self.qvar,
+                gaugemap=self.gaugemap,
+                clonemap=self.clonemap,
+                warmupsteps=self.WarmUpSteps,
+                warmuppars=self.WarmUpParameters,
+                warmupcachesize=self.WarmUpCacheSize,
+            )
+        self.worker.areacode = int(self.AreaCode)
+        q = self.worker.run(pars)
+
+        return q[self.WarmUpSteps :, self.ColSim].astype(np.float64)
+
     def savemaps(self, pars, savetoinput=False):
         """
         Ssave the adjusted (and original) parameter maps
@@ -303,6 +356,12 @@ class wfmodel_fit_API:
             exec(strr_new)
             i = i + 1
 
+        if savetoinput and self.worker is not None:
+            # The worker holds the original maps, start the next catchment
+            # from the adjusted maps
+            self.worker.shutdown()
+            self.worker = None
+
     def shutdown(self, pars):
         """
         Shutdown the model 
@@ -310,33 +369,24 @@ class wfmodel_fit_API:
         """
 
         self.dynModelFw._wf_shutdown()
+        if self.worker is not None:
+            self.worker.shutdown()
 
 
 def errfuncFIT(pars, qmeas, mimo, caseName, runId):
     q = mimo.run(pars)
-    res = q - qmeas
+    mask = stats.get_mask(qmeas, q)
     # only resturn non-nan values
-    resnonan = res[~np.isnan(res)]
+    resnonan = (q - qmeas)[mask]
 
     mimo.log.log(45, "Parameters now: " + str(pars))
     pylab.plot(q)
 
-    mimo.NS.append(
-        stats.get_nash_sutcliffe(
-            qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan
-        )
-    )
-    mimo.BIAS.append(
-        stats.get_bias(qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan)
-    )
-    mimo.CORR.append(
-        stats.get_correlation(qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan)
-    )
-    mimo.MABSE.append(
-        stats.get_mean_absolute_error(
-            qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan
-        )
-    )
+    metrics = stats.get_metrics(qmeas, q, mask=mask)
+    mimo.NS.append(float(metrics["NS"]))
+    mimo.BIAS.append(float(metrics["BIAS"]))
+    mimo.CORR.append(float(metrics["CORR"]))
+    mimo.MABSE.append(float(metrics["MABSE"]))
     mimo.log.log(45, "NS: " + str(mimo.NS[-1]))
     mimo.log.log(45, "BIAS: " + str(mimo.BIAS[-1]))
     mimo.log.log(45, "CORR: " + str(mimo.CORR[-1]))
@@ -24,8 +24,8 @@ usage
 
 ::
     
-    wflow_fit -M ModelName [-h][-F runinfofile][-C casename]
-          [-c configfile][-T last_step][-S first_step][-s seconds]
+    wflow_fit_brute -M ModelName [-h][-F runinfofile][-C casename]
+          [-c configfile][-T last_step][-S first_step][-s seconds][-P ncpu]
           
 
     -M: model to fit (e.g. wflow_sbm, wflow_hbv, wflow_cqf)          
@@ -40,6 +40,9 @@ usage
     
     -U: save the map after each step ti the input (staticmaps) dir so 
         that next steps (colums) use the previous results
+
+    -P: number of worker processes to use (default: all cpu's). Each worker
+        holds one model instance that is re-initialised in memory.
     
     -c: name of wflow the configuration file (default: Casename/wflow_sbm.ini). 
     
@@ -50,6 +53,12 @@ usage
 For this program to work you must add a [fit] section to the
 ini file of the program to fit (e.g. the wflow\_hbv program)
 
+The simulated discharge is taken from the model in memory: the variable
+given by Qvar (default SurfaceRunoff) in the [fit] section is sampled at
+the gauges in gaugemap (default staticmaps/wflow_gauges.map). The results
+of each parameter set are stored in runId/<ColSim>_wflow_fit.csv. If a
+run is interrupted it continues with the sets that are not in that file yet.
+
 
 
 $Author: schelle $
@@ -59,8 +68,8 @@ $Rev: 785 $
 """
 
 
-import csv
 import getopt
+import itertools
 import os.path
 import sys
 
@@ -68,6 +77,7 @@ import numpy as np
 import pylab
 import wflow.pcrut as pcrut
 import wflow.stats as stats
+import wflow.wf_calib as wf_calib
 
 
 # TODO: do not read results from file
@@ -166,6 +176,10 @@ class wfmodel_fit_API:
             self.pars.append(1.0)
             item = item + 1
         self.qmeasname = configget(self.conf, "fit", "Q", "calib.tss")
+        self.qvar = configget(self.conf, "fit", "Qvar", "SurfaceRunoff")
+        self.gaugemap = configget(
+            self.conf, "fit", "gaugemap", "staticmaps/wflow_gauges.map"
+        )
         self.epsfcn = float(configget(self.conf, "fit", "epsfcn", "0.00001"))
         self.ftol = float(configget(self.conf, "fit", "ftol", "0.0001"))
         self.xtol = float(configget(self.conf, "fit", "xtol", "0.0001"))
@@ -175,6 +189,18 @@ class wfmodel_fit_API:
         exec("self.ColSimS  = " + configget(self.conf, "fit", "ColSim", "[1]"))
         exec("self.ColMeasS = " + configget(self.conf, "fit", "ColMeas", "[1]"))
         self.WarmUpSteps = int(configget(self.conf, "fit", "WarmUpSteps", "1"))
+        # Parameters that change the state at the end of the warm-up, the
+        # others (e.g. routing parameters) reuse the warm-up checkpoint
+        self.WarmUpParameters = [
+            par.strip()
+            for par in configget(
+                self.conf, "fit", "WarmUpParameters", ",".join(self.calibpars)
+            ).split(",")
+            if par.strip()
+        ]
+        self.WarmUpCacheSize = int(
+            configget(self.conf, "fit", "WarmUpCacheSize", "8")
+        )
         self.AreaMapName = configget(self.conf, "fit", "areamap", "wflow_catchment.map")
         self.AreaMap = self.WF.readmap(os.path.join(self.caseName, self.AreaMapName))
         exec("self.AreaCodeS = " + configget(self.conf, "fit", "areacode", "[1]"))
@@ -189,6 +215,32 @@ class wfmodel_fit_API:
         self.ColSim = self.ColSimS[0]
         self.ColMeas = self.ColMeasS[0]
         self.AreaCode = self.AreaCodeS[0]
+        self.modeltofit = modeltofit
+        self.configfile = configfile
+        self.clonemap = clonemap
+
+    def workerargs(self):
+        """
+        Returns the arguments needed to create a wf_calib.wf_CalibWorker
+        for the current area
+        """
+        return dict(
+            modeltofit=self.modeltofit,
+            casename=self.caseName,
+            runId=self.runId,
+            configfile=self.configfile,
+            startTime=self.startTime,
+            stopTime=self.stopTime,
+            calibpars=self.calibpars,
+            areamap=self.AreaMapName,
+            areacode=self.AreaCode,
+            qvar=self.qvar,
+            gaugemap=self.gaugemap,
+            clonemap=self.clonemap,
+            warmupsteps=self.WarmUpSteps,
+            warmuppars=self.WarmUpParameters,
+            warmupcachesize=self.WarmUpCacheSize,
+        )
 
     def multVarWithPar(self, pars):
         """
@@ -318,104 +370,56 @@ class wfmodel_fit_API:
         self.dynModelFw._wf_shutdown()
 
 
-def bruteforce(mimo, qmeas, caseName, runId):
+def bruteforce(mimo, qmeas, caseName, runId, ncpu=None):
     """
+    Evaluate all combinations of the parameter ranges given in the [fit]
+    section using a pool of ncpu worker processes.
     """
-    nowpars = mimo.pars
-    print(nowpars)
-    i = 0
-    results = []
-
-    execstr = "mimo.range[mimo.calibpars[" + str(i) + "]]"
-    print("=========")
-    for i in range(0, len(mimo.calibpars)):
-        if i > 0:
-            execstr = execstr + ", mimo.range[mimo.calibpars[" + str(i) + "]]"
-        print(execstr)
-        for parmult in mimo.range[mimo.calibpars[i]]:
-            nowpars[i] = parmult
-
-    exec("combi = itertools.product(" + execstr + ")")
-
-    while 1:
-        try:
-            thisparset = next(combi)
-            print("Parameters:" + str(thisparset))
-            q = mimo.run(thisparset)
-
-            res = q - qmeas
-            # only resturn non-nan values
-            resnonan = res[~np.isnan(res)]
-            mimo.log.log(45, "Parameters now: " + str(thisparset))
-            pylab.plot(q)
-            mimo.NS.append(
-                stats.get_nash_sutcliffe(
-                    qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan
-                )
-            )
-            mimo.BIAS.append(
-                stats.get_bias(qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan)
-            )
-            mimo.CORR.append(
-                stats.get_correlation(
-                    qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan
-                )
-            )
-            mimo.MABSE.append(
-                stats.get_mean_absolute_error(
-                    qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan
-                )
-            )
-            mimo.log.log(45, "NS: " + str(mimo.NS[-1]))
-            mimo.log.log(45, "BIAS: " + str(mimo.BIAS[-1]))
-            mimo.log.log(45, "CORR: " + str(mimo.CORR[-1]))
-            mimo.log.log(45, "MABSE: " + str(mimo.MABSE[-1]))
-            results.append(
-                [
-                    thisparset,
-                    stats.get_nash_sutcliffe(
-                        qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan
-                    ),
-                    stats.get_bias(
-                        qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan
-                    ),
-                ]
-            )
-
-            pylab.savefig(os.path.join(caseName, runId, str(mimo.ColSim) + "fit.png"))
-            # zz = errfuncFIT(thisparset,qmeas,mimo,caseName,runId)
-        except:
-            print("Unexpected error:", sys.exc_info()[0])
-            break
+    combi = itertools.product(*[mimo.range[par] for par in mimo.calibpars])
+
+    def _report(setnr, pars, q, metrics):
+        mimo.log.log(45, "Parameters now: " + str(pars))
+        mimo.NS.append(metrics["NS"])
+        mimo.BIAS.append(metrics["BIAS"])
+        mimo.CORR.append(metrics["CORR"])
+        mimo.MABSE.append(metrics["MABSE"])
+        mimo.log.log(45, "NS: " + str(mimo.NS[-1]))
+        mimo.log.log(45, "BIAS: " + str(mimo.BIAS[-1]))
+        mimo.log.log(45, "CORR: " + str(mimo.CORR[-1]))
+        mimo.log.log(45, "MABSE: " + str(mimo.MABSE[-1]))
+        pylab.plot(q)
+
+    results = wf_calib.calibrate(
+        combi,
+        mimo.workerargs(),
+        qmeas,
+        colsim=mimo.ColSim,
+        resultsfile=os.path.join(
+            caseName, runId, str(mimo.ColSim) + "_wflow_fit.csv"
+        ),
+        ncpu=ncpu,
+        warmupsteps=mimo.WarmUpSteps,
+        callback=_report,
+    )
+    pylab.savefig(os.path.join(caseName, runId, str(mimo.ColSim) + "fit.png"))
 
     return results
 
 
 def errfuncFIT(pars, qmeas, mimo, caseName, runId):
     q = mimo.run(pars)
-    res = q - qmeas
+    mask = stats.get_mask(qmeas, q)
     # only resturn non-nan values
-    resnonan = res[~np.isnan(res)]
+    resnonan = (q - qmeas)[mask]
 
     mimo.log.log(45, "Parameters now: " + str(pars))
     pylab.plot(q)
 
-    mimo.NS.append(
-        stats.get_nash_sutcliffe(
-            qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan
-        )
-    )
-    mimo.BIAS.append(
-        stats.get_bias(qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan)
-    )
-    mimo.CORR.append(
-        stats.get_correlation(qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan)
-    )
-    mimo.MABSE.append(
-        stats.get_mean_absolute_error(
-            qmeas[~np.isnan(res)], q[~np.isnan(res)], NoData=np.nan
-        )
-    )
+    metrics = stats.get_metrics(qmeas, q, mask=mask)
+    mimo.NS.append(float(metrics["NS"]))
+    mimo.BIAS.append(float(metrics["BIAS"]))
+    mimo.CORR.append(float(metrics["CORR"]))
+    mimo.MABSE.append(float(metrics["MABSE"]))
     mimo.log.log(45, "NS: " + str(mimo.NS[-1]))
     mimo.log.log(45, "BIAS: " + str(mimo.BIAS[-1]))
     mimo.log.log(45, "CORR: " + str(mimo.CORR[-1]))
@@ -476,6 +480,7 @@ def main(argv=None):
     configfile = None
     saveResults = False
     fitmethod = "fmin"
+    ncpu = None
 
     if argv is None:
         argv = sys.argv[1:]
@@ -483,7 +488,7 @@ def main(argv=None):
             usage()
             return
 
-    opts, args = getopt.getopt(argv, "C:S:T:c:s:R:hM:U")
+    opts, args = getopt.getopt(argv, "C:S:T:c:s:R:hM:UP:")
 
     for o, a in opts:
         if o == "-C":
@@ -502,6 +507,8 @@ def main(argv=None):
             theModel = a
         if o == "-U":
             saveResults = True
+        if o == "-P":
+            ncpu = int(a)
         if o == "-h":
             usage()
 
@@ -561,7 +568,7 @@ def main(argv=None):
         )
 
         # bruteforce(mimo)
-        res = bruteforce(mimo, qmeas, caseName, runId)
+        res = bruteforce(mimo, qmeas, caseName, runId, ncpu=ncpu)
         # print pp
         # pylab.plot(mimo.run(pp),"r",linewidth=2.0)
         # printresults(pp,a,b,c,d,mimo.calibpars,os.path.join(caseName,runId,fitname),mimo)
@@ -572,12 +579,6 @@ def main(argv=None):
 
     mimo.shutdown()
 
-    f = open(os.path.join(caseName, runId, "wflow_fit.csv"), "wb")
-    writer = csv.writer(f)
-    writer.writerows(res)
-    f.close()
-    # print pp
-
 
 if __name__ == "__main__":
     main()
@@ -33,6 +33,13 @@ Ini file settings:
     # or already flooded cel. Functions as a max flooding velocity
     # Never set lower that the length of one cell.
     maxflooddist= 0.3
+
+    # Use the sparse flood extent engine (1) instead of the map based
+    # approach (0). The nearest river cell (drain) and the height above
+    # that drain (HAND) of each cell are determined once in the initial
+    # section. Each step only the zones that drain to a river cell over
+    # bankfull are updated. Results are the same for both methods.
+    sparse = 0
     
 
 
@@ -60,9 +67,12 @@ $Rev: 916 $
 
 import os.path
 
+import numpy as np
 import pcraster.framework
+from numba import jit
 from wflow.wf_DynamicFramework import *
 from wflow.wflow_adapt import *
+from wflow.wflow_funcs import drainage_network
 
 
 def usage(*args):
@@ -73,6 +83,128 @@ def usage(*args):
     sys.exit(0)
 
 
+def drain_network(np_ldd, river, cellength):
+    """
+    Determine the drainage network needed by the sparse flood extent engine
+    from a ldd and river (numpy arrays). This is only done once.
+
+    Returns a dictionary with:
+
+        - ds: downstream cell of each cell (-1 for pits and missing values)
+        - steplen: distance to the downstream cell (as ldddist with friction 1)
+        - drain: nearest river cell at or downstream of each cell (-1 if none)
+        - rup_ptr, rup_idx: river cells that have a river cell as first river
+          cell downstream (csr format, indexed by cell)
+        - hs_ptr, hs_idx: non-river cells per drain ordered from downstream
+          to upstream (csr format, indexed by cell)
+    """
+    ncell = np_ldd.size
+    river = river.flatten() > 0
+    nodes, nodes_up, rnodes, rnodes_up = drainage_network(np_ldd)
+
+    ds = np.full(ncell, -1, dtype=np.int64)
+    for idx, nbs in zip(nodes, nodes_up):
+        for i in range(idx.size):
+            nb = nbs[i][nbs[i] >= 0]
+            ds[nb] = idx[i]
+    order = np.concatenate(nodes[::-1]).astype(np.int64)
+
+    ldd = np_ldd.flatten()
+    steplen = np.where(np.isin(ldd, [1, 3, 7, 9]), np.sqrt(2.0), 1.0) * cellength
+
+    drain = np.full(ncell, -1, dtype=np.int64)
+    for c in order:
+        if river[c]:
+            drain[c] = c
+        elif ds[c] >= 0:
+            drain[c] = drain[ds[c]]
+
+    rcells = np.where(river & (ds >= 0))[0]
+    rnext = drain[ds[rcells]]
+    rcells = rcells[rnext >= 0]
+    rnext = rnext[rnext >= 0]
+    srt = np.argsort(rnext, kind="stable")
+    rup_idx = rcells[srt]
+    rup_ptr = np.concatenate(([0], np.cumsum(np.bincount(rnext, minlength=ncell))))
+
+    hcells = order[(~river[order]) & (drain[order] >= 0)]
+    hdrain = drain[hcells]
+    srt = np.argsort(hdrain, kind="stable")
+    hs_idx = hcells[srt]
+    hs_ptr = np.concatenate(([0], np.cumsum(np.bincount(hdrain, minlength=ncell))))
+
+    return {
+        "ds": ds,
+        "steplen": steplen,
+        "drain": drain,
+        "rup_ptr": rup_ptr,
+        "rup_idx": rup_idx,
+        "hs_ptr": hs_ptr,
+        "hs_idx": hs_idx,
+    }
+
+
+@jit(nopython=True, cache=True)
+def flood_zones(
+    fld,
+    water_surf,
+    extent,
+    altitude,
+    ds,
+    steplen,
+    rup_ptr,
+    rup_idx,
+    hs_ptr,
+    hs_idx,
+    maxdist,
+    dist,
+    depth,
+):
+    """
+    Flood depth for all cells that drain to one of the river cells over
+    bankfull (fld). For each of these river cells the zone is traced
+    upstream until the next river cell over bankfull (as pcraster subcatchment).
+    The flood level in a zone is the water surface of its river cell, cells
+    further away (along the ldd) from a flooded cell than maxdist stay dry.
+
+    dist and depth are work arrays of the size of the map, only
+    the cells in the returned zone indices are updated.
+    """
+    isfld = np.zeros(extent.size, dtype=np.bool_)
+    for f in fld:
+        isfld[f] = True
+
+    zone = []
+    for f in fld:
+        level = water_surf[f]
+        start = len(zone)
+        # river cells of this zone, from downstream to upstream
+        riv = [f]
+        k = 0
+        while k < len(riv):
+            r = riv[k]
+            k = k + 1
+            zone.append(r)
+            for p in range(hs_ptr[r], hs_ptr[r + 1]):
+                zone.append(hs_idx[p])
+            for p in range(rup_ptr[r], rup_ptr[r + 1]):
+                if not isfld[rup_idx[p]]:
+                    riv.append(rup_idx[p])
+
+        for i in range(start, len(zone)):
+            c = zone[i]
+            if extent[c] or isfld[c]:
+                dist[c] = 0.0
+            else:
+                dist[c] = dist[ds[c]] + steplen[c]
+            if dist[c] > maxdist:
+                depth[c] = 0.0
+            else:
+                depth[c] = max(level - altitude[c], 0.0)
+
+    return np.array(zone, dtype=np.int64)
+
+
 class WflowModel(pcraster.framework.DynamicModel):
     """
   The user defined model class. This is your work!
@@ -226,8 +358,45 @@ class WflowModel(pcraster.framework.DynamicModel):
         self.FloodDepth = pcr.scalar(pcr.cover(0.0))
         self.MaxExt = pcr.boolean(pcr.cover(0.0))
         self.MaxDepth = pcr.cover(0.0)
+
+        self.sparse = int(configget(self.config, "model", "sparse", "0"))
+        if self.sparse:
+            self.logger.info("Determining drainage network for sparse flood mapping")
+            self.mv = -999.0
+            self.shape = pcr.pcr2numpy(self.Altitude, self.mv).shape
+            np_ldd = pcr.pcr2numpy(self.Ldd, self.mv)
+            np_ldd[np_ldd == self.mv] = 0
+            cellength = float(pcr.pcr2numpy(pcr.celllength(), 0.0)[0, 0])
+            self.network = drain_network(
+                np_ldd, pcr.pcr2numpy(pcr.scalar(self.River), 0.0), cellength
+            )
+            self.np_Altitude = pcr.pcr2numpy(self.Altitude, np.nan).flatten()
+            self.np_BankFull = pcr.pcr2numpy(self.BankFull, np.nan).flatten()
+            self.rivercells = np.where(
+                pcr.pcr2numpy(pcr.scalar(self.River), 0.0).flatten() > 0
+            )[0]
+            drain = self.network["drain"]
+            hand = np.full(drain.size, np.nan)
+            hand[drain >= 0] = (
+                self.np_Altitude[drain >= 0] - self.np_Altitude[drain[drain >= 0]]
+            )
+            self.HAND = self.topcr(hand)
+            self.np_dist = np.zeros(drain.size)
+            self.np_FloodDepth = np.zeros(drain.size)
+            self.np_MaxDepth = np.zeros(drain.size)
+            self.np_MaxExt = np.zeros(drain.size, dtype=np.bool_)
+            self.np_FloodExtent = None
+            self.zone = np.array([], dtype=np.int64)
+
         self.logger.info("End of initial...")
 
+    def topcr(self, values):
+        """
+        Convert a flat numpy array to a pcraster scalar map (nan becomes missing value)
+        """
+        values = np.where(np.isnan(values), self.mv, values).reshape(self.shape)
+        return pcr.numpy2pcr(pcr.Scalar, values, self.mv)
+
     def resume(self):
         """ 
     *Required*
@@ -257,6 +426,10 @@ class WflowModel(pcraster.framework.DynamicModel):
       :var self.FloodExtent: Actual flood extent [-]
       
       """
+        if self.sparse:
+            self.dynamic_sparse()
+            return
+
         self.FloodDepth = pcr.scalar(self.FloodDepth) * 0.0
 
         self.wf_updateparameters()
@@ -334,6 +507,75 @@ class WflowModel(pcraster.framework.DynamicModel):
 
         # reporting of maps is done by the framework (see ini file)
 
+    def dynamic_sparse(self):
+        """
+        Sparse version of the dynamic section. Only the zones that drain to a river
+        cell over bankfull are updated using the drainage network determined in the
+        initial section. Depth and extent are kept as numpy arrays and converted
+        to maps for reporting.
+        """
+        self.wf_updateparameters()
+
+        if self.np_FloodExtent is None:
+            self.np_FloodExtent = (
+                pcr.pcr2numpy(pcr.scalar(self.FloodExtent), 0.0).flatten() > 0
+            )
+
+        # WL surface if level > bankfull. For the eventual surface substract bankfull as measure for river depth
+        wl = pcr.pcr2numpy(self.WL, np.nan).flatten()[self.rivercells]
+        overbank = wl > self.np_BankFull[self.rivercells]
+        fld = self.rivercells[overbank]
+        water_surf = np.zeros(self.np_Altitude.size)
+        water_surf[fld] = wl[overbank] + self.np_Altitude[fld] - self.np_BankFull[fld]
+
+        self.logger.info(
+            "Step: "
+            + str(self.currentStep)
+            + ". River cells over bankfull: "
+            + str(fld.size)
+        )
+
+        # reset the zones of the previous step, the old extent is still needed
+        # to determine the distance to the nearest already flooded cell
+        prevzone = self.zone
+        self.np_FloodDepth[prevzone] = 0.0
+
+        if fld.size > 0:
+            self.zone = flood_zones(
+                fld,
+                water_surf,
+                self.np_FloodExtent,
+                self.np_Altitude,
+                self.network["ds"],
+                self.network["steplen"],
+                self.network["rup_ptr"],
+                self.network["rup_idx"],
+                self.network["hs_ptr"],
+                self.network["hs_idx"],
+                self.maxdist,
+                self.np_dist,
+                self.np_FloodDepth,
+            )
+            # as in the map version the new extent only holds the flooded cells,
+            # also cells of the initial extent outside the zones are dropped
+            self.np_FloodExtent = self.np_FloodDepth > 0.0
+
+            # Keep track of af depth and extent
+            self.np_MaxDepth[self.zone] = np.maximum(
+                self.np_MaxDepth[self.zone], self.np_FloodDepth[self.zone]
+            )
+            self.np_MaxExt[self.zone] |= self.np_FloodExtent[self.zone]
+        else:
+            self.np_FloodExtent[:] = False
+            self.zone = np.array([], dtype=np.int64)
+
+        self.FloodDepth = self.topcr(
+            np.where(self.np_FloodDepth > 0.0, self.np_FloodDepth, np.nan)
+        )
+        self.FloodExtent = pcr.boolean(self.topcr(self.np_FloodExtent * 1.0))
+        self.MaxDepth = self.topcr(self.np_MaxDepth)
+        self.MaxExt = pcr.boolean(self.topcr(self.np_MaxExt * 1.0))
+
 
 # The main function is used to run the program from the command line
 
@@ -28,7 +28,7 @@ import numpy as np
 import pcraster as pcr
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def _up_nb(ldd_f, idx0, shape, _ldd_us, sr=1):
     """returns a numpy array with 1d indices of upstream neighbors on a ldd
     """
@@ -52,7 +52,7 @@ def _up_nb(ldd_f, idx0, shape, _ldd_us, sr=1):
     return np.array(wdw_idx, dtype=np.int32)
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def set_dd(ldd, _ldd_us, river, pit_value=5):
     """set drainage direction network from downstream to upstream
     """
@@ -97,7 +97,75 @@ def set_dd(ldd, _ldd_us, river, pit_value=5):
     return nodes[::-1], nodes_up[::-1], rnodes[::-1], rnodes_up[::-1]
 
 
-@jit(nopython=True)
+def drainage_network(np_ldd, river=None, pit_value=5):
+    """returns the drainage network of a ldd (numpy array) as made by set_dd:
+    nodes (and river nodes) ordered from upstream to downstream, together
+    with their upstream neighbours (-1 for no neighbour)
+    """
+    _ldd = np.array([[7, 8, 9], [4, 5, 6], [1, 2, 3]])
+    _ldd_us = np.fliplr(np.flipud(_ldd)).flatten()
+    _ldd_us = np.where(_ldd_us == 5, 0, _ldd_us)
+    if river is None:
+        river = np.zeros(np_ldd.size, dtype=np.float64)
+
+    return set_dd(np_ldd, _ldd_us, river, pit_value=pit_value)
+
+
+@jit(nopython=True, cache=True)
+def accucapacity(nodes, nodes_up, material, capacity):
+    """accumulate material (nclass, ncell) over the drainage network limited by
+    the transport capacity of each cell, for all classes in one pass.
+    Returns the flux out of each cell (as pcraster accucapacityflux) and the
+    amount that stays in each cell (as pcraster accucapacitystate).
+    Missing values (nan) propagate downstream.
+    """
+    nclass, ncell = material.shape
+    # last column stays zero to deal with nodata (-1) in upstream indices
+    flux = np.zeros((nclass, ncell + 1), dtype=np.float64)
+    flux[:, :ncell] = np.nan
+    state = np.full((nclass, ncell), np.nan, dtype=np.float64)
+
+    for i in range(len(nodes)):
+        for j in range(len(nodes[i])):
+            idx = nodes[i][j]
+            nbs = nodes_up[i][j]
+            for k in range(nclass):
+                inflow = material[k, idx]
+                for nb in nbs:
+                    inflow = inflow + flux[k, nb]
+                if math.isnan(inflow) or math.isnan(capacity[k, idx]):
+                    continue
+                out = min(inflow, max(capacity[k, idx], 0.0))
+                flux[k, idx] = out
+                state[k, idx] = inflow - out
+
+    return flux[:, :ncell], state
+
+
+@jit(nopython=True, cache=True)
+def upstream_sum(nodes, nodes_up, values):
+    """sum of values (nclass, ncell) of the upstream neighbours of each cell
+    (as pcraster upstream) for all classes in one pass. Missing values (nan)
+    of upstream cells propagate (as in pcraster and accucapacity).
+    """
+    nclass, ncell = values.shape
+    res = np.full((nclass, ncell), np.nan, dtype=np.float64)
+
+    for i in range(len(nodes)):
+        for j in range(len(nodes[i])):
+            idx = nodes[i][j]
+            nbs = nodes_up[i][j]
+            for k in range(nclass):
+                tot = 0.0
+                for nb in nbs:
+                    if nb >= 0:
+                        tot = tot + values[k, nb]
+                res[k, idx] = tot
+
+    return res
+
+
+@jit(nopython=True, cache=True)
 def kinematic_wave(Qin,Qold,q,alpha,beta,deltaT,deltaX):
     
     epsilon = 1e-12
@@ -133,7 +201,7 @@ def kinematic_wave(Qin,Qold,q,alpha,beta,deltaT,deltaX):
         return Qkx
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def kin_wave(rnodes, rnodes_up, Qold, q, Alpha, Beta, DCL, River, Bw, AlpTermR, AlpPow, deltaT, it=1):
     
     acc_flow = np.zeros(Qold.size, dtype=np.float64)
@@ -165,7 +233,7 @@ def kin_wave(rnodes, rnodes_up, Qold, q, Alpha, Beta, DCL, River, Bw, AlpTermR,
     #return Qnew[:-1].reshape(shape)
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def kinematic_wave_ssf(ssf_in, ssf_old, zi_old, r, Ks_hor, Ks ,slope ,neff, f, D, dt, dx, w, ssf_max):
     
     epsilon = 1e-6
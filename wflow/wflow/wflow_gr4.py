@@ -108,26 +108,68 @@ def initUH2(X4, D):
     return UH2, SH2
 
 
-def mk_qres(N):
+class UHStack(object):
     """
-    Returns an array (or ayyar of maps) to store the 
-    delayed flow in
-    
+    Delayed flow of a unit hydrograph for all cells, stored in a preallocated
+    (len(UH) x cells) numpy ring buffer. Element j of the stack (the flow j time
+    steps ahead) is row (pos + j) % len(UH) of the buffer, so moving to the next
+    time step only moves pos.
+
+    The stack behaves as a list of maps (len, indexing and iteration) so it can be
+    saved and read as a state by wf_suspend and wf_resume.
+
     Input:
-    
-        - N nr op steps
-        
-    Ouput:
-    
-        - nr of steps elemenst initialized with zeros's
+
+        - UH unit hydrograph
+        - maps (optional) list of maps with the initial delayed flow
     """
 
-    uhq = []
+    def __init__(self, UH, maps=None):
+        self.UH = numpy.asarray(UH, dtype=numpy.float64)
+        self.shape = (pcr.clone().nrRows(), pcr.clone().nrCols())
+        self.buffer = numpy.zeros((len(self.UH), self.shape[0] * self.shape[1]))
+        self.pos = 0
+        if maps is not None:
+            for j, qmap in enumerate(list(maps)[: len(self.UH)]):
+                self.buffer[j] = pcr.pcr2numpy(qmap, numpy.nan).ravel()
+
+    def __len__(self):
+        return len(self.UH)
+
+    def __getitem__(self, j):
+        if j < -len(self) or j >= len(self):
+            raise IndexError("UHStack index out of range")
+        return self._tomap(self.buffer[(self.pos + j) % len(self)])
+
+    def __iter__(self):
+        for j in range(len(self)):
+            yield self[j]
+
+    def _tomap(self, row):
+        return pcr.numpy2pcr(
+            pcr.Scalar,
+            numpy.where(numpy.isnan(row), -999.0, row).reshape(self.shape),
+            -999.0,
+        )
 
-    for i in range(0, N):
-        uhq.append(pcr.cover(0.0))
+    def add(self, Pr):
+        """
+        Adds Pr (map) distributed over the time steps with the unit hydrograph
+        """
+        self.buffer += (
+            numpy.roll(self.UH, self.pos)[:, None]
+            * pcr.pcr2numpy(Pr, numpy.nan).ravel()
+        )
 
-    return uhq
+    def shift(self):
+        """
+        Returns the flow of the current time step (first element) as a map and
+        moves the stack one time step ahead
+        """
+        first = self._tomap(self.buffer[self.pos])
+        self.buffer[self.pos] = 0.0
+        self.pos = (self.pos + 1) % len(self)
+        return first
 
 
 class WflowModel(pcraster.framework.DynamicModel):
@@ -326,8 +368,8 @@ class WflowModel(pcraster.framework.DynamicModel):
         self.UH1, self.SH1 = initUH1(self.X4, self.D)
         self.UH2, self.SH2 = initUH2(self.X4, self.D)
 
-        self.QUH1 = mk_qres(self.NH)
-        self.QUH2 = mk_qres(self.NH * 2)
+        self.QUH1 = UHStack(self.UH1)
+        self.QUH2 = UHStack(self.UH2)
 
         self.logger.info("End of initial section...")
 
@@ -347,8 +389,8 @@ class WflowModel(pcraster.framework.DynamicModel):
             # STATES
             self.S_X1 = 245.4900 / self.X1  # STATE(1),level in production store
             self.R_X3 = 43.9031 / self.X3  # STATE(2),level in routing store
-            self.QUH1 = mk_qres(self.NH)
-            self.QUH2 = mk_qres(self.NH * 2)
+            self.QUH1 = UHStack(self.UH1)
+            self.QUH2 = UHStack(self.UH2)
         else:
             self.wf_resume(os.path.join(self.Dir, "instate"))
 
@@ -416,18 +458,20 @@ class WflowModel(pcraster.framework.DynamicModel):
         # ACTUAL ROUTING =====================================================
         # UH1 has a memory of int(X4) steps
 
-        # ouput of UH1 =========================================================
-
-        for j in range(0, self.NH):  # UH1 output for each time step
-            self.QUH1[j] = self.QUH1[j] + float(self.UH1[j]) * self.Pr
-
-        self.Q9 = self.B * self.QUH1[0]
+        # states read by wf_resume are lists of maps
+        if not isinstance(self.QUH1, UHStack):
+            self.QUH1 = UHStack(self.UH1, self.QUH1)
+        if not isinstance(self.QUH2, UHStack):
+            self.QUH2 = UHStack(self.UH2, self.QUH2)
 
-        # Add the current Q to the UH res
-        for j in range(0, 2 * self.NH):  # UH2 output for each time step
-            self.QUH2[j] = self.QUH2[j] + float(self.UH2[j]) * self.Pr
+        # ouput of UH1 =========================================================
+        # Add the current Q to the UH res and take the output of this time step,
+        # this also moves the UH stacks one time step ahead
+        self.QUH1.add(self.Pr)
+        self.Q9 = self.B * self.QUH1.shift()
 
-        self.Q1prim = self.QUH2[0]
+        self.QUH2.add(self.Pr)
+        self.Q1prim = self.QUH2.shift()
         # Get final runoff
         self.Q1 = (1 - self.B) * self.Q1prim
         self.F = self.X2 * (self.R_X3) ** 3.5  # water subterranean exchange
@@ -443,12 +487,6 @@ class WflowModel(pcraster.framework.DynamicModel):
         # Updated this line to get total Q per basin
         self.SurfaceRunoff = pcr.areatotal(self.Q * self.ToCubic, self.OutputId)
 
-        # Remove first item from the UH stacks and add a new empty one at the end
-        self.QUH1 = delete(self.QUH1, 0)
-        self.QUH1 = append(self.QUH1, pcr.cover(0.0))
-        self.QUH2 = delete(self.QUH2, 0)
-        self.QUH2 = append(self.QUH2, pcr.cover(0.0))
-
 
 # The main function is used to run the program from the command line
 
@@ -81,8 +81,11 @@ wflow_hbv::
 
 import os.path
 
+import numpy as np
 import pcraster.framework
+from numba import jit
 from wflow.wf_DynamicFramework import *
+from wflow.wf_kinematic import kinematicRouter
 from wflow.wflow_adapt import *
 
 wflow = "wflow_hbv"
@@ -106,6 +109,238 @@ def usage(*args):
     sys.exit(0)
 
 
+#: parameters used by hbv_cell, in the order of the fields of the static array
+hbv_static_pars = [
+    "TTI",
+    "TT",
+    "SFCF",
+    "RFCF",
+    "ICF",
+    "EPF",
+    "ECORR",
+    "CEVPF",
+    "Cfmax",
+    "CFR",
+    "WHC",
+    "FieldCapacity",
+    "Treshold",
+    "BetaSeepage",
+    "PERC",
+    "Cflux",
+    "KQuickFlow",
+    "AlphaNL",
+    "SUZ",
+    "K0",
+    "K4",
+    "filter_P_PET",
+]
+
+#: forcing and states (input) of hbv_cell
+hbv_dyn_in = [
+    "Precipitation",
+    "PotEvaporation",
+    "Temperature",
+    "Seepage",
+    "InterceptionStorage",
+    "DrySnow",
+    "FreeWater",
+    "SoilMoisture",
+    "UpperZoneStorage",
+    "LowerZoneStorage",
+]
+
+#: fluxes (output) of hbv_cell, the states and forcing are updated in place
+hbv_dyn_out = [
+    "ReserVoirPrecip",
+    "ReserVoirPotEvap",
+    "IntEvap",
+    "SnowMelt",
+    "SnowCover",
+    "InSoil",
+    "RainAndSnowmelt",
+    "NetInSoil",
+    "SoilEvap",
+    "ActEvap",
+    "HBVSeepage",
+    "DirectRunoff",
+    "InUpperZone",
+    "Percolation",
+    "CapFlux",
+    "QuickFlow",
+    "RealQuickFlow",
+    "BaseFlow",
+    "InwaterMM",
+]
+
+
+@jit(nopython=True, cache=True)
+def hbv_cell(cells, static, dyn, SetKquickFlow, ExternalQbase):
+    """
+    Snow, interception, soil and response routine of HBV for all active cells in
+    one pass. This is the same sequence of calculations as the PCRaster
+    implementation in WflowModel.dynamic (without mass wasting and glaciers, these
+    only change the snow pack and are applied afterwards).
+
+    Input:
+        - cells - flat indices of the active cells (with forcing)
+        - static - structured array with the parameters (hbv_static_pars)
+        - dyn - structured array with forcing, states and fluxes (hbv_dyn_in and
+          hbv_dyn_out), updated in place
+        - SetKquickFlow, ExternalQbase - model options
+
+    Output:
+        - dyn
+    """
+    for idx in cells:
+        P = dyn["Precipitation"][idx]
+        PET = dyn["PotEvaporation"][idx]
+        T = dyn["Temperature"][idx]
+        TT = static["TT"][idx]
+        TTI = static["TTI"][idx]
+        FC = static["FieldCapacity"][idx]
+
+        # fraction of precipitation which falls as rain
+        if TTI == 0.0:
+            RainFrac = 0.0 if T <= TT else 1.0
+        else:
+            RainFrac = min((T - (TT - TTI / 2.0)) / TTI, 1.0)
+        RainFrac = max(RainFrac, 0.0)
+        SnowFrac = 1.0 - RainFrac
+        P = static["SFCF"][idx] * SnowFrac * P + static["RFCF"][idx] * RainFrac * P
+
+        # interception and correction of the potential evaporation
+        IntStorage = dyn["InterceptionStorage"][idx]
+        Interception = min(P, static["ICF"][idx] - IntStorage)
+        IntStorage = IntStorage + Interception
+        P = P - Interception
+        PET = np.exp(-static["EPF"][idx] * P) * static["ECORR"][idx] * PET
+        PET = static["CEVPF"][idx] * PET
+        IntEvap = min(IntStorage, PET)
+        IntStorage = IntStorage - IntEvap
+        RestEvap = max(0.0, PET - IntEvap)
+
+        dyn["ReserVoirPotEvap"][idx] = PET
+        dyn["ReserVoirPrecip"][idx] = P
+        PET = static["filter_P_PET"][idx] * PET
+        P = static["filter_P_PET"][idx] * P
+
+        # snow
+        DrySnow = dyn["DrySnow"][idx]
+        FreeWater = dyn["FreeWater"][idx]
+        SnowFall = SnowFrac * P
+        RainFall = RainFrac * P
+        if T > TT:
+            PotSnowMelt = static["Cfmax"][idx] * (T - TT)
+        else:
+            PotSnowMelt = 0.0
+        if T < TT:
+            PotRefreezing = static["Cfmax"][idx] * static["CFR"][idx] * (TT - T)
+            Refreezing = min(PotRefreezing, FreeWater)
+        else:
+            Refreezing = 0.0
+        SnowMelt = min(PotSnowMelt, DrySnow)
+        DrySnow = DrySnow + SnowFall + Refreezing - SnowMelt
+        FreeWater = FreeWater - Refreezing
+        MaxFreeWater = DrySnow * static["WHC"][idx]
+        FreeWater = FreeWater + SnowMelt + RainFall
+        InSoil = max(FreeWater - MaxFreeWater, 0.0)
+        FreeWater = FreeWater - InSoil
+
+        # soil
+        NetInSoil = InSoil
+        SoilMoisture = dyn["SoilMoisture"][idx] + NetInSoil
+        DirectRunoff = max(SoilMoisture - FC, 0.0)
+        SoilMoisture = SoilMoisture - DirectRunoff
+        NetInSoil = NetInSoil - DirectRunoff
+
+        Treshold = static["Treshold"][idx]
+        if SoilMoisture > Treshold:
+            SoilEvap = min(SoilMoisture, RestEvap)
+        else:
+            SoilEvap = min(SoilMoisture, min(RestEvap, PET * (SoilMoisture / Treshold)))
+        SoilMoisture = SoilMoisture - SoilEvap
+        HBVSeepage = (
+            min(SoilMoisture / FC, 1.0) ** static["BetaSeepage"][idx]
+        ) * NetInSoil
+        SoilMoisture = SoilMoisture - HBVSeepage
+        Backtosoil = min(FC - SoilMoisture, DirectRunoff)
+        DirectRunoff = DirectRunoff - Backtosoil
+        SoilMoisture = SoilMoisture + Backtosoil
+        InUpperZone = DirectRunoff + HBVSeepage
+
+        # upper zone
+        PERC = static["PERC"][idx]
+        UpperZoneStorage = dyn["UpperZoneStorage"][idx] + InUpperZone
+        Percolation = min(PERC, UpperZoneStorage - InUpperZone / 2)
+        UpperZoneStorage = UpperZoneStorage - Percolation
+        CapFlux = static["Cflux"][idx] * ((FC - SoilMoisture) / FC)
+        CapFlux = min(UpperZoneStorage, CapFlux)
+        CapFlux = min(FC - SoilMoisture, CapFlux)
+        UpperZoneStorage = UpperZoneStorage - CapFlux
+        SoilMoisture = SoilMoisture + CapFlux
+
+        KQuickFlow = static["KQuickFlow"][idx]
+        if not SetKquickFlow:
+            if Percolation < PERC:
+                QuickFlow = min(0.0, UpperZoneStorage)
+            else:
+                QuickFlow = min(
+                    KQuickFlow
+                    * (
+                        (UpperZoneStorage - min(InUpperZone / 2, UpperZoneStorage))
+                        ** (1.0 + static["AlphaNL"][idx])
+                    ),
+                    UpperZoneStorage,
+                )
+                UpperZoneStorage = UpperZoneStorage - QuickFlow
+            UpperZoneStorage = max(UpperZoneStorage, 0.0)
+            RealQuickFlow = 0.0
+        else:
+            QuickFlow = KQuickFlow * UpperZoneStorage
+            RealQuickFlow = max(
+                0.0, static["K0"][idx] * (UpperZoneStorage - static["SUZ"][idx])
+            )
+            UpperZoneStorage = UpperZoneStorage - QuickFlow - RealQuickFlow
+
+        # lower zone
+        LowerZoneStorage = dyn["LowerZoneStorage"][idx] + Percolation
+        BaseFlow = min(LowerZoneStorage, static["K4"][idx] * LowerZoneStorage)
+        LowerZoneStorage = LowerZoneStorage - BaseFlow
+
+        if ExternalQbase:
+            DirectRunoffStorage = QuickFlow + dyn["Seepage"][idx] + RealQuickFlow
+        else:
+            DirectRunoffStorage = QuickFlow + BaseFlow + RealQuickFlow
+
+        dyn["Precipitation"][idx] = P
+        dyn["PotEvaporation"][idx] = PET
+        dyn["InterceptionStorage"][idx] = IntStorage
+        dyn["DrySnow"][idx] = DrySnow
+        dyn["FreeWater"][idx] = FreeWater
+        dyn["SoilMoisture"][idx] = SoilMoisture
+        dyn["UpperZoneStorage"][idx] = UpperZoneStorage
+        dyn["LowerZoneStorage"][idx] = LowerZoneStorage
+        dyn["IntEvap"][idx] = IntEvap
+        dyn["SnowMelt"][idx] = SnowMelt
+        dyn["SnowCover"][idx] = 1.0 if DrySnow > 0 else 0.0
+        dyn["InSoil"][idx] = InSoil
+        dyn["RainAndSnowmelt"][idx] = RainFall + SnowMelt
+        dyn["NetInSoil"][idx] = NetInSoil
+        dyn["SoilEvap"][idx] = SoilEvap
+        dyn["ActEvap"][idx] = IntEvap + SoilEvap
+        dyn["HBVSeepage"][idx] = HBVSeepage
+        dyn["DirectRunoff"][idx] = DirectRunoff
+        dyn["InUpperZone"][idx] = InUpperZone
+        dyn["Percolation"][idx] = Percolation
+        dyn["CapFlux"][idx] = CapFlux
+        dyn["QuickFlow"][idx] = QuickFlow
+        dyn["RealQuickFlow"][idx] = RealQuickFlow
+        dyn["BaseFlow"][idx] = BaseFlow
+        dyn["InwaterMM"][idx] = max(0.0, DirectRunoffStorage)
+
+    return dyn
+
+
 class WflowModel(pcraster.framework.DynamicModel):
 
     """
@@ -390,6 +625,10 @@ class WflowModel(pcraster.framework.DynamicModel):
         self.ExternalQbase = int(configget(self.config, "model", "ExternalQbase", "0"))
         self.SetKquickFlow = int(configget(self.config, "model", "SetKquickFlow", "0"))
         self.MassWasting = int(configget(self.config, "model", "MassWasting", "0"))
+        self.UseNumba = int(configget(self.config, "model", "UseNumba", "0"))
+        self.RoutingEngine = configget(
+            self.config, "model", "RoutingEngine", "pcraster"
+        )
         self.SubCatchFlowOnly = int(
             configget(self.config, "model", "SubCatchFlowOnly", "0")
         )
@@ -975,6 +1214,24 @@ class WflowModel(pcraster.framework.DynamicModel):
         self.upsize = pcr.catchmenttotal(self.xl * self.yl, self.TopoLdd)
         self.csize = pcr.areamaximum(self.upsize, self.TopoId)
 
+        if self.UseNumba:
+            # flat arrays for the numba version of the vertical processes
+            self.mv = -999.0
+            np_active = pcr.pcr2numpy(pcr.defined(self.TopoId), 0)
+            self.shape = np_active.shape
+            self.cells = np.flatnonzero(np_active)
+            self.hbv_static = np.zeros(
+                np_active.size, dtype=[(name, np.float64) for name in hbv_static_pars]
+            )
+            self.hbv_dyn = np.zeros(
+                np_active.size,
+                dtype=[(name, np.float64) for name in hbv_dyn_in + hbv_dyn_out],
+            )
+            self.hbv_parmaps = {}
+            self.logger.info("Using numba for the vertical processes.")
+
+        self.Router = kinematicRouter(self.RoutingEngine, self.TopoLdd)
+
         self.logger.info("End of initial section.")
 
     def default_summarymaps(self):
@@ -1062,6 +1319,48 @@ class WflowModel(pcraster.framework.DynamicModel):
                 self.HQ ** -self.AlphaNL
             )  # recession rate of the upper reservoir, KHQ*UHQ=HQ=kquickflow*(UHQ**alpha)
 
+    def hbv_numba(self):
+        """
+        Snow, interception, soil and response routines for all cells in one pass
+        using the numba function hbv_cell (set UseNumba=1 in the model section of
+        the ini file). The parameter maps are only converted to numpy again if they
+        have been replaced (e.g. dynamic parameters or multiplication factors).
+        """
+        for name in hbv_static_pars:
+            parmap = getattr(self, name, 1.0 if name == "filter_P_PET" else 0.0)
+            if self.hbv_parmaps.get(name) is not parmap:
+                self.hbv_parmaps[name] = parmap
+                if isinstance(parmap, float):
+                    self.hbv_static[name] = parmap
+                else:
+                    self.hbv_static[name] = pcr.pcr2numpy(parmap, self.mv).ravel()
+
+        dyn = self.hbv_dyn
+        for name in hbv_dyn_in:
+            dyn[name] = pcr.pcr2numpy(getattr(self, name), self.mv).ravel()
+
+        # cells with missing forcing get missing values (as in PCRaster)
+        cells = self.cells[
+            (dyn["Precipitation"][self.cells] != self.mv)
+            & (dyn["PotEvaporation"][self.cells] != self.mv)
+            & (dyn["Temperature"][self.cells] != self.mv)
+        ]
+        missing = np.ones(dyn.size, dtype=bool)
+        missing[cells] = False
+        dyn[missing] = self.mv
+
+        hbv_cell(cells, self.hbv_static, dyn, self.SetKquickFlow, self.ExternalQbase)
+
+        for name in hbv_dyn_in + hbv_dyn_out:
+            if name not in ["Temperature", "Seepage"]:
+                setattr(
+                    self,
+                    name,
+                    pcr.numpy2pcr(
+                        pcr.Scalar, np.copy(dyn[name].reshape(self.shape)), self.mv
+                    ),
+                )
+
     def dynamic(self):
 
         """
@@ -1119,100 +1418,214 @@ class WflowModel(pcraster.framework.DynamicModel):
 
         self.wf_multparameters()
 
-        RainFrac = pcr.ifthenelse(
-            1.0 * self.TTI == 0.0,
-            pcr.ifthenelse(
-                self.Temperature <= self.TT, pcr.scalar(0.0), pcr.scalar(1.0)
-            ),
-            pcr.min(
-                (self.Temperature - (self.TT - self.TTI / 2.0)) / self.TTI,
-                pcr.scalar(1.0),
-            ),
-        )
-        RainFrac = pcr.max(
-            RainFrac, pcr.scalar(0.0)
-        )  # fraction of precipitation which falls as rain
-        SnowFrac = 1.0 - RainFrac  # fraction of self.Precipitation which falls as snow
-
-        self.Precipitation = (
-            self.SFCF * SnowFrac * self.Precipitation
-            + self.RFCF * RainFrac * self.Precipitation
-        )  # different correction for rainfall and snowfall
-
-        # Water onto the canopy
-        Interception = pcr.min(
-            self.Precipitation, self.ICF - self.InterceptionStorage
-        )  #: Interception in mm/timestep
-        self.InterceptionStorage = (
-            self.InterceptionStorage + Interception
-        )  #: Current interception storage
-        self.Precipitation = self.Precipitation - Interception
-
-        self.PotEvaporation = (
-            pcr.exp(-self.EPF * self.Precipitation) * self.ECORR * self.PotEvaporation
-        )  # correction for potential evaporation on wet days
-        self.PotEvaporation = self.CEVPF * self.PotEvaporation  # Correct per landuse
-
-        self.IntEvap = pcr.min(
-            self.InterceptionStorage, self.PotEvaporation
-        )  #: Evaporation from interception storage
-        self.InterceptionStorage = self.InterceptionStorage - self.IntEvap
-
-        # I nthe origal HBV code
-        RestEvap = pcr.max(0.0, self.PotEvaporation - self.IntEvap)
+        if self.UseNumba:
+            self.hbv_numba()
+        else:
+            RainFrac = pcr.ifthenelse(
+                1.0 * self.TTI == 0.0,
+                pcr.ifthenelse(
+                    self.Temperature <= self.TT, pcr.scalar(0.0), pcr.scalar(1.0)
+                ),
+                pcr.min(
+                    (self.Temperature - (self.TT - self.TTI / 2.0)) / self.TTI,
+                    pcr.scalar(1.0),
+                ),
+            )
+            RainFrac = pcr.max(
+                RainFrac, pcr.scalar(0.0)
+            )  # fraction of precipitation which falls as rain
+            SnowFrac = 1.0 - RainFrac  # fraction of self.Precipitation which falls as snow
+
+            self.Precipitation = (
+                self.SFCF * SnowFrac * self.Precipitation
+                + self.RFCF * RainFrac * self.Precipitation
+            )  # different correction for rainfall and snowfall
+
+            # Water onto the canopy
+            Interception = pcr.min(
+                self.Precipitation, self.ICF - self.InterceptionStorage
+            )  #: Interception in mm/timestep
+            self.InterceptionStorage = (
+                self.InterceptionStorage + Interception
+            )  #: Current interception storage
+            self.Precipitation = self.Precipitation - Interception
+
+            self.PotEvaporation = (
+                pcr.exp(-self.EPF * self.Precipitation) * self.ECORR * self.PotEvaporation
+            )  # correction for potential evaporation on wet days
+            self.PotEvaporation = self.CEVPF * self.PotEvaporation  # Correct per landuse
+
+            self.IntEvap = pcr.min(
+                self.InterceptionStorage, self.PotEvaporation
+            )  #: Evaporation from interception storage
+            self.InterceptionStorage = self.InterceptionStorage - self.IntEvap
+
+            # I nthe origal HBV code
+            RestEvap = pcr.max(0.0, self.PotEvaporation - self.IntEvap)
 
-        if hasattr(self, "ReserVoirComplexLocs"):
-            self.ReserVoirPotEvap = self.PotEvaporation
-            self.ReserVoirPrecip = self.Precipitation
-
-            self.PotEvaporation = self.filter_P_PET * self.PotEvaporation
-            self.Precipitation = self.filter_P_PET * self.Precipitation
-
-        SnowFall = SnowFrac * self.Precipitation  #: snowfall depth
-        RainFall = RainFrac * self.Precipitation  #: rainfall depth
-        PotSnowMelt = pcr.ifthenelse(
-            self.Temperature > self.TT,
-            self.Cfmax * (self.Temperature - self.TT),
-            pcr.scalar(0.0),
-        )  # Potential snow melt, based on temperature
-        PotRefreezing = pcr.ifthenelse(
-            self.Temperature < self.TT,
-            self.Cfmax * self.CFR * (self.TT - self.Temperature),
-            0.0,
-        )  # Potential refreezing, based on temperature
-
-        Refreezing = pcr.ifthenelse(
-            self.Temperature < self.TT, pcr.min(PotRefreezing, self.FreeWater), 0.0
-        )  # actual refreezing
-        self.SnowMelt = pcr.min(PotSnowMelt, self.DrySnow)  # actual snow melt
-        self.DrySnow = (
-            self.DrySnow + SnowFall + Refreezing - self.SnowMelt
-        )  # dry snow content
-        self.FreeWater = self.FreeWater - Refreezing  # free water content in snow
-        MaxFreeWater = self.DrySnow * self.WHC
-        self.FreeWater = self.FreeWater + self.SnowMelt + RainFall
-        InSoil = pcr.max(
-            self.FreeWater - MaxFreeWater, 0.0
-        )  # abundant water in snow pack which goes into soil
-        self.FreeWater = self.FreeWater - InSoil
-        RainAndSnowmelt = RainFall + self.SnowMelt
-
-        self.SnowCover = pcr.ifthenelse(self.DrySnow > 0, pcr.scalar(1), pcr.scalar(0))
+            if hasattr(self, "ReserVoirComplexLocs"):
+                self.ReserVoirPotEvap = self.PotEvaporation
+                self.ReserVoirPrecip = self.Precipitation
+
+                self.PotEvaporation = self.filter_P_PET * self.PotEvaporation
+                self.Precipitation = self.filter_P_PET * self.Precipitation
+
+            SnowFall = SnowFrac * self.Precipitation  #: snowfall depth
+            RainFall = RainFrac * self.Precipitation  #: rainfall depth
+            PotSnowMelt = pcr.ifthenelse(
+                self.Temperature > self.TT,
+                self.Cfmax * (self.Temperature - self.TT),
+                pcr.scalar(0.0),
+            )  # Potential snow melt, based on temperature
+            PotRefreezing = pcr.ifthenelse(
+                self.Temperature < self.TT,
+                self.Cfmax * self.CFR * (self.TT - self.Temperature),
+                0.0,
+            )  # Potential refreezing, based on temperature
+
+            Refreezing = pcr.ifthenelse(
+                self.Temperature < self.TT, pcr.min(PotRefreezing, self.FreeWater), 0.0
+            )  # actual refreezing
+            self.SnowMelt = pcr.min(PotSnowMelt, self.DrySnow)  # actual snow melt
+            self.DrySnow = (
+                self.DrySnow + SnowFall + Refreezing - self.SnowMelt
+            )  # dry snow content
+            self.FreeWater = self.FreeWater - Refreezing  # free water content in snow
+            MaxFreeWater = self.DrySnow * self.WHC
+            self.FreeWater = self.FreeWater + self.SnowMelt + RainFall
+            InSoil = pcr.max(
+                self.FreeWater - MaxFreeWater, 0.0
+            )  # abundant water in snow pack which goes into soil
+            self.FreeWater = self.FreeWater - InSoil
+            RainAndSnowmelt = RainFall + self.SnowMelt
+
+            self.SnowCover = pcr.ifthenelse(self.DrySnow > 0, pcr.scalar(1), pcr.scalar(0))
+
+            # first part of precipitation is intercepted
+            # Interception=pcr.min(InSoil,self.ICF-self.InterceptionStorage)#: Interception in mm/timestep
+            # self.InterceptionStorage=self.InterceptionStorage+Interception #: Current interception storage
+            # NetInSoil=InSoil-Interception
+            NetInSoil = InSoil
+
+            self.SoilMoisture = self.SoilMoisture + NetInSoil
+            DirectRunoff = pcr.max(
+                self.SoilMoisture - self.FieldCapacity, 0.0
+            )  # if soil is filled to capacity: abundant water runs of directly
+            self.SoilMoisture = self.SoilMoisture - DirectRunoff
+            NetInSoil = NetInSoil - DirectRunoff  # net water which infiltrates into soil
+
+            # IntEvap=pcr.min(self.InterceptionStorage,self.PotEvaporation)  #: Evaporation from interception storage
+            # self.InterceptionStorage=self.InterceptionStorage-IntEvap
+
+            # I nthe origal HBV code
+            # RestEvap = pcr.max(0.0,self.PotEvaporation-IntEvap)
+
+            self.SoilEvap = pcr.ifthenelse(
+                self.SoilMoisture > self.Treshold,
+                pcr.min(self.SoilMoisture, RestEvap),
+                pcr.min(
+                    self.SoilMoisture,
+                    pcr.min(
+                        RestEvap, self.PotEvaporation * (self.SoilMoisture / self.Treshold)
+                    ),
+                ),
+            )
+            #: soil evapotranspiration
+            self.SoilMoisture = (
+                self.SoilMoisture - self.SoilEvap
+            )  # evaporation from soil moisture storage
+
+            self.ActEvap = (
+                self.IntEvap + self.SoilEvap
+            )  #: Sum of evaporation components (IntEvap+SoilEvap)
+            self.HBVSeepage = (
+                (pcr.min(self.SoilMoisture / self.FieldCapacity, 1)) ** self.BetaSeepage
+            ) * NetInSoil  # runoff water from soil
+            self.SoilMoisture = self.SoilMoisture - self.HBVSeepage
+
+            Backtosoil = pcr.min(
+                self.FieldCapacity - self.SoilMoisture, DirectRunoff
+            )  # correction for extremely wet periods: soil is filled to capacity
+            self.DirectRunoff = DirectRunoff - Backtosoil
+            self.SoilMoisture = self.SoilMoisture + Backtosoil
+            self.InUpperZone = (
+                self.DirectRunoff + self.HBVSeepage
+            )  # total water available for runoff
+
+            # Steps is always 1 at the moment
+            # calculations for Upper zone
+            self.UpperZoneStorage = (
+                self.UpperZoneStorage + self.InUpperZone
+            )  # incoming water from soil
+            self.Percolation = pcr.min(
+                self.PERC, self.UpperZoneStorage - self.InUpperZone / 2
+            )  # Percolation
+            self.UpperZoneStorage = self.UpperZoneStorage - self.Percolation
+            self.CapFlux = self.Cflux * (
+                ((self.FieldCapacity - self.SoilMoisture) / self.FieldCapacity)
+            )  #: Capillary flux flowing back to soil
+            self.CapFlux = pcr.min(self.UpperZoneStorage, self.CapFlux)
+            self.CapFlux = pcr.min(self.FieldCapacity - self.SoilMoisture, self.CapFlux)
+            self.UpperZoneStorage = self.UpperZoneStorage - self.CapFlux
+            self.SoilMoisture = self.SoilMoisture + self.CapFlux
+
+            if not self.SetKquickFlow:
+                self.QuickFlow = pcr.min(
+                    pcr.ifthenelse(
+                        self.Percolation < self.PERC,
+                        0,
+                        self.KQuickFlow
+                        * (
+                            (
+                                self.UpperZoneStorage
+                                - pcr.min(self.InUpperZone / 2, self.UpperZoneStorage)
+                            )
+                            ** (1.0 + self.AlphaNL)
+                        ),
+                    ),
+                    self.UpperZoneStorage,
+                )
+                self.UpperZoneStorage = pcr.max(
+                    pcr.ifthenelse(
+                        self.Percolation < self.PERC,
+                        self.UpperZoneStorage,
+                        self.UpperZoneStorage - self.QuickFlow,
+                    ),
+                    0,
+                )
+                # QuickFlow_temp = pcr.max(0,self.KQuickFlow*(self.UpperZoneStorage**(1.0+self.AlphaNL)))
+                # self.QuickFlow = pcr.min(QuickFlow_temp,self.UpperZoneStorage)
+                self.RealQuickFlow = self.ZeroMap
+            else:
+                self.QuickFlow = self.KQuickFlow * self.UpperZoneStorage
+                self.RealQuickFlow = pcr.max(
+                    0, self.K0 * (self.UpperZoneStorage - self.SUZ)
+                )
+                self.UpperZoneStorage = (
+                    self.UpperZoneStorage - self.QuickFlow - self.RealQuickFlow
+                )
+            """Quickflow volume in mm/timestep"""
+            # self.UpperZoneStorage=self.UpperZoneStorage-self.QuickFlow-self.RealQuickFlow
+
+            # calculations for Lower zone
+            self.LowerZoneStorage = self.LowerZoneStorage + self.Percolation
+            self.BaseFlow = pcr.min(
+                self.LowerZoneStorage, self.K4 * self.LowerZoneStorage
+            )  #: Baseflow in mm/timestep
+            self.LowerZoneStorage = self.LowerZoneStorage - self.BaseFlow
+            # Direct runoff generation
+            if self.ExternalQbase:
+                DirectRunoffStorage = self.QuickFlow + self.Seepage + self.RealQuickFlow
+            else:
+                DirectRunoffStorage = self.QuickFlow + self.BaseFlow + self.RealQuickFlow
+
+            self.InSoil = InSoil
+            self.RainAndSnowmelt = RainAndSnowmelt
+            self.NetInSoil = NetInSoil
+            self.InwaterMM = pcr.max(0.0, DirectRunoffStorage)
+
+        # mass wasting and glaciers only change the snow pack
         self.NrCell = pcr.areatotal(self.SnowCover, self.TopoId)
-        
-
-        # first part of precipitation is intercepted
-        # Interception=pcr.min(InSoil,self.ICF-self.InterceptionStorage)#: Interception in mm/timestep
-        # self.InterceptionStorage=self.InterceptionStorage+Interception #: Current interception storage
-        # NetInSoil=InSoil-Interception
-        NetInSoil = InSoil
-
-        self.SoilMoisture = self.SoilMoisture + NetInSoil
-        DirectRunoff = pcr.max(
-            self.SoilMoisture - self.FieldCapacity, 0.0
-        )  # if soil is filled to capacity: abundant water runs of directly
-        self.SoilMoisture = self.SoilMoisture - DirectRunoff
-        NetInSoil = NetInSoil - DirectRunoff  # net water which infiltrates into soil
 
         MaxSnowPack = 10000.0
         if self.MassWasting:
@@ -1255,115 +1668,6 @@ class WflowModel(pcraster.framework.DynamicModel):
                 self.FreeWater + self.GlacierMelt
             )
 
-        # IntEvap=pcr.min(self.InterceptionStorage,self.PotEvaporation)  #: Evaporation from interception storage
-        # self.InterceptionStorage=self.InterceptionStorage-IntEvap
-
-        # I nthe origal HBV code
-        # RestEvap = pcr.max(0.0,self.PotEvaporation-IntEvap)
-
-        self.SoilEvap = pcr.ifthenelse(
-            self.SoilMoisture > self.Treshold,
-            pcr.min(self.SoilMoisture, RestEvap),
-            pcr.min(
-                self.SoilMoisture,
-                pcr.min(
-                    RestEvap, self.PotEvaporation * (self.SoilMoisture / self.Treshold)
-                ),
-            ),
-        )
-        #: soil evapotranspiration
-        self.SoilMoisture = (
-            self.SoilMoisture - self.SoilEvap
-        )  # evaporation from soil moisture storage
-
-        self.ActEvap = (
-            self.IntEvap + self.SoilEvap
-        )  #: Sum of evaporation components (IntEvap+SoilEvap)
-        self.HBVSeepage = (
-            (pcr.min(self.SoilMoisture / self.FieldCapacity, 1)) ** self.BetaSeepage
-        ) * NetInSoil  # runoff water from soil
-        self.SoilMoisture = self.SoilMoisture - self.HBVSeepage
-
-        Backtosoil = pcr.min(
-            self.FieldCapacity - self.SoilMoisture, DirectRunoff
-        )  # correction for extremely wet periods: soil is filled to capacity
-        self.DirectRunoff = DirectRunoff - Backtosoil
-        self.SoilMoisture = self.SoilMoisture + Backtosoil
-        self.InUpperZone = (
-            self.DirectRunoff + self.HBVSeepage
-        )  # total water available for runoff
-
-        # Steps is always 1 at the moment
-        # calculations for Upper zone
-        self.UpperZoneStorage = (
-            self.UpperZoneStorage + self.InUpperZone
-        )  # incoming water from soil
-        self.Percolation = pcr.min(
-            self.PERC, self.UpperZoneStorage - self.InUpperZone / 2
-        )  # Percolation
-        self.UpperZoneStorage = self.UpperZoneStorage - self.Percolation
-        self.CapFlux = self.Cflux * (
-            ((self.FieldCapacity - self.SoilMoisture) / self.FieldCapacity)
-        )  #: Capillary flux flowing back to soil
-        self.CapFlux = pcr.min(self.UpperZoneStorage, self.CapFlux)
-        self.CapFlux = pcr.min(self.FieldCapacity - self.SoilMoisture, self.CapFlux)
-        self.UpperZoneStorage = self.UpperZoneStorage - self.CapFlux
-        self.SoilMoisture = self.SoilMoisture + self.CapFlux
-
-        if not self.SetKquickFlow:
-            self.QuickFlow = pcr.min(
-                pcr.ifthenelse(
-                    self.Percolation < self.PERC,
-                    0,
-                    self.KQuickFlow
-                    * (
-                        (
-                            self.UpperZoneStorage
-                            - pcr.min(self.InUpperZone / 2, self.UpperZoneStorage)
-                        )
-                        ** (1.0 + self.AlphaNL)
-                    ),
-                ),
-                self.UpperZoneStorage,
-            )
-            self.UpperZoneStorage = pcr.max(
-                pcr.ifthenelse(
-                    self.Percolation < self.PERC,
-                    self.UpperZoneStorage,
-                    self.UpperZoneStorage - self.QuickFlow,
-                ),
-                0,
-            )
-            # QuickFlow_temp = pcr.max(0,self.KQuickFlow*(self.UpperZoneStorage**(1.0+self.AlphaNL)))
-            # self.QuickFlow = pcr.min(QuickFlow_temp,self.UpperZoneStorage)
-            self.RealQuickFlow = self.ZeroMap
-        else:
-            self.QuickFlow = self.KQuickFlow * self.UpperZoneStorage
-            self.RealQuickFlow = pcr.max(
-                0, self.K0 * (self.UpperZoneStorage - self.SUZ)
-            )
-            self.UpperZoneStorage = (
-                self.UpperZoneStorage - self.QuickFlow - self.RealQuickFlow
-            )
-        """Quickflow volume in mm/timestep"""
-        # self.UpperZoneStorage=self.UpperZoneStorage-self.QuickFlow-self.RealQuickFlow
-
-        # calculations for Lower zone
-        self.LowerZoneStorage = self.LowerZoneStorage + self.Percolation
-        self.BaseFlow = pcr.min(
-            self.LowerZoneStorage, self.K4 * self.LowerZoneStorage
-        )  #: Baseflow in mm/timestep
-        self.LowerZoneStorage = self.LowerZoneStorage - self.BaseFlow
-        # Direct runoff generation
-        if self.ExternalQbase:
-            DirectRunoffStorage = self.QuickFlow + self.Seepage + self.RealQuickFlow
-        else:
-            DirectRunoffStorage = self.QuickFlow + self.BaseFlow + self.RealQuickFlow
-
-        self.InSoil = InSoil
-        self.RainAndSnowmelt = RainAndSnowmelt
-        self.NetInSoil = NetInSoil
-        self.InwaterMM = pcr.max(0.0, DirectRunoffStorage)
         self.Inwater = self.InwaterMM * self.ToCubic
 
         # only run the reservoir module if needed
@@ -1433,8 +1737,7 @@ class WflowModel(pcraster.framework.DynamicModel):
         q = self.Inwater / self.DCL + self.ForecQ_qmec / self.DCL
         self.OldSurfaceRunoff = self.SurfaceRunoff
 
-        self.SurfaceRunoff = pcr.kinematic(
-            self.TopoLdd,
+        self.SurfaceRunoff = self.Router.kinematic(
             self.SurfaceRunoff,
             q,
             self.Alpha,
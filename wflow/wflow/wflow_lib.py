@@ -39,7 +39,6 @@ import sys
 import zipfile
 
 import numpy as np
-import osgeo.gdal as gdal
 import pcraster as pcr
 import pcraster.framework
 
@@ -1325,6 +1324,8 @@ def readMap(fileName, fileFormat):
     :param fileFormat:
     :return x, y, data, FillVal:
     """
+    import osgeo.gdal as gdal
+
     # Open file for binary-reading
     mapFormat = gdal.GetDriverByName(fileFormat)
     mapFormat.Register()
@@ -1372,6 +1373,8 @@ def cutMapById(data, subcatchmap, id, x, y, FillVal):
             xmin = xmin - 1
         if xmax < len(x) - 1:
             xmax = xmax + 1
+        else:
+            xmax = len(x)
 
         yid, = np.where(scid.max(axis=1))
         ymin = yid.min()
@@ -1380,6 +1383,8 @@ def cutMapById(data, subcatchmap, id, x, y, FillVal):
             ymin = ymin - 1
         if ymax < len(y) - 1:
             ymax = ymax + 1
+        else:
+            ymax = len(y)
 
         return (
             x[xmin:xmax].copy(),
@@ -1392,6 +1397,7 @@ def cutMapById(data, subcatchmap, id, x, y, FillVal):
 
 def writeMap(fileName, fileFormat, x, y, data, FillVal):
     """ Write geographical data into file"""
+    import osgeo.gdal as gdal
 
     verbose = False
     gdal.AllRegister()
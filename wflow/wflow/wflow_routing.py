@@ -63,6 +63,7 @@ import os.path
 
 import pcraster.framework
 from wflow.wf_DynamicFramework import *
+from wflow.wf_kinematic import kinematicRouter
 from wflow.wflow_adapt import *
 from wflow.wflow_funcs import *
 
@@ -254,6 +255,9 @@ class WflowModel(pcraster.framework.DynamicModel):
         self.updating = int(configget(self.config, "model", "updating", "0"))
         self.updateFile = configget(self.config, "model", "updateFile", "no_set")
         self.Tslice = int(configget(self.config, "model", "Tslice", "1"))
+        self.RoutingEngine = configget(
+            self.config, "model", "RoutingEngine", "pcraster"
+        )
         self.sCatch = int(configget(self.config, "model", "sCatch", "0"))
         self.intbl = configget(self.config, "model", "intbl", "intbl")
         self.timestepsecs = int(
@@ -582,6 +586,8 @@ class WflowModel(pcraster.framework.DynamicModel):
                 self.Dir + "/" + self.runId + "/outsum/DistToUpdPt.map",
             )
 
+        self.Router = kinematicRouter(self.RoutingEngine, self.TopoLdd)
+
         # self.IF = self.ZeroMap
         self.logger.info("End of initial section")
 
@@ -866,8 +872,7 @@ class WflowModel(pcraster.framework.DynamicModel):
         # per distance along stream
         q = self.Inwater / self.DCL
         # discharge (m3/s)
-        self.SurfaceRunoff = pcr.kinematic(
-            self.TopoLdd,
+        self.SurfaceRunoff = self.Router.kinematic(
             self.SurfaceRunoff,
             q,
             self.Alpha,
@@ -920,8 +925,7 @@ class WflowModel(pcraster.framework.DynamicModel):
                 # per distance along stream
                 q = self.Inwater / self.DCL
                 # discharge (m3/s)
-                self.SurfaceRunoff = pcr.kinematic(
-                    self.TopoLdd,
+                self.SurfaceRunoff = self.Router.kinematic(
                     self.OldSurfaceRunoff,
                     q,
                     self.Alpha,
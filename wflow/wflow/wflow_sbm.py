@@ -101,6 +101,95 @@ wflow = "wflow_sbm: "
 
 updateCols = []
 
+# structured arrays with the layer, static and dynamic variables of sbm_cell
+layer_dtype = np.dtype(
+    [('c', np.float64),
+     ('UStoreLayerDepth', np.float64),
+     ('st', np.float64),
+     ('KsatVerFrac', np.float64),
+     ('ActEvapUstore', np.float64),
+     ('vwc', np.float64),
+     ('vwc_perc', np.float64),
+     ('UStoreLayerThickness', np.float64),
+     ('UStest', np.float64)
+    ])
+
+static_dtype = np.dtype(
+    [('KsatVer', np.float64),
+     ('KsatHorFrac', np.float64),
+     ('f', np.float64),
+     ('thetaS', np.float64),
+     ('thetaR', np.float64),
+     ('SoilThickness', np.float64),
+     ('InfiltCapSoil', np.float64),
+     ('PathFrac', np.float64),
+     ('InfiltCapPath', np.float64),
+     ('cf_soil', np.float64),
+     ('neff', np.float64),
+     ('slope', np.float64),
+     ('SoilWaterCapacity', np.float64),
+     ('MaxLeakage', np.float64),
+     ('CanopyGapFraction', np.float64),
+     ('CapScale', np.float64),
+     ('rootdistpar', np.float64),
+     ('River', np.float64),
+     ('DL', np.float64),
+     ('DW', np.float64),
+     ('SW', np.float64),
+     ('Beta', np.float64),
+     ('DCL', np.float64),
+     ('reallength', np.float64),
+     ('RootingDepth', np.float64),
+     ('ActRootingDepth', np.float64),
+     ('ssfmax', np.float64),
+     ('xl', np.float64),
+     ('yl', np.float64),
+     ('h_p', np.float64),
+     ('Bw', np.float64),
+     ('AlpPow', np.float64),
+     ('AlpTermR', np.float64)
+     ])
+
+dyn_dtype = np.dtype(
+    [('restEvap', np.float64),
+     ('AvailableForInfiltration', np.float64),
+     ('TSoil', np.float64),
+     ('zi', np.float64),
+     ('SatWaterDepth', np.float64),
+     ('ssf', np.float64),
+     ('LandRunoff', np.float64),
+     ('PotTransSoil', np.float64),
+     ('ActEvapOpenWaterLand', np.float64),
+     ('RiverRunoff', np.float64),
+     ('AlphaL', np.float64),
+     ('AlphaR', np.float64),
+     ('ExcessWater', np.float64),
+     ('ExfiltWater', np.float64),
+     ('soilevap', np.float64),
+     ('Transfer', np.float64),
+     ('CapFlux', np.float64),
+     ('qo_toriver', np.float64),
+     ('ssf_toriver', np.float64),
+     ('ActEvapUStore', np.float64),
+     ('ActEvapSat', np.float64),
+     ('ActInfilt', np.float64),
+     ('RunoffLandCells', np.float64),
+     ('ActLeakage', np.float64),
+     ('PondingDepth', np.float64),
+     ('RootStore_unsat', np.float64),
+     ('CellInFlow', np.float64),
+     ('InwaterO', np.float64),
+     ('SoilWatbal', np.float64),
+     ('Qo_in', np.float64),
+     ('WaterLevelL', np.float64),
+     ('InfiltSoilPath',np.float64),
+     ('sumUStoreLayerDepth', np.float64),
+     ('SatWaterDepthOld', np.float64),
+     ('sumUStoreLayerDepthOld', np.float64),
+     ('InfiltWater', np.float64)
+     ])
+
+
 def usage(*args):
     sys.stdout = sys.stderr
     """Way"""
@@ -124,7 +213,7 @@ def estimate_iterations_kin_wave(Q, Beta, alpha, timestepsecs, dx, mv):
     return it_kin
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def _sCurve(X, a=0.0, b=1.0, c=1.0):
     """
     sCurve function:
@@ -144,7 +233,7 @@ def _sCurve(X, a=0.0, b=1.0, c=1.0):
     return s
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def actEvap_unsat_SBM(
     RootingDepth,
     UStoreDepth,
@@ -235,7 +324,7 @@ def actEvap_unsat_SBM(
     return UStoreDepth, sumActEvapUStore, RestPotEvap
 
 
-@jit(nopython=True)    
+@jit(nopython=True, cache=True)    
 def infiltration(AvailableForInfiltration, PathFrac, cf_soil, TSoil,InfiltCapSoil,InfiltCapPath, UStoreCapacity, modelSnow, soilInfReduction):
     
     SoilInf = AvailableForInfiltration  * (1 - PathFrac)
@@ -252,7 +341,7 @@ def infiltration(AvailableForInfiltration, PathFrac, cf_soil, TSoil,InfiltCapSoi
     return InfiltSoilPath
 
 
-@jit(nopython=True)  
+@jit(nopython=True, cache=True)  
 def unsatzone_flow(UStoreLayerDepth, InfiltSoilPath, L, z, KsatVerFrac, c, KsatVer, f, thetaS, thetaR, SoilWaterCapacity, SWDold, shape_layer, TransferMethod):
     
     m = 0
@@ -289,7 +378,7 @@ def unsatzone_flow(UStoreLayerDepth, InfiltSoilPath, L, z, KsatVerFrac, c, KsatV
     return ast, UStoreLayerDepth
     
     
-@jit(nopython=True)    
+@jit(nopython=True, cache=True)    
 def sbm_cell(nodes, nodes_up, ldd, layer, static, dyn, modelSnow, soilInfReduction, timestepsecs, basetimestep, deltaT, nrpaddyirri, shape, TransferMethod, it_kinL=1, ust=0):
         
     shape_layer = layer['UStoreLayerThickness'].shape
@@ -1819,17 +1908,6 @@ class WflowModel(pcraster.framework.DynamicModel):
         # width for overland kinematic reservoir        
         self.SW = pcr.ifthenelse(self.River, pcr.max(self.DW - self.RiverWidth,0), self.DW)
         
-        layer_dtype = np.dtype(
-                [('c', np.float64),
-                 ('UStoreLayerDepth', np.float64),
-                 ('st', np.float64),
-                 ('KsatVerFrac', np.float64),
-                 ('ActEvapUstore', np.float64),
-                 ('vwc', np.float64),
-                 ('vwc_perc', np.float64),
-                 ('UStoreLayerThickness', np.float64),
-                 ('UStest', np.float64)
-                ])        
         
         self.layer = np.zeros((self.maxLayers,np_zeros.size), dtype=layer_dtype)       
         
@@ -1837,41 +1915,6 @@ class WflowModel(pcraster.framework.DynamicModel):
             self.layer['c'][n] = pcr.pcr2numpy(self.c[n], self.mv).ravel()
             self.layer['KsatVerFrac'][n] = pcr.pcr2numpy(self.KsatVerFrac[n], self.mv).ravel()
         
-        static_dtype = np.dtype(
-                [('KsatVer', np.float64),
-                 ('KsatHorFrac', np.float64),
-                 ('f', np.float64),
-                 ('thetaS', np.float64),
-                 ('thetaR', np.float64),
-                 ('SoilThickness', np.float64),
-                 ('InfiltCapSoil', np.float64),
-                 ('PathFrac', np.float64),
-                 ('InfiltCapPath', np.float64),
-                 ('cf_soil', np.float64),
-                 ('neff', np.float64),
-                 ('slope', np.float64),
-                 ('SoilWaterCapacity', np.float64),
-                 ('MaxLeakage', np.float64),
-                 ('CanopyGapFraction', np.float64),
-                 ('CapScale', np.float64),
-                 ('rootdistpar', np.float64),
-                 ('River', np.float64),
-                 ('DL', np.float64),
-                 ('DW', np.float64),
-                 ('SW', np.float64),
-                 ('Beta', np.float64),
-                 ('DCL', np.float64),
-                 ('reallength', np.float64),
-                 ('RootingDepth', np.float64),
-                 ('ActRootingDepth', np.float64),
-                 ('ssfmax', np.float64),
-                 ('xl', np.float64),
-                 ('yl', np.float64),
-                 ('h_p', np.float64),
-                 ('Bw', np.float64),
-                 ('AlpPow', np.float64),
-                 ('AlpTermR', np.float64)
-                 ])
         
             
         self.static = np.zeros(np_zeros.size, dtype=static_dtype)   
@@ -1929,44 +1972,6 @@ class WflowModel(pcraster.framework.DynamicModel):
             
             self.layer['UStoreLayerThickness'][n] = UstoreThick
         
-        dyn_dtype = np.dtype(
-                [('restEvap', np.float64),
-                 ('AvailableForInfiltration', np.float64),
-                 ('TSoil', np.float64),
-                 ('zi', np.float64),
-                 ('SatWaterDepth', np.float64),
-                 ('ssf', np.float64),
-                 ('LandRunoff', np.float64),
-                 ('PotTransSoil', np.float64),
-                 ('ActEvapOpenWaterLand', np.float64),
-                 ('RiverRunoff', np.float64),
-                 ('AlphaL', np.float64),
-                 ('AlphaR', np.float64),
-                 ('ExcessWater', np.float64),
-                 ('ExfiltWater', np.float64),
-                 ('soilevap', np.float64),
-                 ('Transfer', np.float64),
-                 ('CapFlux', np.float64),
-                 ('qo_toriver', np.float64),
-                 ('ssf_toriver', np.float64),
-                 ('ActEvapUStore', np.float64),
-                 ('ActEvapSat', np.float64),
-                 ('ActInfilt', np.float64),
-                 ('RunoffLandCells', np.float64),
-                 ('ActLeakage', np.float64),
-                 ('PondingDepth', np.float64),
-                 ('RootStore_unsat', np.float64),
-                 ('CellInFlow', np.float64),
-                 ('InwaterO', np.float64),
-                 ('SoilWatbal', np.float64),
-                 ('Qo_in', np.float64),
-                 ('WaterLevelL', np.float64),
-                 ('InfiltSoilPath',np.float64),
-                 ('sumUStoreLayerDepth', np.float64),
-                 ('SatWaterDepthOld', np.float64),
-                 ('sumUStoreLayerDepthOld', np.float64),
-                 ('InfiltWater', np.float64)
-                 ])        
         
         self.dyn = np.zeros(np_zeros.size, dtype=dyn_dtype)
         
@@ -37,6 +37,7 @@ import getopt
 
 from wflow.wf_DynamicFramework import *
 from wflow.wflow_adapt import *
+from wflow.wflow_funcs import accucapacity, drainage_network, upstream_sum
 
 # import scipy
 
@@ -378,6 +379,11 @@ class WflowModel(DynamicModel):
         )
         if self.RunRiverModel == 1:
             self.LandTransportMethod = 1
+        # Route all particle classes in one pass over the ldd with the numba
+        # kernels of wflow_funcs (1) or per class with pcraster (0)
+        self.FusedTransport = int(
+            configget(self.config, "model", "fusedtransport", "0")
+        )
 
         # Static maps to use
         wflow_dem = configget(
@@ -984,8 +990,50 @@ class WflowModel(DynamicModel):
             tt_filter = pcr2numpy(self.filter_Eros_TC, 1.0)
             self.filterResArea = tt_filter.min()
 
+        if self.FusedTransport == 1:
+            # Drainage network (upstream to downstream) for the transport kernels
+            self.mv = -999
+            np_ldd = pcr2numpy(self.TopoLdd, self.mv)
+            self.shape = np_ldd.shape
+            self.nodes, self.nodes_up, rnodes, rnodes_up = drainage_network(np_ldd)
+
         self.logger.info("Starting Dynamic run...")
 
+    def _tonumpy(self, maps):
+        """
+      Stack a list of pcraster maps into a (nclass, ncell) numpy array with nan
+      as missing value
+      """
+        return numpy.vstack([pcr2numpy(m, numpy.nan).ravel() for m in maps])
+
+    def _topcr(self, arr):
+        """
+      Convert a (nclass, ncell) numpy array back to a list of pcraster maps
+      """
+        arr = numpy.where(numpy.isnan(arr), self.mv, arr)
+        return [numpy2pcr(Scalar, a.reshape(self.shape), self.mv) for a in arr]
+
+    def accucapacityclasses(self, materials, capacities):
+        """
+      Accumulate several classes of material limited by their transport
+      capacity in one pass over the ldd. Returns the lists of flux and state maps
+      (as accucapacityflux and accucapacitystate for each class).
+      """
+        flux, state = accucapacity(
+            self.nodes,
+            self.nodes_up,
+            self._tonumpy(materials),
+            self._tonumpy(capacities),
+        )
+        return self._topcr(flux), self._topcr(state)
+
+    def upstreamclasses(self, maps):
+        """
+      Sum of the upstream cells for several maps in one pass over the ldd
+      (as upstream for each map).
+      """
+        return self._topcr(upstream_sum(self.nodes, self.nodes_up, self._tonumpy(maps)))
+
     def resume(self):
         """ 
     *Required*
@@ -1281,15 +1329,25 @@ class WflowModel(DynamicModel):
 
             # To get total sediment input from land into the river systems, river cells transport all sediment to the output (huge TC)
             self.TCRiv = cover(ifthenelse(self.River == 1, 10 ** 9, self.TC), self.TC)
-            # Transported sediment over the land
-            self.SedFlux = accucapacityflux(
-                self.TopoLdd, self.SoilLoss, self.TCRiv
-            )  # [ton/cell/tinestep]
-            # Deposited sediment over the land
-            self.SedDep = accucapacitystate(self.TopoLdd, self.SoilLoss, self.TCRiv)
-
-            # Sediment amount reaching each river cell '''
-            self.SedDep2 = accucapacitystate(self.TopoLdd, self.SoilLoss, self.TC)
+            if self.FusedTransport == 1:
+                flux, state = self.accucapacityclasses(
+                    [self.SoilLoss, self.SoilLoss], [self.TCRiv, self.TC]
+                )
+                self.SedFlux = flux[0]
+                self.SedDep = state[0]
+                self.SedDep2 = state[1]
+            else:
+                # Transported sediment over the land
+                self.SedFlux = accucapacityflux(
+                    self.TopoLdd, self.SoilLoss, self.TCRiv
+                )  # [ton/cell/tinestep]
+                # Deposited sediment over the land
+                self.SedDep = accucapacitystate(
+                    self.TopoLdd, self.SoilLoss, self.TCRiv
+                )
+
+                # Sediment amount reaching each river cell '''
+                self.SedDep2 = accucapacitystate(self.TopoLdd, self.SoilLoss, self.TC)
             # Remove inland deposition
             self.OvSed = cover(ifthenelse(self.River == 1, self.SedDep2, 0.0), 0.0)
 
@@ -1525,45 +1583,35 @@ class WflowModel(DynamicModel):
                 )
 
             # Eroded sediment in overland flow reaching the river system per particle class [ton/cell/timestep]
+            LandErod = [
+                self.LandErodClay,
+                self.LandErodSilt,
+                self.LandErodSand,
+                self.LandErodSagg,
+                self.LandErodLagg,
+            ]
+            TCLand = [self.TCClay, self.TCSilt, self.TCSand, self.TCSagg, self.TCLagg]
+            if self.FusedTransport == 1:
+                flux, InLandState = self.accucapacityclasses(LandErod, TCLand)
+            else:
+                InLandState = [
+                    accucapacitystate(self.TopoLdd, erod, tc)
+                    for erod, tc in zip(LandErod, TCLand)
+                ]
             self.InLandClay = cover(
-                ifthenelse(
-                    self.River == 1,
-                    accucapacitystate(self.TopoLdd, self.LandErodClay, self.TCClay),
-                    0.0,
-                ),
-                0.0,
+                ifthenelse(self.River == 1, InLandState[0], 0.0), 0.0
             )
             self.InLandSilt = cover(
-                ifthenelse(
-                    self.River == 1,
-                    accucapacitystate(self.TopoLdd, self.LandErodSilt, self.TCSilt),
-                    0.0,
-                ),
-                0.0,
+                ifthenelse(self.River == 1, InLandState[1], 0.0), 0.0
             )
             self.InLandSand = cover(
-                ifthenelse(
-                    self.River == 1,
-                    accucapacitystate(self.TopoLdd, self.LandErodSand, self.TCSand),
-                    0.0,
-                ),
-                0.0,
+                ifthenelse(self.River == 1, InLandState[2], 0.0), 0.0
             )
             self.InLandSagg = cover(
-                ifthenelse(
-                    self.River == 1,
-                    accucapacitystate(self.TopoLdd, self.LandErodSagg, self.TCSagg),
-                    0.0,
-                ),
-                0.0,
+                ifthenelse(self.River == 1, InLandState[3], 0.0), 0.0
             )
             self.InLandLagg = cover(
-                ifthenelse(
-                    self.River == 1,
-                    accucapacitystate(self.TopoLdd, self.LandErodLagg, self.TCLagg),
-                    0.0,
-                ),
-                0.0,
+                ifthenelse(self.River == 1, InLandState[4], 0.0), 0.0
             )
             self.InLandSed = (
                 self.InLandClay
@@ -1627,40 +1675,29 @@ class WflowModel(DynamicModel):
             self.OldLaggLoad = self.LaggLoad
             self.OldGravLoad = self.GravLoad
 
+            # Incoming load from upstream river cells
+            OutLoads = [
+                self.OutSedLoad,
+                self.OutClayLoad,
+                self.OutSiltLoad,
+                self.OutSandLoad,
+                self.OutSaggLoad,
+                self.OutLaggLoad,
+                self.OutGravLoad,
+            ]
+            if self.FusedTransport == 1:
+                UpLoads = self.upstreamclasses(OutLoads)
+            else:
+                UpLoads = [upstream(self.TopoLdd, load) for load in OutLoads]
+
             # Input concentration including the old load, the incoming load from upstream river cells and the incoming load from land erosion
-            self.InSedLoad = (
-                self.OldSedLoad
-                + upstream(self.TopoLdd, self.OutSedLoad)
-                + self.InLandSed
-            )
-            self.InClayLoad = (
-                self.OldClayLoad
-                + upstream(self.TopoLdd, self.OutClayLoad)
-                + self.InLandClay
-            )
-            self.InSiltLoad = (
-                self.OldSiltLoad
-                + upstream(self.TopoLdd, self.OutSiltLoad)
-                + self.InLandSilt
-            )
-            self.InSandLoad = (
-                self.OldSandLoad
-                + upstream(self.TopoLdd, self.OutSandLoad)
-                + self.InLandSand
-            )
-            self.InSaggLoad = (
-                self.OldSaggLoad
-                + upstream(self.TopoLdd, self.OutSaggLoad)
-                + self.InLandSagg
-            )
-            self.InLaggLoad = (
-                self.OldLaggLoad
-                + upstream(self.TopoLdd, self.OutLaggLoad)
-                + self.InLandLagg
-            )
-            self.InGravLoad = self.OldGravLoad + upstream(
-                self.TopoLdd, self.OutGravLoad
-            )
+            self.InSedLoad = self.OldSedLoad + UpLoads[0] + self.InLandSed
+            self.InClayLoad = self.OldClayLoad + UpLoads[1] + self.InLandClay
+            self.InSiltLoad = self.OldSiltLoad + UpLoads[2] + self.InLandSilt
+            self.InSandLoad = self.OldSandLoad + UpLoads[3] + self.InLandSand
+            self.InSaggLoad = self.OldSaggLoad + UpLoads[4] + self.InLandSagg
+            self.InLaggLoad = self.OldLaggLoad + UpLoads[5] + self.InLandLagg
+            self.InGravLoad = self.OldGravLoad + UpLoads[6]
 
             """ River erosion """
             # Hydraulic radius of the river [m] (rectangular channel)
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+
+# Wflow is Free software, see below:
+#
+# Copyright (c) J. Schellekens 2005-2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+wflow_service -- keep a wflow model in memory between forecast cycles
+
+Usage::
+
+    -C CaseName
+    -c inifile (default = wflow_sbm.ini)
+    -M model (e.g. wflow_sbm, default = modeltype in the model section of the
+       ini file or the name of the ini file)
+    -R runId (default = run_default)
+    -K maximum number of states kept in memory (default = 8)
+
+The service reads commands from stdin, one per line, and answers each command
+with one line on stdout that starts with ok or error::
+
+    run                 run a forecast cycle
+    keep                keep the current states in memory
+    restore datetime    set the states to the states kept at datetime
+    save directory      write the current states to directory
+    times               list the date/times of the states kept in memory
+    quit                stop the service
+
+The model is initialised (initial and resume) at the first run. Each following
+run reads the start and end time from the [run] section of the ini file or
+the runinfo file and the forcing as configured (mapstacks or netcdfinput),
+but skips the initial section. The states at the state time (start) of the run
+are taken from memory: either the states at the end of the previous run or states
+kept at that time. If they are not in memory the states are read from the instate
+directory. The states at the end of each run are kept in memory, states are only
+written to disk with the save command.
+
+If the ini file is changed in another section than [run] the model is
+initialised again and all states kept in memory are dropped.
+"""
+
+import collections
+import configparser
+import getopt
+import logging
+import os.path
+import sys
+
+from dateutil import parser
+
+
+def usage(*args):
+    sys.stdout = sys.stderr
+    for msg in args:
+        print(msg)
+    print(__doc__)
+    sys.exit(0)
+
+
+class HotStart(object):
+    """
+    A wflow model that is kept initialised in memory between runs, with the
+    states of the model at a number of date/times.
+    """
+
+    def __init__(
+        self,
+        caseName,
+        inifile,
+        runId="run_default",
+        model=None,
+        maxstates=8,
+        loglevel=logging.INFO,
+    ):
+        self.caseName = os.path.abspath(caseName)
+        self.inifile = inifile
+        self.runId = runId
+        self.model = model
+        self.maxstates = maxstates
+        self.loglevel = loglevel
+        self.logger = logging.getLogger(__name__)
+
+        self.dynModelFw = None
+        self.runconfig = None
+        self.time = None
+        self.states = collections.OrderedDict()
+
+    def _readConfig(self):
+        """
+        Returns the ini file as a dictionary of sections
+        """
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config.read(os.path.join(self.caseName, self.inifile))
+        return {sect: dict(config.items(sect)) for sect in config.sections()}
+
+    def initialize(self):
+        """
+        Initialises the model (initial and resume) and drops all states kept in
+        memory
+        """
+        import wflow.wflow_bmi as wfbmi
+
+        if self.model is None:
+            config = wfbmi.iniFileSetUp(os.path.join(self.caseName, self.inifile))
+            self.model, useddef = wfbmi.configget(
+                config, "model", "modeltype", os.path.splitext(self.inifile)[0]
+            )
+        wf = wfbmi.wflow_model(self.model)
+
+        myModel = wf.WflowModel(
+            "wflow_subcatch.map", self.caseName, self.runId, self.inifile
+        )
+        self.dynModelFw = wf.wf_DynamicFramework(myModel, 0, firstTimestep=1)
+        self.dynModelFw.createRunId(
+            NoOverWrite=False,
+            level=self.loglevel,
+            model=self.model,
+            doSetupFramework=False,
+        )
+        self.logger = self.dynModelFw.logger
+        self.dynModelFw.setupFramework()
+        self.dynModelFw._runInitial()
+        self.dynModelFw._runResume()
+        self.time = self.dynModelFw.DT.runStateTime
+        self.states.clear()
+
+    def run(self):
+        """
+        Runs a forecast cycle, see the module documentation
+
+        Output:
+            - date/time at the end of the run
+        """
+        runconfig = self._readConfig()
+        if self.dynModelFw is None or {
+            sect: opts for sect, opts in runconfig.items() if sect != "run"
+        } != {sect: opts for sect, opts in self.runconfig.items() if sect != "run"}:
+            if self.dynModelFw is not None:
+                self.logger.info("Run configuration changed, initialising the model")
+            self.initialize()
+        else:
+            config = self.dynModelFw._userModel().config
+            for opt, value in runconfig.get("run", {}).items():
+                config.set("run", opt, value)
+            self.dynModelFw.setupFramework()
+
+            statetime = self.dynModelFw.DT.runStateTime
+            if statetime in self.states:
+                self.restore(statetime)
+            elif statetime != self.time:
+                self.logger.warning(
+                    "No states for "
+                    + str(statetime)
+                    + " in memory, reading the states from disk"
+                )
+                self.dynModelFw._runResume()
+        self.runconfig = runconfig
+
+        self.dynModelFw._runDynamic(0, 0)
+        self.dynModelFw._wf_shutdown()
+        self.time = self.dynModelFw.DT.currentDateTime
+        self.keep()
+        return self.time
+
+    def keep(self):
+        """
+        Keeps a copy of the current states in memory, the oldest states are
+        dropped if more than maxstates are kept
+        """
+        self.states[self.time] = self.dynModelFw.wf_supplyStatesAsNumpy()
+        self.states.move_to_end(self.time)
+        while len(self.states) > self.maxstates:
+            self.states.popitem(last=False)
+
+    def restore(self, time):
+        """
+        Sets the states of the model to the states kept in memory at time
+        """
+        if time not in self.states:
+            raise ValueError("No states for " + str(time) + " in memory")
+        self.dynModelFw.wf_setStatesFromNumpy(self.states[time])
+        self.time = time
+
+    def save(self, directory):
+        """
+        Writes the current states to directory
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.dynModelFw.wf_suspend(directory)
+        self.dynModelFw.wf_waitStates()
+
+
+def serve(service, infile=sys.stdin, outfile=sys.stdout):
+    """
+    Executes the commands read from infile, see the module documentation
+    """
+    for line in infile:
+        cmd = line.split()
+        if len(cmd) == 0:
+            continue
+        try:
+            if cmd[0] == "run":
+                reply = "ok " + str(service.run())
+            elif cmd[0] == "keep":
+                service.keep()
+                reply = "ok " + str(service.time)
+            elif cmd[0] == "restore":
+                service.restore(parser.parse(" ".join(cmd[1:])))
+                reply = "ok " + str(service.time)
+            elif cmd[0] == "save":
+                service.save(os.path.abspath(" ".join(cmd[1:])))
+                reply = "ok " + str(service.time)
+            elif cmd[0] == "times":
+                reply = "ok " + ",".join([str(t) for t in service.states])
+            elif cmd[0] == "quit":
+                outfile.write("ok\n")
+                outfile.flush()
+                break
+            else:
+                reply = "error Unknown command: " + cmd[0]
+        except Exception as e:
+            service.logger.error("Command failed: " + line.strip())
+            service.logger.error(sys.exc_info())
+            reply = "error " + str(e)
+        outfile.write(reply + "\n")
+        outfile.flush()
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hC:c:M:R:K:")
+    except getopt.error as msg:
+        usage(msg)
+
+    caseName = "thecase"
+    inifile = "wflow_sbm.ini"
+    model = None
+    runId = "run_default"
+    maxstates = 8
+
+    for o, a in opts:
+        if o == "-C":
+            caseName = a
+        if o == "-c":
+            inifile = a
+        if o == "-M":
+            model = a
+        if o == "-R":
+            runId = a
+        if o == "-K":
+            maxstates = int(a)
+        if o == "-h":
+            usage()
+
+    serve(HotStart(caseName, inifile, runId=runId, model=model, maxstates=maxstates))
+
+
+if __name__ == "__main__":
+    main()
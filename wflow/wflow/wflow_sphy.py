@@ -226,6 +226,9 @@ class WflowModel(DynamicModel):
       are saved to disk as pcraster maps. Use resume() to re-read them
     """
 
+        # -wait until the maps queued by the reporting module are written
+        self.reporting.closereporting(self)
+
         self.logger.info("Saving initial conditions...")
         self.wf_suspend(os.path.join(self.SaveDir, "outstate"))
 
@@ -26,10 +26,11 @@ import wflow.JarvisCoefficients as JarvisCoefficients
 
 
 import os.path
-from copy import deepcopy as copylist
 
 import pcraster.framework
 from wflow.wf_DynamicFramework import *
+from wflow.wf_kinematic import kinematicRouter
+from wflow.reservoir_classes import ClassStack, mapArray
 from wflow.wflow_adapt import *
 
 import pcraster as pcr
@@ -53,6 +54,28 @@ def usage(*args):
     sys.exit(0)
 
 
+def reservoirFunction(module, name, default):
+    """
+    Returns the function of a reservoir module selected in the ini file (default if
+    no function is selected)
+    """
+    if not name:
+        name = default
+    if not hasattr(module, name):
+        raise ValueError(
+            "Function %s not found in %s, check the ini file" % (name, module.__name__)
+        )
+    return getattr(module, name)
+
+
+def classesFunction(module, function):
+    """
+    Returns the version of a reservoir function that runs all classes at once
+    (<function>_classes), None if the module has no such version
+    """
+    return getattr(module, function.__name__ + "_classes", None)
+
+
 class WflowModel(pcraster.framework.DynamicModel):
     """
   The user defined model class. This is your work!
@@ -417,6 +440,9 @@ class WflowModel(pcraster.framework.DynamicModel):
 
         # Set and get defaults from ConfigFile here ###################################
         self.Tslice = int(configget(self.config, "model", "Tslice", "1"))
+        self.RoutingEngine = configget(
+            self.config, "model", "RoutingEngine", "pcraster"
+        )
         self.timestepsecs = int(
             configget(self.config, "model", "timestepsecs", "3600")
         )  # number of seconds in a timestep
@@ -513,6 +539,62 @@ class WflowModel(pcraster.framework.DynamicModel):
 
         self.selectRout = configget(self.config, "model", "selectRout", " ")
 
+        # resolve the reservoir functions once, in the order they are run for each class
+        self.classFunctions = [
+            [
+                reservoirFunction(reservoir_Sw, self.selectSw[k], "snow_no_reservoir"),
+                reservoirFunction(
+                    reservoir_Si, self.selectSi[k], "interception_no_reservoir"
+                ),
+                reservoirFunction(
+                    reservoir_Sa, self.selectSa[k], "agriZone_no_reservoir"
+                ),
+                reservoirFunction(
+                    reservoir_Su, self.selectSu[k], "unsatZone_no_reservoir"
+                ),
+                reservoirFunction(
+                    reservoir_Sf, self.selectSf[k], "fastRunoff_no_reservoir"
+                ),
+                reservoirFunction(
+                    reservoir_Sf, self.selectSfa[k], "fastAgriRunoff_no_reservoir"
+                ),
+            ]
+            for k in self.Classes
+        ]
+        # A reservoir is run for all classes at once if all classes use the same
+        # function and it has a version for all classes. These functions only use
+        # the states and fluxes of their own class, so (as the snow functions do not
+        # use interception and agriculture zone variables) the interception and
+        # agriculture zone can run before and the fast agriculture runoff after the
+        # loop over the classes.
+        modules = [
+            reservoir_Sw,
+            reservoir_Si,
+            reservoir_Sa,
+            reservoir_Su,
+            reservoir_Sf,
+            reservoir_Sf,
+        ]
+        allClasses = [
+            classesFunction(module, functions[0]) if len(set(functions)) == 1 else None
+            for module, functions in zip(modules, zip(*self.classFunctions))
+        ]
+        first = 1
+        while first < len(modules) and allClasses[first]:
+            first += 1
+        last = len(modules) - 1 if first < len(modules) and allClasses[-1] else None
+        self.beforeClassFunctions = allClasses[1:first]
+        self.afterClassFunctions = allClasses[last:] if last else []
+        self.classFunctions = [
+            functions[:1] + functions[first:last] for functions in self.classFunctions
+        ]
+        self.groundWaterFunction = reservoirFunction(
+            reservoir_Ss, self.selectSs, "groundWater_no_reservoir"
+        )
+        self.routingFunction = reservoirFunction(
+            reservoir_Sf, self.selectRout, "noRouting"
+        )
+
         # static maps to use (normally default)
         wflow_subcatch = configget(
             self.config, "model", "wflow_subcatch", "staticmaps/wflow_subcatch.map"
@@ -648,6 +730,9 @@ class WflowModel(pcraster.framework.DynamicModel):
         self.percent = []
         for i in self.Classes:
             self.percent.append(pcr.readmap(os.path.join(self.Dir, wflow_percent[i])))
+        # (classes x rows x cols) array of the percentages, used by classTotal
+        self.percentStack = ClassStack(self.percent).array
+        self.percentTotal = self.classTotal([1.0] * len(self.Classes))
 
         self.wf_updateparameters()
         # MODEL PARAMETERS - VALUES PER CLASS
@@ -1056,6 +1141,8 @@ class WflowModel(pcraster.framework.DynamicModel):
         self.upsize = pcr.catchmenttotal(self.xl * self.yl, self.TopoLdd)
         self.csize = pcr.areamaximum(self.upsize, self.TopoId)
 
+        self.Router = kinematicRouter(self.RoutingEngine, self.TopoLdd)
+
         self.SaveDir = os.path.join(self.Dir, self.runId)
         self.logger.info("Starting Dynamic run...")
 
@@ -1193,6 +1280,14 @@ class WflowModel(pcraster.framework.DynamicModel):
                 os.path.join(self.Dir, "instate", "WaterLevel.map")
             )
 
+        # the states of all classes are kept in (classes x rows x cols) arrays
+        self.Si = ClassStack(self.Si)
+        self.Sw = ClassStack(self.Sw)
+        self.Su = ClassStack(self.Su)
+        self.Sa = ClassStack(self.Sa)
+        self.Sf = ClassStack(self.Sf)
+        self.Sfa = ClassStack(self.Sfa)
+
         P = self.Bw + (2.0 * self.WaterLevel)
         self.Alpha = self.AlpTerm * pow(P, self.AlpPow)
 
@@ -1203,29 +1298,29 @@ class WflowModel(pcraster.framework.DynamicModel):
         self.KinWaveVolume = self.WaterLevel * self.Bw * self.DCL
         self.OldKinWaveVolume = self.KinWaveVolume
 
-        self.wbSi_ = [self.ZeroMap] * len(self.Classes)
-        self.wbSu_ = [self.ZeroMap] * len(self.Classes)
-        self.wbSa_ = [self.ZeroMap] * len(self.Classes)
-        self.wbSw_ = [self.ZeroMap] * len(self.Classes)
-        self.wbSf_ = [self.ZeroMap] * len(self.Classes)
-        self.wbSfa_ = [self.ZeroMap] * len(self.Classes)
+        self.wbSi_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.wbSu_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.wbSa_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.wbSw_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.wbSf_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.wbSfa_ = ClassStack([self.ZeroMap] * len(self.Classes))
         self.wbSfrout = self.ZeroMap
         self.wbSs = self.ZeroMap
 
-        self.Ei_ = [self.ZeroMap] * len(self.Classes)
-        self.Pe_ = [self.ZeroMap] * len(self.Classes)
-        self.Si_ = [self.ZeroMap] * len(self.Classes)
-        self.Eu_ = [self.ZeroMap] * len(self.Classes)
-        self.Ea_ = [self.ZeroMap] * len(self.Classes)
-        self.Ew_ = [self.ZeroMap] * len(self.Classes)
-        self.Qu_ = [self.ZeroMap] * len(self.Classes)
-        self.Qw_ = [self.ZeroMap] * len(self.Classes)
-        self.Qa_ = [self.ZeroMap] * len(self.Classes)
-        self.Cap_ = [self.ZeroMap] * len(self.Classes)
-        self.Perc_ = [self.ZeroMap] * len(self.Classes)
-        self.Fa_ = [self.ZeroMap] * len(self.Classes)
-        self.Qf_ = [self.ZeroMap] * len(self.Classes)
-        self.Qfa_ = [self.ZeroMap] * len(self.Classes)
+        self.Ei_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Pe_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Si_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Eu_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Ea_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Ew_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Qu_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Qw_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Qa_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Cap_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Perc_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Fa_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Qf_ = ClassStack([self.ZeroMap] * len(self.Classes))
+        self.Qfa_ = ClassStack([self.ZeroMap] * len(self.Classes))
         self.Qs_ = self.ZeroMap  # for combined gw reservoir
         self.Qflag_ = [self.ZeroMap] * len(self.Classes)
         self.Qfcub_ = [self.ZeroMap] * len(self.Classes)
@@ -1249,6 +1344,20 @@ class WflowModel(pcraster.framework.DynamicModel):
       """
         return ["self.Altitude"]
 
+    def classTotal(self, maps):
+        """
+        Sum of the maps (or values) of all classes weighted with the percentage of
+        each class, maps is a ClassStack or a list with a map for each class
+        """
+        if isinstance(maps, ClassStack):
+            stack = maps.array
+        else:
+            stack = np.stack([mapArray(m) for m in maps])
+        total = (stack * self.percentStack).sum(axis=0)
+        return pcr.numpy2pcr(
+            pcr.Scalar, np.where(np.isnan(total), -999.0, total), -999.0
+        )
+
     def dynamic(self):
         """
         *Required*
@@ -1266,18 +1375,16 @@ class WflowModel(pcraster.framework.DynamicModel):
         # if self.thestep == 26:
         # 		pdb.set_trace()
 
-        self.Si_t = copylist(self.Si)
-        self.Sw_t = copylist(self.Sw)
-        self.Su_t = copylist(self.Su)
-        self.Sa_t = copylist(self.Sa)
-        self.Sf_t = copylist(self.Sf)
-        self.Sfa_t = copylist(self.Sfa)
+        self.Si_t = self.Si.copy()
+        self.Sw_t = self.Sw.copy()
+        self.Su_t = self.Su.copy()
+        self.Sa_t = self.Sa.copy()
+        self.Sf_t = self.Sf.copy()
+        self.Sfa_t = self.Sfa.copy()
         self.Ss_t = self.Ss
-        self.trackQ_t = copylist(self.trackQ)  # copylist(self.trackQ)
-        self.convQu_t = [
-            copylist(self.convQu[i]) for i in self.Classes
-        ]  # copylist(self.convQu)
-        self.convQa_t = [copylist(self.convQa[i]) for i in self.Classes]
+        self.trackQ_t = list(self.trackQ)
+        self.convQu_t = [list(self.convQu[i]) for i in self.Classes]
+        self.convQa_t = [list(self.convQa[i]) for i in self.Classes]
 
         if self.IRURFR_L:
             self.PotEvaporation = pcr.areatotal(
@@ -1307,68 +1414,25 @@ class WflowModel(pcraster.framework.DynamicModel):
         # if self.thestep >= 45:
         # pdb.set_trace()
 
+        # snow, interception, agriculture zone, unsaturated zone, fast runoff and
+        # fast agriculture ditches runoff reservoir, for all classes at once where
+        # possible (see initial) and else per class
+        for function in self.beforeClassFunctions:
+            function(self)
         for k in self.Classes:
-
-            # SNOW =================================================================================================
-            if self.selectSw[k]:
-                eval_str = "reservoir_Sw.{:s}(self, k)".format(self.selectSw[k])
-            else:
-                eval_str = "reservoir_Sw.snow_no_reservoir(self, k)"
-            eval(eval_str)
-
-            # INTERCEPTION =========================================================================================
-            if self.selectSi[k]:
-                eval_str = "reservoir_Si.{:s}(self, k)".format(self.selectSi[k])
-            else:
-                eval_str = "reservoir_Si.interception_no_reservoir(self, k)"
-            eval(eval_str)
-
-            # AGRICULTURE ZONE ======================================================================================
-            if self.selectSa[k]:
-                eval_str = "reservoir_Sa.{:s}(self, k)".format(self.selectSa[k])
-            else:
-                eval_str = "reservoir_Sa.agriZone_no_reservoir(self, k)"
-            eval(eval_str)
-
-            # UNSATURATED ZONE ======================================================================================
-            if self.selectSu[k]:
-                eval_str = "reservoir_Su.{:s}(self, k)".format(self.selectSu[k])
-            else:
-                eval_str = "reservoir_Su.unsatZone_no_reservoir(self, k)"
-            eval(eval_str)
-
-            # FAST RUNOFF RESERVOIR ===================================================================================
-            if self.selectSf[k]:
-                eval_str = "reservoir_Sf.{:s}(self, k)".format(self.selectSf[k])
-            else:
-                eval_str = "reservoir_Sf.fastRunoff_no_reservoir(self, k)"
-            eval(eval_str)
-
-            # FAST AGRICULTURE DITCHES RUNOFF RESERVOIR ===================================================================================
-            if self.selectSfa[k]:
-                eval_str = "reservoir_Sf.{:s}(self, k)".format(self.selectSfa[k])
-            else:
-                eval_str = "reservoir_Sf.fastAgriRunoff_no_reservoir(self, k)"
-            eval(eval_str)
+            for function in self.classFunctions[k]:
+                function(self, k)
+        for function in self.afterClassFunctions:
+            function(self)
 
         # TOTAL RUNOFF =============================================================================================
-        self.Qftotal = sum([x * y for x, y in zip(self.Qf_, self.percent)]) + sum(
-            [x * y for x, y in zip(self.Qfa_, self.percent)]
-        )
+        self.Qftotal = self.classTotal(self.Qf_) + self.classTotal(self.Qfa_)
 
         # SLOW RUNOFF RESERVOIR ===========================================================================
-        if self.selectSs:
-            eval_str = "reservoir_Ss.{:s}(self)".format(self.selectSs)
-        else:
-            eval_str = "reservoir_Ss.groundWater_no_reservoir(self)"
-        eval(eval_str)
+        self.groundWaterFunction(self)
 
         # ROUTING
-        if self.selectRout:
-            eval_str = "reservoir_Sf.{:s}(self)".format(self.selectRout)
-        else:
-            eval_str = "reservoir_Sf.noRouting(self)"
-        eval(eval_str)
+        self.routingFunction(self)
 
         # WATER BALANCE (per reservoir, per cell) ========================================================================================
         self.QtlagWB = (self.Qtlag / self.surfaceArea) * 1000 * self.timestepsecs
@@ -1378,99 +1442,96 @@ class WflowModel(pcraster.framework.DynamicModel):
         self.convQaWB_t = [sum(self.convQa_t[i]) for i in self.Classes]
         self.trackQWB = (sum(self.trackQ) / self.surfaceArea) * 1000
         self.trackQWB_t = (sum(self.trackQ_t) / self.surfaceArea) * 1000
+
+        # totals of all classes, each determined once
+        Ei = self.classTotal(self.Ei_)
+        Eu = self.classTotal(self.Eu_)
+        Ea = self.classTotal(self.Ea_)
+        Ew = self.classTotal(self.Ew_)
+        Si = self.classTotal(self.Si)
+        Si_t = self.classTotal(self.Si_t)
+        Su = self.classTotal(self.Su)
+        Su_t = self.classTotal(self.Su_t)
+        Sa = self.classTotal(self.Sa)
+        Sa_t = self.classTotal(self.Sa_t)
+        Sf = self.classTotal(self.Sf)
+        Sf_t = self.classTotal(self.Sf_t)
+        Sfa = self.classTotal(self.Sfa)
+        Sfa_t = self.classTotal(self.Sfa_t)
+        Sw = self.classTotal(self.Sw)
+        Sw_t = self.classTotal(self.Sw_t)
+        convQu = self.classTotal(self.convQuWB)
+        convQu_t = self.classTotal(self.convQuWB_t)
+        convQa = self.classTotal(self.convQaWB)
+        convQa_t = self.classTotal(self.convQaWB_t)
+
         self.WB = (
             self.Precipitation
-            - sum(np.multiply(self.Ei_, self.percent))
-            - sum(np.multiply(self.Eu_, self.percent))
+            - Ei
+            - Eu
             - self.QtlagWB
-            - sum(np.multiply(self.Si, self.percent))
-            + sum(np.multiply(self.Si_t, self.percent))
-            - sum(np.multiply(self.Su, self.percent))
-            + sum(np.multiply(self.Su_t, self.percent))
-            - sum(np.multiply(self.Sf, self.percent))
-            + sum(np.multiply(self.Sf_t, self.percent))
-            - sum(np.multiply(self.Ss, self.percent))
-            + sum(np.multiply(self.Ss_t, self.percent))
+            - Si
+            + Si_t
+            - Su
+            + Su_t
+            - Sf
+            + Sf_t
+            - self.Ss * self.percentTotal
+            + self.Ss_t * self.percentTotal
             - self.trackQWB
             + self.trackQWB_t
-            - sum(np.multiply(self.convQuWB, self.percent))
-            + sum(np.multiply(self.convQuWB_t, self.percent))
+            - convQu
+            + convQu_t
         )
 
         #    #fuxes and states in m3/h
         self.P = pcr.areatotal(
             self.PrecipTotal / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
-        self.Ei = pcr.areatotal(
-            sum(np.multiply(self.Ei_, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
-        )
-        self.Ea = pcr.areatotal(
-            sum(np.multiply(self.Ea_, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
-        )
-        self.Eu = pcr.areatotal(
-            sum(np.multiply(self.Eu_, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
-        )
-        self.Ew = pcr.areatotal(
-            sum(np.multiply(self.Ew_, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
-        )
+        self.Ei = pcr.areatotal(Ei / 1000 * self.surfaceArea, pcr.nominal(self.TopoId))
+        self.Ea = pcr.areatotal(Ea / 1000 * self.surfaceArea, pcr.nominal(self.TopoId))
+        self.Eu = pcr.areatotal(Eu / 1000 * self.surfaceArea, pcr.nominal(self.TopoId))
+        self.Ew = pcr.areatotal(Ew / 1000 * self.surfaceArea, pcr.nominal(self.TopoId))
         self.EwiCorr = pcr.areatotal(
-            sum(np.multiply(np.multiply(self.Ew_, self.lamdaS / self.lamda), self.percent))
-            / 1000
-            * self.surfaceArea,
+            Ew * (self.lamdaS / self.lamda) / 1000 * self.surfaceArea,
             pcr.nominal(self.TopoId),
         )
         self.Qtot = self.QLagTot * self.timestepsecs
         self.SiWB = pcr.areatotal(
-            sum(np.multiply(self.Si, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Si / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.Si_WB = pcr.areatotal(
-            sum(np.multiply(self.Si_t, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Si_t / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.SuWB = pcr.areatotal(
-            sum(np.multiply(self.Su, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Su / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.Su_WB = pcr.areatotal(
-            sum(np.multiply(self.Su_t, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Su_t / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.SaWB = pcr.areatotal(
-            sum(np.multiply(self.Sa, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Sa / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.Sa_WB = pcr.areatotal(
-            sum(np.multiply(self.Sa_t, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Sa_t / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.SfWB = pcr.areatotal(
-            sum(np.multiply(self.Sf, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Sf / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.Sf_WB = pcr.areatotal(
-            sum(np.multiply(self.Sf_t, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Sf_t / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.SfaWB = pcr.areatotal(
-            sum(np.multiply(self.Sfa, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Sfa / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.Sfa_WB = pcr.areatotal(
-            sum(np.multiply(self.Sfa_t, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Sfa_t / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.SwWB = pcr.areatotal(
-            sum(np.multiply(self.Sw, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Sw / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.Sw_WB = pcr.areatotal(
-            sum(np.multiply(self.Sw_t, self.percent)) / 1000 * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            Sw_t / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.SsWB = pcr.areatotal(
             self.Ss / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
@@ -1479,28 +1540,16 @@ class WflowModel(pcraster.framework.DynamicModel):
             self.Ss_t / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.convQuWB = pcr.areatotal(
-            sum(np.multiply([sum(self.convQu[i]) for i in self.Classes], self.percent))
-            / 1000
-            * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            convQu / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.convQu_WB = pcr.areatotal(
-            sum(np.multiply([sum(self.convQu_t[i]) for i in self.Classes], self.percent))
-            / 1000
-            * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            convQu_t / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.convQaWB = pcr.areatotal(
-            sum(np.multiply([sum(self.convQa[i]) for i in self.Classes], self.percent))
-            / 1000
-            * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            convQa / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.convQa_WB = pcr.areatotal(
-            sum(np.multiply([sum(self.convQa_t[i]) for i in self.Classes], self.percent))
-            / 1000
-            * self.surfaceArea,
-            pcr.nominal(self.TopoId),
+            convQa_t / 1000 * self.surfaceArea, pcr.nominal(self.TopoId)
         )
         self.trackQWB = pcr.areatotal(sum(self.trackQ), pcr.nominal(self.TopoId))
         self.trackQ_WB = pcr.areatotal(sum(self.trackQ_t), pcr.nominal(self.TopoId))
@@ -1557,11 +1606,7 @@ class WflowModel(pcraster.framework.DynamicModel):
             self.sumprecip + self.Precipitation
         )  # accumulated rainfall for water balance (m/h)
         self.sumevap = (
-            self.sumevap
-            + sum(np.multiply(self.Ei_, self.percent))
-            + sum(np.multiply(self.Eu_, self.percent))
-            + sum(np.multiply(self.Ea_, self.percent))
-            + sum(np.multiply(self.Ew_, self.percent))
+            self.sumevap + Ei + Eu + Ea + Ew
         )  # accumulated evaporation for water balance (m/h)
         try:
             self.sumpotevap = (
@@ -1574,9 +1619,7 @@ class WflowModel(pcraster.framework.DynamicModel):
         )  # accumulated runoff for water balance (m/h)
         self.sumwb = self.sumwb + self.WB
 
-        self.sumE = sum(np.multiply(self.Ei_, self.percent)) + sum(
-            np.multiply(self.Eu_, self.percent)
-        )
+        self.sumE = Ei + Eu
 
         self.QCatchmentMM = self.Qstate * self.QMMConvUp
 
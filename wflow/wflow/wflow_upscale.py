@@ -31,6 +31,11 @@ Usage::
     -M maxcpu
        maximum number of cpu's/cores to use (default = 4)
 
+The resample commands of all directories are run in parallel. Completed
+commands are recorded in wflow_upscale_tasks.json in the new case, an
+interrupted run is resumed by starting it again. With -f this file is removed
+and all maps are resampled again.
+
 The script uses the pcraster resample program to reduce the maps. The original
 river network is used to force the river network in the reduced version of the
 model. Nevertheless it may be needed to manually adjust the locations of
@@ -44,10 +49,11 @@ run the wflow_prepare scripts twice to create the different models.
 
 import getopt
 import glob
+import logging
 import os.path
-import shlex
 
 from wflow.wflow_lib import *
+from wflow.wf_tasks import Task, runTasks
 
 
 def usage(*args):
@@ -58,48 +64,6 @@ def usage(*args):
     sys.exit(0)
 
 
-def runCommands(commands, maxCpu):
-    """
-    Runs a list of processes dividing
-    over maxCpu number of cores.
-    """
-
-    def removeFinishedProcesses(processes):
-        """ given a list of (commandString, process),
-            remove those that have completed and return the result
-        """
-        newProcs = []
-        for pollCmd, pollProc in processes:
-            retCode = pollProc.poll()
-            if retCode == None:
-                # still running
-                newProcs.append((pollCmd, pollProc))
-            elif retCode != 0:
-                # failed
-                raise Exception("Command %s failed" % pollCmd)
-            else:
-                print("Command %s completed successfully" % pollCmd)
-        return newProcs
-
-    processes = []
-    for command in commands:
-        command = command.replace(
-            "\\", "/"
-        )  # otherwise shlex.split removes all path separators
-        proc = subprocess.Popen(shlex.split(command))
-        procTuple = (command, proc)
-        processes.append(procTuple)
-        while len(processes) >= maxCpu:
-            time.sleep(0.2)
-            processes = removeFinishedProcesses(processes)
-
-    # wait for all processes
-    while len(processes) > 0:
-        time.sleep(0.5)
-        processes = removeFinishedProcesses(processes)
-    print("All processes in que (" + str(len(commands)) + ") completed.")
-
-
 def main():
 
     try:
@@ -133,7 +97,8 @@ def main():
 
     dirs = ["/intbl/", "/inmaps/", "/staticmaps/", "/intss/", "/instate/", "/outstate/"]
     ext_to_copy = ["*.tss", "*.tbl", "*.col", "*.xml"]
-    if os.path.isdir(caseNameNew) and not force:
+    statefile = os.path.join(caseNameNew, "wflow_upscale_tasks.json")
+    if os.path.isdir(caseNameNew) and not force and not os.path.exists(statefile):
         print("Refusing to write into an existing directory:" + caseNameNew)
         sys.exit()
 
@@ -143,45 +108,38 @@ def main():
         for inifile in glob.glob(caseName + "/*.ini"):
             shutil.copy(inifile, inifile.replace(caseName, caseNameNew))
 
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    if force and os.path.exists(statefile):
+        # redo all resamples, the source maps may have changed
+        os.remove(statefile)
+    tasks = []
     for ddir in dirs:
-        allcmd = []
-        for mfile in glob.glob(caseName + ddir + "/*.map"):
-            if "_ldd.map" not in mfile:
-                mstr = (
-                    "resample -r "
-                    + str(factor)
-                    + " "
-                    + mfile
-                    + " "
-                    + mfile.replace(caseName, caseNameNew)
-                )
-                # print mstr
-                allcmd.append(mstr)
-            # os.system(mstr)
-        runCommands(allcmd, maxcpu)
-
+        mfiles = [
+            mfile
+            for mfile in glob.glob(caseName + ddir + "/*.map")
+            if "_ldd.map" not in mfile
+        ]
         if inmaps:
-            allcmd = []
             for mfile in glob.glob(caseName + ddir + "/*.[0-9][0-9][0-9]"):
-                mstr = (
-                    "resample -r "
-                    + str(factor)
-                    + " "
-                    + mfile
-                    + " "
-                    + mfile.replace(caseName, caseNameNew)
-                )
                 if not os.path.exists(mfile.replace(caseName, caseNameNew)):
-                    # print mstr
-                    allcmd.append(mstr)
-                    # os.system(mstr)
+                    mfiles.append(mfile)
                 else:
                     print("skipping " + mfile.replace(caseName, caseNameNew))
-            runCommands(allcmd, maxcpu)
+        for mfile in mfiles:
+            mstr = (
+                "resample -r "
+                + str(factor)
+                + " "
+                + mfile
+                + " "
+                + mfile.replace(caseName, caseNameNew)
+            )
+            tasks.append(Task(mfile.replace(caseName, caseNameNew), mstr))
 
         for ext in ext_to_copy:
             for mfile in glob.glob(caseName + ddir + ext):
                 shutil.copy(mfile, mfile.replace(caseName, caseNameNew))
+    runTasks(tasks, maxCpu=maxcpu, statefile=statefile)
 
     # Because the ldd cannot be resampled this way we have to recreate
     # in including the subcatchments that are derived from it
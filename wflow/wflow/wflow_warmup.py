@@ -0,0 +1,156 @@
+#!/usr/bin/python
+
+# Wflow is Free software, see below:
+#
+# Copyright (c) J. Schellekens 2005-2011
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+wflow_warmup -- compile and cache the numba kernels of a wflow model
+
+Usage::
+
+    -C CaseName
+    -c inifile (default = wflow_sbm.ini)
+    -M model (e.g. wflow_sbm, default = modeltype in the model section of the
+       ini file or the name of the ini file)
+    -R runId used for the warm-up run (default = warmup), must not exist and
+       is removed afterwards
+    -T number of timesteps to run (default = 2)
+
+The numba kernels of the models (sbm_cell, kin_wave, set_dd, kinematic_route, ...)
+are compiled with cache=True: the compiled code is stored on disk the first time a
+kernel is used with a given set of argument types and loaded by all later
+processes. wflow_warmup runs the model of a case for a few timesteps so all kernels
+are compiled for the argument types the case actually uses, e.g. before starting
+a calibration or an ensemble. The time used to import wflow, by the initial section
+and by each timestep is reported. If the first timestep is much slower than
+the second the kernels were compiled, otherwise they were loaded from the cache.
+
+The cache is written in the __pycache__ directory next to the wflow source files,
+or in the directory given by the NUMBA_CACHE_DIR environment variable (this must
+then be set for all runs).
+"""
+
+import getopt
+import logging
+import os.path
+import shutil
+import sys
+import time
+
+
+def usage(*args):
+    sys.stdout = sys.stderr
+    for msg in args:
+        print(msg)
+    print(__doc__)
+    sys.exit(0)
+
+
+def warmup(caseName, inifile, model=None, runId="warmup", steps=2, logger=None):
+    """
+    Runs a model for a few timesteps to compile (and cache) its numba kernels
+
+    Input:
+        - caseName - case directory
+        - inifile - name of the ini file in the case
+        - model - name of the model (default: modeltype from the ini file)
+        - runId - runId used for the run, the run directory must not exist and is
+          removed afterwards
+        - steps - number of timesteps to run
+        - logger - logger to use (default: logger of this module)
+
+    Output:
+        - list of (phase, seconds) tuples
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    if os.path.exists(os.path.join(caseName, runId)):
+        raise ValueError("Run directory of the warm-up run exists already: " + runId)
+
+    timing = []
+    start = time.time()
+    # wflow is imported here so the import time can be reported
+    import wflow.wflow_bmi as wfbmi
+
+    timing.append(("import", time.time() - start))
+
+    if model is None:
+        config = wfbmi.iniFileSetUp(os.path.join(caseName, inifile))
+        model, useddef = wfbmi.configget(
+            config, "model", "modeltype", os.path.splitext(inifile)[0]
+        )
+    wf = wfbmi.wflow_model(model)
+
+    cwd = os.getcwd()
+    start = time.time()
+    myModel = wf.WflowModel("wflow_subcatch.map", caseName, runId, inifile)
+    dynModelFw = wf.wf_DynamicFramework(myModel, steps, firstTimestep=1)
+    try:
+        dynModelFw.createRunId(
+            NoOverWrite=False, level=logging.WARNING, doSetupFramework=False
+        )
+        dynModelFw.setupFramework()
+        dynModelFw._runInitial()
+        dynModelFw._runResume()
+        timing.append(("initial", time.time() - start))
+        for step in range(1, steps + 1):
+            start = time.time()
+            dynModelFw._runDynamic(step, step)
+            timing.append(("timestep %d" % step, time.time() - start))
+        dynModelFw._wf_shutdown()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(os.path.join(caseName, runId), ignore_errors=True)
+
+    for phase, seconds in timing:
+        logger.info("%-12s %8.2f seconds" % (phase, seconds))
+    return timing
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hC:c:M:R:T:")
+    except getopt.error as msg:
+        usage(msg)
+
+    caseName = "thecase"
+    inifile = "wflow_sbm.ini"
+    model = None
+    runId = "warmup"
+    steps = 2
+
+    for o, a in opts:
+        if o == "-C":
+            caseName = a
+        if o == "-c":
+            inifile = a
+        if o == "-M":
+            model = a
+        if o == "-R":
+            runId = a
+        if o == "-T":
+            steps = int(a)
+        if o == "-h":
+            usage()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    warmup(os.path.abspath(caseName), inifile, model=model, runId=runId, steps=steps)
+
+
+if __name__ == "__main__":
+    main()